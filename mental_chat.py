@@ -1,13 +1,41 @@
+import os
+import queue
+import re
+import sys
+import threading
+import time
+
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import PeftConfig, PeftModel
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, abort
+
+# shared metrics/profiling helpers live next to main_api.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ourModels", "VideoAndAudioAnalysis"))
+from service_metrics import install_metrics, model_forward, model_load, track_queue
+from request_profiler import install_profiler, is_admin
 
 app = Flask(__name__)
+install_metrics(app)
+install_profiler(app, paths=("/chat",))
 
 # Define model parameters
 base_model = "mistralai/Mistral-7B-Instruct-v0.2"
-adapter = "GRMenon/mental-health-mistral-7b-instructv0.2-finetuned-V2"
+# LoRA adapters served on top of the one base model: name -> HF id or local dir.
+# More can be loaded/unloaded at runtime through /adapters (X-Admin-Token:
+# $PROFILE_ADMIN_TOKEN), but only from ADAPTER_DIR or ADAPTER_REPO_PREFIXES.
+ADAPTERS = {
+    "mental-health": "GRMenon/mental-health-mistral-7b-instructv0.2-finetuned-V2",
+}
+DEFAULT_ADAPTER = "mental-health"
+ADAPTER_DIR = os.path.realpath(os.getenv("ADAPTER_DIR", "adapters"))
+ADAPTER_REPO_PREFIXES = tuple(p.strip() for p in os.getenv("ADAPTER_REPO_PREFIXES", "GRMenon/").split(",") if p.strip())
+MAX_NEW_TOKENS = 512
+# Requests arriving within BATCH_WAIT_S of each other that target the same
+# adapter are generated together (up to MAX_BATCH_SIZE).
+MAX_BATCH_SIZE = 8
+BATCH_WAIT_S = 0.05
+REQUEST_TIMEOUT_S = 300
 
 # Load tokenizer
 tokenizer = AutoTokenizer.from_pretrained(
@@ -16,44 +44,174 @@ tokenizer = AutoTokenizer.from_pretrained(
     trust_remote_code=True,
     padding_side="left"
 )
+if tokenizer.pad_token is None:
+    tokenizer.pad_token = tokenizer.eos_token
 
-# Create PEFT model using base_model and finetuned adapter
-peft_config = PeftConfig.from_pretrained(adapter)
-# Load the base model without quantization
-model = AutoModelForCausalLM.from_pretrained(
-    peft_config.base_model_name_or_path,
-    device_map="auto",
-    torch_dtype=torch.float16  # or use torch.float32 if your GPU doesn't support FP16
-)
-model = PeftModel.from_pretrained(model, adapter)
+# Load the base model once; every adapter shares its weights
+with model_load("mistral"):
+    model = AutoModelForCausalLM.from_pretrained(
+        base_model,
+        device_map="auto",
+        torch_dtype=torch.float16  # or use torch.float32 if your GPU doesn't support FP16
+    )
+_first, *_rest = ADAPTERS.items()
+with model_load(f"adapter:{_first[0]}"):
+    model = PeftModel.from_pretrained(model, _first[1], adapter_name=_first[0])
+for _name, _path in _rest:
+    with model_load(f"adapter:{_name}"):
+        model.load_adapter(_path, adapter_name=_name)
 
 device = "cuda" if torch.cuda.is_available() else "cpu"
 model.to(device)
 model.eval()
 
+# set_adapter() switches global model state: generation and (un)loading
+# never run concurrently
+model_lock = threading.Lock()
+pending = queue.Queue()
+track_queue("chat", pending.qsize)
+
+
+def check_adapter_source(path):
+    """Raises PermissionError unless `path` is inside ADAPTER_DIR or an allowed HF repo."""
+    if os.path.exists(path):
+        real = os.path.realpath(path)
+        if os.path.commonpath([real, ADAPTER_DIR]) == ADAPTER_DIR:
+            return
+        raise PermissionError(f"local adapters must live in {ADAPTER_DIR}")
+    if re.fullmatch(r"[\w.-]+/[\w.-]+", path) and ".." not in path and path.startswith(ADAPTER_REPO_PREFIXES):
+        return
+    raise PermissionError("adapter source is not allowed (see ADAPTER_DIR / ADAPTER_REPO_PREFIXES)")
+
+
+def check_adapter_base(path):
+    """Raises ValueError if the adapter was trained on a different base model."""
+    adapter_base = PeftConfig.from_pretrained(path).base_model_name_or_path
+    if adapter_base and adapter_base.rstrip("/").split("/")[-1] != base_model.split("/")[-1]:
+        raise ValueError(f"adapter was trained on {adapter_base}, this server runs {base_model}")
+
+
+def generate_batch(adapter, jobs):
+    """Runs one generate() call for jobs that all use the same adapter."""
+    prompts = [
+        tokenizer.apply_chat_template(job["messages"], tokenize=False, add_generation_prompt=True)
+        for job in jobs
+    ]
+    # the chat template already starts with <s>
+    inputs = tokenizer(prompts, return_tensors="pt", padding=True, add_special_tokens=False).to(device)
+    with model_lock:
+        model.set_adapter(adapter)
+        with torch.inference_mode(), model_forward(f"generate:{adapter}"):
+            output_ids = model.generate(
+                **inputs, max_new_tokens=MAX_NEW_TOKENS, do_sample=True, pad_token_id=tokenizer.pad_token_id
+            )
+    return tokenizer.batch_decode(output_ids.detach().cpu().numpy(), skip_special_tokens=True)
+
+
+def batch_worker():
+    while True:
+        jobs = [pending.get()]
+        # collect whatever else arrives in the batching window
+        deadline = time.monotonic() + BATCH_WAIT_S
+        while len(jobs) < MAX_BATCH_SIZE * 4:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                jobs.append(pending.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        by_adapter = {}
+        for job in jobs:
+            by_adapter.setdefault(job["adapter"], []).append(job)
+        for adapter, group in by_adapter.items():
+            for i in range(0, len(group), MAX_BATCH_SIZE):
+                chunk = group[i:i + MAX_BATCH_SIZE]
+                try:
+                    responses = generate_batch(adapter, chunk)
+                    for job, response in zip(chunk, responses):
+                        job["response"] = response
+                except Exception as e:
+                    for job in chunk:
+                        job["error"] = str(e)
+                for job in chunk:
+                    job["done"].set()
+
+
+threading.Thread(target=batch_worker, daemon=True).start()
+
+
 @app.route("/chat", methods=["POST"])
 def chat():
     data = request.get_json()
     user_message = data.get("message", "Hello!")
-    messages = [{"role": "user", "content": user_message}]
-    
-    # Prepare input_ids using the model's chat template
-    input_ids = tokenizer.apply_chat_template(
-        conversation=messages,
-        tokenize=True,
-        add_generation_prompt=True,
-        return_tensors="pt",
-    ).to(device)
-    
-    # Generate response
-    output_ids = model.generate(
-        input_ids=input_ids, max_new_tokens=512, do_sample=True, pad_token_id=2
-    )
-    response = tokenizer.batch_decode(
-        output_ids.detach().cpu().numpy(), skip_special_tokens=True
-    )
-    
-    return jsonify({"response": response[0]})
+    adapter = data.get("adapter", DEFAULT_ADAPTER)
+    if adapter not in model.peft_config:
+        return jsonify({"error": f"unknown adapter '{adapter}'", "adapters": list(model.peft_config)}), 404
+
+    job = {
+        "adapter": adapter,
+        "messages": [{"role": "user", "content": user_message}],
+        "done": threading.Event(),
+    }
+    pending.put(job)
+    if not job["done"].wait(REQUEST_TIMEOUT_S):
+        return jsonify({"error": "generation timed out"}), 504
+    if "error" in job:
+        return jsonify({"error": job["error"]}), 500
+
+    return jsonify({"response": job["response"], "adapter": adapter})
+
+
+@app.route("/adapters", methods=["GET"])
+def list_adapters():
+    return jsonify({"base_model": base_model, "default": DEFAULT_ADAPTER, "adapters": list(model.peft_config)})
+
+
+@app.route("/adapters", methods=["POST"])
+def load_adapter():
+    """Hot-loads an adapter (admin only): {"name": "...", "path": "<HF id or local dir>"}."""
+    if not is_admin():
+        abort(403)
+    data = request.get_json() or {}
+    name, path = data.get("name"), data.get("path")
+    if not name or not path:
+        return jsonify({"error": "name and path are required"}), 400
+    if name in model.peft_config:
+        return jsonify({"error": f"adapter '{name}' is already loaded"}), 409
+    try:
+        check_adapter_source(path)
+        check_adapter_base(path)
+        with model_lock, model_load(f"adapter:{name}"):
+            model.load_adapter(path, adapter_name=name)
+            model.to(device)
+    except PermissionError as e:
+        return jsonify({"error": str(e)}), 403
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": f"failed to load adapter: {e}"}), 500
+    print(f"🔌 Loaded adapter {name} from {path}")
+    return jsonify({"loaded": name, "adapters": list(model.peft_config)}), 201
+
+
+@app.route("/adapters/<name>", methods=["DELETE"])
+def unload_adapter(name):
+    if not is_admin():
+        abort(403)
+    if name not in model.peft_config:
+        return jsonify({"error": f"unknown adapter '{name}'"}), 404
+    if name == DEFAULT_ADAPTER:
+        return jsonify({"error": "the default adapter cannot be unloaded"}), 400
+    with model_lock:
+        model.set_adapter(DEFAULT_ADAPTER)
+        model.delete_adapter(name)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    print(f"🔌 Unloaded adapter {name}")
+    return jsonify({"unloaded": name, "adapters": list(model.peft_config)})
+
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=5000, threaded=True)
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+"""
+bench_training.py — CPU-sized throughput benchmark for the training data pipelines.
+
+Runs a few optimizer steps of each batching layout used by train_lora.py /
+fineTuner.py on a tiny random-init causal LM and a sample of the JSONL data,
+and reports per pipeline:
+  - tokens/sec (real tokens) and padded tokens/sec
+  - padding ratio
+  - data-loader stall time (waiting for the next batch)
+  - per-step breakdown: data / forward / backward / optimizer
+  - peak RSS (each pipeline runs in its own process)
+Optionally writes a torch profiler trace per pipeline.
+
+Pipelines:
+  padded    train_lora.py with PACKING=False (padding="max_length")
+  packed    train_lora.py with PACKING=True  (data_pipeline.pack_sequences)
+  bucketed  fineTuner.py (TokenBudgetBatchSampler + pad-to-longest collator)
+
+Usage:
+    python bench_training.py                       # all pipelines, tiny model, 256 samples
+    python bench_training.py --pipelines packed --steps 50 --profile ./traces
+    python bench_training.py --json bench.json --baseline bench_baseline.json
+"""
+
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import resource
+import sys
+import time
+
+PIPELINES = ("padded", "packed", "bucketed")
+
+
+# -----------------------------
+# Data + tiny model
+# -----------------------------
+def sample_records(path, n, seed):
+    """Reservoir-samples n JSONL records without loading the file."""
+    rng = random.Random(seed)
+    sample = []
+    with open(path) as f:
+        for i, line in enumerate(f):
+            if not line.strip():
+                continue
+            if len(sample) < n:
+                sample.append(json.loads(line))
+            else:
+                j = rng.randint(0, i)
+                if j < n:
+                    sample[j] = json.loads(line)
+    return sample
+
+
+def build_tiny_tokenizer(texts, vocab_size):
+    """Byte-level BPE trained on the sample itself, so no download is needed."""
+    from tokenizers import ByteLevelBPETokenizer
+    from transformers import PreTrainedTokenizerFast
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(texts, vocab_size=vocab_size, special_tokens=["<s>", "</s>", "<pad>"])
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=bpe._tokenizer, bos_token="<s>", eos_token="</s>")
+    tokenizer.pad_token = tokenizer.eos_token  # as in train_lora.py / fineTuner.py
+    return tokenizer
+
+
+def build_model(args, vocab_size):
+    import torch
+    from transformers import AutoModelForCausalLM, LlamaConfig, LlamaForCausalLM
+
+    torch.manual_seed(args.seed)
+    if args.model == "tiny":
+        config = LlamaConfig(
+            vocab_size=vocab_size,
+            hidden_size=args.hidden_size,
+            intermediate_size=args.hidden_size * 2,
+            num_hidden_layers=args.layers,
+            num_attention_heads=4,
+            num_key_value_heads=4,
+            max_position_embeddings=max(1024, args.max_length * 2),
+        )
+        model = LlamaForCausalLM(config)
+    else:
+        model = AutoModelForCausalLM.from_pretrained(args.model, torch_dtype=torch.float32)
+
+    if args.lora:
+        from peft import LoraConfig, get_peft_model
+
+        model = get_peft_model(model, LoraConfig(
+            r=16, lora_alpha=32, target_modules=["q_proj", "v_proj"],
+            lora_dropout=0.05, bias="none", task_type="CAUSAL_LM",
+        ))
+    return model
+
+
+def build_loader(pipeline, texts, tokenizer, args):
+    """Returns (dataloader, description) for one batching layout."""
+    from datasets import Dataset
+    from torch.utils.data import DataLoader
+    from transformers import DataCollatorForLanguageModeling, DataCollatorForSeq2Seq, default_data_collator
+
+    from data_pipeline import TokenBudgetBatchSampler, pack_sequences
+
+    ds = Dataset.from_dict({"text": texts})
+    if pipeline == "padded":
+        ds = ds.map(lambda b: tokenizer(b["text"], truncation=True, padding="max_length",
+                                        max_length=args.max_length),
+                    batched=True, remove_columns=["text"])
+        collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+        return DataLoader(ds, batch_size=args.batch_size, shuffle=True, collate_fn=collator,
+                          num_workers=args.workers), f"batch={args.batch_size}"
+
+    if pipeline == "packed":
+        ds = ds.map(lambda b: tokenizer(b["text"]), batched=True, remove_columns=["text"])
+        ds = ds.map(pack_sequences, batched=True, batch_size=1000, remove_columns=ds.column_names,
+                    fn_kwargs={"max_length": args.max_length, "eos_token_id": tokenizer.eos_token_id})
+        return DataLoader(ds, batch_size=args.batch_size, shuffle=True, collate_fn=default_data_collator,
+                          num_workers=args.workers), f"batch={args.batch_size}"
+
+    if pipeline == "bucketed":
+        def tokenize(b):
+            out = tokenizer(b["text"], truncation=True, max_length=args.max_length)
+            out["labels"] = [ids.copy() for ids in out["input_ids"]]
+            return out
+
+        ds = ds.map(tokenize, batched=True, remove_columns=["text"])
+        lengths = [len(x) for x in ds["input_ids"]]
+        sampler = TokenBudgetBatchSampler(lengths, args.token_budget, seed=args.seed)
+        collator = DataCollatorForSeq2Seq(tokenizer, padding="longest", pad_to_multiple_of=8)
+        return DataLoader(ds, batch_sampler=sampler, collate_fn=collator,
+                          num_workers=args.workers), f"token_budget={args.token_budget}"
+
+    raise ValueError(f"Unknown pipeline: {pipeline}")
+
+
+# -----------------------------
+# One pipeline (runs in its own process)
+# -----------------------------
+def run_pipeline(pipeline, args, texts):
+    import torch
+
+    torch.set_num_threads(args.threads)
+    tokenizer = build_tiny_tokenizer(texts, args.vocab_size) if args.tokenizer == "tiny" else None
+    if tokenizer is None:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(args.tokenizer, use_fast=True)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+
+    t0 = time.perf_counter()
+    loader, desc = build_loader(pipeline, texts, tokenizer, args)
+    prep_s = time.perf_counter() - t0
+
+    model = build_model(args, len(tokenizer))
+    model.train()
+    optimizer = torch.optim.AdamW([p for p in model.parameters() if p.requires_grad], lr=1e-4)
+
+    profiler = None
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        profiler = torch.profiler.profile(
+            activities=[torch.profiler.ProfilerActivity.CPU],
+            schedule=torch.profiler.schedule(wait=1, warmup=1, active=3, repeat=1),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(args.profile, worker_name=pipeline),
+            record_shapes=True,
+        )
+        profiler.start()
+
+    timings = {"data": [], "forward": [], "backward": [], "optimizer": [], "step": []}
+    real_tokens = padded_tokens = 0
+    step = 0
+    it = iter(loader)
+    while step < args.warmup + args.steps:
+        t_start = time.perf_counter()
+        try:
+            batch = next(it)
+        except StopIteration:
+            it = iter(loader)
+            batch = next(it)
+        t_data = time.perf_counter()
+
+        loss = model(**batch).loss
+        t_fwd = time.perf_counter()
+        loss.backward()
+        t_bwd = time.perf_counter()
+        optimizer.step()
+        optimizer.zero_grad(set_to_none=True)
+        t_opt = time.perf_counter()
+        if profiler is not None:
+            profiler.step()
+
+        if step >= args.warmup:
+            timings["data"].append(t_data - t_start)
+            timings["forward"].append(t_fwd - t_data)
+            timings["backward"].append(t_bwd - t_fwd)
+            timings["optimizer"].append(t_opt - t_bwd)
+            timings["step"].append(t_opt - t_start)
+            ids = batch["input_ids"]
+            padded_tokens += ids.numel()
+            mask = batch.get("attention_mask")
+            real_tokens += int(mask.sum()) if mask is not None else ids.numel()
+        step += 1
+
+    if profiler is not None:
+        profiler.stop()
+
+    total = sum(timings["step"])
+    mean_ms = {k: round(1000 * sum(v) / len(v), 2) for k, v in timings.items()}
+    return {
+        "pipeline": pipeline,
+        "batching": desc,
+        "steps": args.steps,
+        "prep_seconds": round(prep_s, 3),
+        "tokens_per_sec": round(real_tokens / total, 1),
+        "padded_tokens_per_sec": round(padded_tokens / total, 1),
+        "padding_ratio": round(1 - real_tokens / max(1, padded_tokens), 4),
+        "dataloader_stall_seconds": round(sum(timings["data"]), 4),
+        "step_ms": mean_ms,
+        # ru_maxrss is KiB on Linux, bytes on macOS
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                             / (1024 * 1024 if sys.platform == "darwin" else 1024), 1),
+    }
+
+
+def _worker(pipeline, args, texts, queue):
+    try:
+        queue.put(run_pipeline(pipeline, args, texts))
+    except Exception as e:
+        queue.put({"pipeline": pipeline, "error": repr(e)})
+
+
+# -----------------------------
+# Reporting
+# -----------------------------
+def compare(results, baseline, tolerance):
+    """Returns a list of regressions: tokens/sec drops or padding ratio rises beyond tolerance."""
+    problems = []
+    base = {r["pipeline"]: r for r in baseline.get("results", [])}
+    for r in results:
+        b = base.get(r["pipeline"])
+        if not b or "error" in r or "error" in b:
+            continue
+        if r["tokens_per_sec"] < b["tokens_per_sec"] * (1 - tolerance):
+            problems.append(f"{r['pipeline']}: tokens/sec {r['tokens_per_sec']} < baseline {b['tokens_per_sec']}")
+        if r["padding_ratio"] > b["padding_ratio"] + tolerance * max(b["padding_ratio"], 0.01):
+            problems.append(f"{r['pipeline']}: padding ratio {r['padding_ratio']} > baseline {b['padding_ratio']}")
+    return problems
+
+
+def print_table(results):
+    print(f"\n{'pipeline':<10} {'tok/s':>9} {'padded tok/s':>13} {'pad %':>7} {'stall s':>8} "
+          f"{'data/fwd/bwd/opt ms':>24} {'RSS MB':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['pipeline']:<10} ERROR {r['error']}")
+            continue
+        ms = r["step_ms"]
+        breakdown = f"{ms['data']}/{ms['forward']}/{ms['backward']}/{ms['optimizer']}"
+        print(f"{r['pipeline']:<10} {r['tokens_per_sec']:>9} {r['padded_tokens_per_sec']:>13} "
+              f"{100 * r['padding_ratio']:>6.1f}% {r['dataloader_stall_seconds']:>8} {breakdown:>24} "
+              f"{r['peak_rss_mb']:>8}")
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="CPU training-pipeline benchmark")
+    here = os.path.dirname(os.path.abspath(__file__))
+    default_data = os.path.join(here, "train.jsonl")
+    if not os.path.exists(default_data):
+        default_data = os.path.join(here, "val.jsonl")
+    p.add_argument("--data", default=default_data, help="JSONL to sample from")
+    p.add_argument("--samples", type=int, default=256)
+    p.add_argument("--pipelines", nargs="+", default=list(PIPELINES), choices=PIPELINES)
+    p.add_argument("--model", default="tiny", help='"tiny" (random-init Llama) or an HF id/path')
+    p.add_argument("--tokenizer", default="tiny", help='"tiny" (BPE trained on the sample) or an HF id/path')
+    p.add_argument("--vocab-size", type=int, default=4096)
+    p.add_argument("--hidden-size", type=int, default=128)
+    p.add_argument("--layers", type=int, default=2)
+    p.add_argument("--lora", action="store_true", help="wrap the model with the train_lora.py LoRA config")
+    p.add_argument("--max-length", type=int, default=512)
+    p.add_argument("--batch-size", type=int, default=2)
+    p.add_argument("--token-budget", type=int, default=4096)
+    p.add_argument("--steps", type=int, default=20)
+    p.add_argument("--warmup", type=int, default=2)
+    p.add_argument("--workers", type=int, default=0, help="DataLoader workers")
+    p.add_argument("--threads", type=int, default=max(1, (os.cpu_count() or 2) // 2))
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--profile", help="directory for torch profiler traces")
+    p.add_argument("--json", help="write results to this file")
+    p.add_argument("--baseline", help="results JSON to compare against")
+    p.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from data_pipeline import record_to_text
+
+    print(f"📥 Sampling {args.samples} records from {args.data}")
+    texts = [t for t in map(record_to_text, sample_records(args.data, args.samples, args.seed)) if t]
+
+    # one process per pipeline, so peak RSS and allocator state are not shared
+    ctx = mp.get_context("spawn")
+    results = []
+    for pipeline in args.pipelines:
+        print(f"🚀 {pipeline} ...")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_worker, args=(pipeline, args, texts, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    print_table(results)
+    report = {"args": vars(args), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print("💾 Results written to", args.json)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f), args.tolerance)
+        for msg in problems:
+            print("❌ Regression:", msg)
+        if problems:
+            sys.exit(1)
+        print("✅ No regressions against", args.baseline)
+    if any("error" in r for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,435 @@
+"""
+data_pipeline.py — shared data helpers for train_lora.py / fineTuner.py.
+
+Sequence packing
+----------------
+pack_sequences() concatenates tokenized examples (EOS-separated) into full
+MAX_LENGTH blocks instead of padding every example to MAX_LENGTH:
+
+- position_ids restart at 0 for every example inside a block
+- no attention_mask is emitted: transformers >= 4.53 detects the restarts in
+  position_ids and builds a block-diagonal causal mask (sdpa/eager), and
+  flash-attention uses them as varlen boundaries. Older versions ignore the
+  restarts and let packed examples attend to each other, so
+  check_packing_support() refuses to train packed blocks on them
+- the first token of each example gets label -100, so the model is not trained
+  to predict it from the previous example's EOS
+
+Tokenized dataset cache
+-----------------------
+load_or_build_tokenized() stores the fully preprocessed DatasetDict (usually
+built with tokenize_splits()) as Arrow shards under tokenized_cache/<fingerprint>/
+and memory-maps it on later runs.
+The fingerprint covers the tokenizer (vocab/merges/special tokens), the
+preprocessing function's source (i.e. the prompt template), MAX_LENGTH and
+the sha256 of every source file, so any change rebuilds automatically.
+
+Streaming ingestion
+-------------------
+stream_tokenized() reads a JSONL lazily (datasets streaming), shuffles through
+a bounded buffer, normalizes each record with record_to_text() and tokenizes
+(and optionally packs) on the fly, so memory stays flat however big the corpus
+is. StreamStateCallback saves the stream position next to every checkpoint and
+restore_stream_state() resumes from it without replaying consumed data.
+
+Length bucketing
+----------------
+TokenBudgetBatchSampler groups examples of similar length and sizes each batch
+by a token budget (longest x count) rather than a fixed example count;
+TokenBudgetTrainer plugs it into the HF Trainer. Combined with a collator that
+pads to the longest member (DataCollatorForSeq2Seq(padding="longest")), almost
+no compute is spent on padding.
+"""
+
+import hashlib
+import importlib.metadata
+import inspect
+import json
+import os
+import random
+import shutil
+from pathlib import Path
+
+from datasets import load_dataset, load_from_disk
+from packaging.version import Version
+from torch.utils.data import DataLoader
+from transformers import Trainer, TrainerCallback
+
+IGNORE_INDEX = -100
+CACHE_ROOT = "./tokenized_cache"
+NUM_PROC = max(1, min(8, (os.cpu_count() or 1) - 1))
+SHUFFLE_BUFFER = 10_000
+STREAM_STATE_FILE = "stream_state.json"
+# first transformers release that builds a per-example mask from position_ids
+PACKING_MIN_TRANSFORMERS = "4.53"
+
+
+def record_to_text(example):
+    """
+    One JSONL record -> training text. Handles our prompt/completion(/meta)
+    schema and the common fallbacks: instruction/response, input/output, text.
+    """
+    # Our JSONL schema: prompt already ends with "ASSISTANT:", completion follows
+    if example.get("prompt"):
+        return f"{example['prompt']}{example.get('completion') or ''}"
+
+    # Try instruction/response, then input/output
+    instr = example.get("instruction")
+    resp = example.get("response")
+    if instr is None:
+        instr = example.get("input")
+    if resp is None:
+        resp = example.get("output")
+
+    # fallback single text field
+    if instr is None or instr == "":
+        instr = example.get("text")
+
+    # Normalize lists -> strings (if any entries are lists)
+    if isinstance(instr, list):
+        instr = " ".join(map(str, instr))
+    if isinstance(resp, list):
+        resp = " ".join(map(str, resp))
+
+    # Coerce to strings safely
+    instr = "" if instr is None else str(instr).strip()
+    resp = "" if resp is None else str(resp).strip()
+
+    # Build final prompt. If there's a response present, include it so model learns mapping.
+    if instr and resp:
+        return f"User: {instr}\nAssistant: {resp}"
+    if instr:
+        return f"User: {instr}\nAssistant:"
+    if resp:
+        return f"Assistant: {resp}"
+    return ""
+
+
+def pack_sequences(batch, max_length, eos_token_id):
+    """
+    batch: {"input_ids": [[...], ...]} (unpadded, untruncated)
+    returns {"input_ids", "position_ids", "labels"} with every row exactly
+    max_length tokens. Examples longer than a block continue in the next one;
+    the incomplete tail of each map batch is dropped (as in HF run_clm).
+    """
+    ids, positions, labels = [], [], []
+    for seq in batch["input_ids"]:
+        if not seq:
+            continue
+        if seq[-1] != eos_token_id:
+            seq = seq + [eos_token_id]
+        ids.extend(seq)
+        positions.extend(range(len(seq)))
+        labels.append(IGNORE_INDEX)
+        labels.extend(seq[1:])
+
+    usable = (len(ids) // max_length) * max_length
+    out = {"input_ids": [], "position_ids": [], "labels": []}
+    for start in range(0, usable, max_length):
+        end = start + max_length
+        out["input_ids"].append(ids[start:end])
+        out["position_ids"].append(positions[start:end])
+        out["labels"].append(labels[start:end])
+    return out
+
+
+def check_packing_support():
+    """Raises unless the installed transformers keeps packed examples apart."""
+    installed = importlib.metadata.version("transformers")
+    if Version(installed) < Version(PACKING_MIN_TRANSFORMERS):
+        raise RuntimeError(
+            f"transformers {installed} would let packed examples attend to each other; "
+            f"install transformers>={PACKING_MIN_TRANSFORMERS} or set PACKING = False"
+        )
+
+
+def packing_report(packed, max_length, name="train"):
+    """
+    Prints how much of each batch is real tokens with padding vs packing.
+    packed: output of pack_sequences. Example lengths are recovered from the
+    position_ids restarts, so a dataset loaded from the cache works too.
+    """
+    lengths = []
+    for row in packed["position_ids"]:
+        for pos in row:
+            if pos == 0 or not lengths:
+                lengths.append(0)
+            lengths[-1] += 1
+    n_examples = len(lengths)
+    real_tokens = sum(min(n, max_length) for n in lengths)
+    padded_util = real_tokens / max(1, n_examples * max_length)
+    n_blocks = len(packed)
+    packed_tokens = n_blocks * max_length
+    print(f"📦 Packing [{name}]: {n_examples} examples -> {n_blocks} blocks of {max_length} tokens")
+    print(f"   padded batches:  {padded_util:.1%} real tokens")
+    print(f"   packed batches:  100.0% real tokens ({packed_tokens} tokens)")
+    print(f"   ≈ {1 / max(padded_util, 1e-9):.1f}x more training tokens per step")
+    return {
+        "examples": n_examples,
+        "blocks": n_blocks,
+        "padded_utilization": padded_util,
+        "speedup": 1 / max(padded_util, 1e-9),
+    }
+
+
+def has_valid_input_ids(example):
+    """Filter for samples that somehow ended up empty after preprocessing."""
+    ids = example.get("input_ids", None)
+    return ids is not None and isinstance(ids, list) and len(ids) > 0
+
+
+def tokenize_splits(dataset, tokenize_fn, num_proc, pack_max_length=None, eos_token_id=None):
+    """
+    Raw JSONL DatasetDict -> tokenized (and packed) splits. tokenize_fn is a
+    batched map function; any subset of splits works (streaming mode only
+    caches "validation").
+    """
+    print("🔤 Tokenizing dataset (batched)...")
+    # remove original columns to avoid collisions later
+    orig_columns = next(iter(dataset.values())).column_names
+    tokenized = dataset.map(tokenize_fn, batched=True, num_proc=num_proc, remove_columns=orig_columns)
+    for split, ds in tokenized.items():
+        print(f"✅ Tokenization done [{split}]. Columns now:", ds.column_names)
+
+    for split in tokenized:
+        tokenized[split] = tokenized[split].filter(has_valid_input_ids, num_proc=num_proc)
+
+    if pack_max_length:
+        print("📦 Packing examples into", pack_max_length, "token blocks...")
+        tokenized = tokenized.map(
+            pack_sequences,
+            batched=True,
+            batch_size=1000,
+            num_proc=num_proc,
+            remove_columns=next(iter(tokenized.values())).column_names,
+            fn_kwargs={"max_length": pack_max_length, "eos_token_id": eos_token_id},
+        )
+    return tokenized
+
+
+# ---------------------------
+# Tokenized dataset cache
+# ---------------------------
+def file_sha256(path, chunk_size=1 << 20):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tokenizer_fingerprint(tokenizer):
+    """Hash of everything about the tokenizer that changes token ids."""
+    h = hashlib.sha256()
+    h.update(type(tokenizer).__name__.encode())
+    backend = getattr(tokenizer, "backend_tokenizer", None)
+    if backend is not None:
+        h.update(backend.to_str().encode())  # fast tokenizer: full vocab/merges/normalizer
+    else:
+        h.update(json.dumps(tokenizer.get_vocab(), sort_keys=True).encode())
+    h.update(json.dumps(tokenizer.special_tokens_map, sort_keys=True, default=str).encode())
+    h.update(str((tokenizer.padding_side, tokenizer.truncation_side,
+                  getattr(tokenizer, "add_bos_token", None), getattr(tokenizer, "add_eos_token", None))).encode())
+    return h.hexdigest()
+
+
+def dataset_fingerprint(data_files, tokenizer, source_fns, max_length, extra=None):
+    sources = "".join(inspect.getsource(fn) for fn in source_fns)
+    payload = {
+        "tokenizer": tokenizer_fingerprint(tokenizer),
+        "preprocess": hashlib.sha256(sources.encode()).hexdigest(),
+        "max_length": max_length,
+        "files": {split: file_sha256(path) for split, path in sorted(data_files.items())},
+        "extra": extra or {},
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+
+def load_or_build_tokenized(data_files, tokenizer, preprocess_fn, max_length, extra=None,
+                            helper_fns=(), cache_root=CACHE_ROOT, num_proc=NUM_PROC):
+    """
+    Returns the preprocessed DatasetDict for data_files, memory-mapped from
+    the cache when its fingerprint matches; otherwise loads the JSONL, runs
+    preprocess_fn(raw_dataset_dict, num_proc) once and saves the result.
+
+    preprocess_fn must do all tokenization/packing and return a DatasetDict.
+    Its source, and that of helper_fns (e.g. the prompt builder), is part of
+    the fingerprint, so edit them freely.
+    """
+    fingerprint = dataset_fingerprint(data_files, tokenizer, (preprocess_fn, *helper_fns), max_length, extra)
+    path = Path(cache_root) / fingerprint
+    if (path / "dataset_dict.json").exists():
+        print(f"⚡ Using tokenized cache {path}")
+        return load_from_disk(str(path))  # Arrow files are memory-mapped, not loaded
+
+    print(f"🔤 No tokenized cache for {fingerprint}; building with {num_proc} processes...")
+    raw = load_dataset("json", data_files=data_files)
+    tokenized = preprocess_fn(raw, num_proc)
+
+    # save to a temp dir and rename, so an interrupted build is never reused
+    tmp = Path(cache_root) / f".{fingerprint}.tmp"
+    shutil.rmtree(tmp, ignore_errors=True)
+    tokenized.save_to_disk(str(tmp), num_proc=num_proc)
+    if (path / "dataset_dict.json").exists():
+        # another run finished the same build meanwhile; keep its copy
+        shutil.rmtree(tmp, ignore_errors=True)
+        return load_from_disk(str(path))
+    # a directory without dataset_dict.json is a partial save; os.replace can't overwrite it
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    print(f"💾 Tokenized cache saved to {path}")
+    return load_from_disk(str(path))
+
+
+# ---------------------------
+# Streaming ingestion
+# ---------------------------
+def stream_jsonl(path, shuffle_buffer=SHUFFLE_BUFFER, seed=42):
+    """Lazy IterableDataset over a JSONL file, shuffled through a bounded buffer."""
+    ds = load_dataset("json", data_files=path, split="train", streaming=True)
+    if shuffle_buffer:
+        ds = ds.shuffle(seed=seed, buffer_size=shuffle_buffer)
+    return ds
+
+
+def stream_tokenized(path, tokenize_fn, shuffle_buffer=SHUFFLE_BUFFER, seed=42,
+                     pack_max_length=None, eos_token_id=None):
+    """
+    Streaming counterpart of the cached pipeline: tokenize_fn (a batched
+    map function, e.g. train_lora.build_prompts_and_tokenize) runs on the fly,
+    followed by pack_sequences when pack_max_length is set.
+    """
+    raw = stream_jsonl(path, shuffle_buffer=shuffle_buffer, seed=seed)
+    # JSON streaming has no schema up front; read the column names off row one
+    columns = list(next(iter(load_dataset("json", data_files=path, split="train", streaming=True))).keys())
+    ds = raw.map(tokenize_fn, batched=True, remove_columns=columns)
+    if pack_max_length:
+        ds = ds.map(
+            pack_sequences,
+            batched=True,
+            batch_size=1000,
+            remove_columns=["input_ids", "attention_mask"],
+            fn_kwargs={"max_length": pack_max_length, "eos_token_id": eos_token_id},
+        )
+    return ds
+
+
+class StreamStateCallback(TrainerCallback):
+    """
+    Writes the streaming dataset's position into each checkpoint folder.
+    The position is taken in the main process, so with dataloader workers the
+    few prefetched batches may be seen again after a resume.
+    """
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+
+    def on_save(self, args, state, control, **kwargs):
+        ckpt = os.path.join(args.output_dir, f"checkpoint-{state.global_step}")
+        os.makedirs(ckpt, exist_ok=True)
+        with open(os.path.join(ckpt, STREAM_STATE_FILE), "w") as f:
+            json.dump(self.dataset.state_dict(), f)
+
+
+def restore_stream_state(dataset, checkpoint_dir):
+    """Resumes dataset from checkpoint_dir's saved position. Returns True if restored."""
+    path = os.path.join(checkpoint_dir, STREAM_STATE_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path) as f:
+        dataset.load_state_dict(json.load(f))
+    print(f"⏩ Resumed data stream from {path}")
+    return True
+
+
+# ---------------------------
+# Length bucketing + dynamic padding
+# ---------------------------
+
+class TokenBudgetBatchSampler:
+    """
+    Yields batches of dataset indices whose padded size (longest x count)
+    stays within max_tokens, instead of a fixed number of examples.
+
+    Examples are sorted by length (random tie-break per epoch), so every batch
+    holds similar lengths and pads very little; the order of the batches is
+    shuffled each epoch. Batch composition sizes are fixed, so len() is exact.
+    """
+
+    def __init__(self, lengths, max_tokens, max_batch_size=64, shuffle=True, seed=0):
+        self.lengths = list(lengths)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self._num_batches = len(self._make_batches(random.Random(seed)))
+
+    def _make_batches(self, rng):
+        order = sorted(range(len(self.lengths)), key=lambda i: (self.lengths[i], rng.random()))
+        batches, batch, longest = [], [], 0
+        for i in order:
+            longest_if_added = max(longest, self.lengths[i])
+            if batch and (longest_if_added * (len(batch) + 1) > self.max_tokens
+                          or len(batch) >= self.max_batch_size):
+                batches.append(batch)
+                batch, longest_if_added = [], self.lengths[i]
+            batch.append(i)
+            longest = longest_if_added
+        if batch:
+            batches.append(batch)
+        return batches
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    @property
+    def sampler(self):
+        # Accelerate's DataLoaderShard.set_epoch() only reaches batch_sampler.sampler
+        return self
+
+    def __iter__(self):
+        rng = random.Random(self.seed + self.epoch)
+        batches = self._make_batches(rng)
+        if self.shuffle:
+            rng.shuffle(batches)
+        return iter(batches)
+
+    def __len__(self):
+        return self._num_batches
+
+
+class TokenBudgetTrainer(Trainer):
+    """
+    Trainer whose train dataloader uses TokenBudgetBatchSampler when
+    max_tokens is set. The dataset needs a "length" column.
+    """
+
+    def __init__(self, *args, max_tokens=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_tokens = max_tokens
+
+    def get_train_dataloader(self):
+        if not self.max_tokens:
+            return super().get_train_dataloader()
+        lengths = self.train_dataset["length"]
+        dataset = self._remove_unused_columns(self.train_dataset, description="training")
+        sampler = TokenBudgetBatchSampler(lengths, self.max_tokens, seed=self.args.seed)
+        loader = DataLoader(
+            dataset,
+            batch_sampler=sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(loader)
+
+
+def padding_ratio(lengths, batches):
+    """Fraction of padded positions when each batch is padded to its longest member."""
+    real = padded = 0
+    for batch in batches:
+        lens = [lengths[i] for i in batch]
+        real += sum(lens)
+        padded += max(lens) * len(lens)
+    return 1 - real / max(1, padded)
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+evaluate_adapters.py — batched offline evaluation of LoRA adapters on test.jsonl.
+
+For every adapter (or the bare base model) it computes teacher-forced loss and
+perplexity on the `completion` tokens only (the prompt is masked with -100),
+and optionally generates a reply for every prompt.
+
+- examples are sorted by length and batched by a token budget
+  (data_pipeline.TokenBudgetBatchSampler), so little compute goes to padding
+- the work is sharded round-robin over worker processes (one per GPU, or
+  --workers on CPU)
+- each shard appends one JSON line per example as soon as its batch is done;
+  re-running the same command skips examples already in the shard files, so an
+  interrupted run resumes where it stopped
+- a summary.json per adapter and a comparison table are written at the end
+
+Usage:
+    python evaluate_adapters.py --adapters ./lora_finetuned ./lora_finetuned_v2
+    python evaluate_adapters.py --adapters none ./lora_finetuned --generate --limit 500
+"""
+
+import argparse
+import json
+import math
+import multiprocessing as mp
+import os
+import time
+
+from data_pipeline import IGNORE_INDEX, TokenBudgetBatchSampler
+
+# -----------------------------
+# Config (defaults for the CLI)
+# -----------------------------
+BASE_MODEL = "meta-llama/Llama-3.2-3b"  # same base as train_lora.py
+DATA_FILE = "./test.jsonl"
+OUTPUT_DIR = "./eval_results"
+MAX_LENGTH = 1024
+MAX_TOKENS = 16384        # token budget per batch (longest x count)
+LOSS_CHUNK = 2048         # scored positions per lm_head slice (bounds the fp32 logits to LOSS_CHUNK x vocab)
+MAX_NEW_TOKENS = 128
+END_MARKER = "END"        # our completions end with " END"
+
+
+# -----------------------------
+# Data
+# -----------------------------
+def load_examples(path, limit=None):
+    """[(index, prompt, completion)] for records that have both fields."""
+    examples = []
+    with open(path) as f:
+        for index, line in enumerate(f):
+            if limit is not None and index >= limit:
+                break
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get("prompt") and record.get("completion"):
+                examples.append((index, record["prompt"], record["completion"]))
+    return examples
+
+
+def adapter_name(adapter):
+    return "base" if adapter in (None, "none") else os.path.basename(os.path.normpath(adapter))
+
+
+def shard_path(out_dir, shard, num_shards):
+    return os.path.join(out_dir, f"shard-{shard:02d}-of-{num_shards:02d}.jsonl")
+
+
+def completed_indices(out_dir):
+    """Indices already written by any shard file (shard count may have changed)."""
+    done = set()
+    if not os.path.isdir(out_dir):
+        return done
+    for name in os.listdir(out_dir):
+        if not (name.startswith("shard-") and name.endswith(".jsonl")):
+            continue
+        with open(os.path.join(out_dir, name)) as f:
+            for line in f:
+                try:
+                    done.add(json.loads(line)["index"])
+                except (ValueError, KeyError):
+                    pass  # partially written last line of an interrupted run
+    return done
+
+
+def encode(tokenizer, prompt, completion, max_length):
+    """
+    Tokenizes prompt+completion jointly (as training did) and returns
+    (input_ids, labels) with the prompt masked. Overlong examples lose
+    prompt tokens from the left so the completion is always scored.
+    """
+    prompt_len = len(tokenizer(prompt)["input_ids"])
+    input_ids = tokenizer(prompt + completion)["input_ids"]
+    labels = [IGNORE_INDEX] * prompt_len + input_ids[prompt_len:]
+    if len(input_ids) > max_length:
+        input_ids, labels = input_ids[-max_length:], labels[-max_length:]
+    return input_ids, labels
+
+
+# -----------------------------
+# Worker
+# -----------------------------
+def load_model(base_model, adapter, device):
+    import torch
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(adapter if adapter not in (None, "none") and
+                                              os.path.exists(os.path.join(adapter, "tokenizer_config.json"))
+                                              else base_model, use_fast=True)
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+
+    dtype = torch.bfloat16 if device.startswith("cuda") else torch.float32
+    model = AutoModelForCausalLM.from_pretrained(base_model, torch_dtype=dtype).to(device)
+    if adapter not in (None, "none"):
+        from peft import PeftModel
+
+        model = PeftModel.from_pretrained(model, adapter)
+        model = model.merge_and_unload()  # plain forward, no LoRA overhead per batch
+    model.eval()
+    return model, tokenizer
+
+
+def score_batch(model, tokenizer, batch, device):
+    """
+    Teacher-forced completion NLL per example: [(nll_sum, n_tokens)].
+    Only the label positions go through the LM head, LOSS_CHUNK at a time, so
+    the logits never exist for the whole (batch x length x vocab) at once.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    longest = max(len(ids) for ids, _ in batch)
+    input_ids = torch.full((len(batch), longest), tokenizer.pad_token_id, dtype=torch.long)
+    labels = torch.full((len(batch), longest), IGNORE_INDEX, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), longest), dtype=torch.long)
+    for row, (ids, lab) in enumerate(batch):
+        input_ids[row, :len(ids)] = torch.tensor(ids)
+        labels[row, :len(lab)] = torch.tensor(lab)
+        attention_mask[row, :len(ids)] = 1
+
+    input_ids, labels, attention_mask = input_ids.to(device), labels.to(device), attention_mask.to(device)
+    hidden = model.get_decoder()(input_ids=input_ids, attention_mask=attention_mask).last_hidden_state[:, :-1]
+    targets = labels[:, 1:]
+    scored = targets != IGNORE_INDEX
+    rows = scored.nonzero()[:, 0]
+    hidden, targets = hidden[scored], targets[scored]
+    head = model.get_output_embeddings()
+    nll = torch.zeros(len(batch), device=device)
+    for start in range(0, len(targets), LOSS_CHUNK):
+        chunk = slice(start, start + LOSS_CHUNK)
+        losses = F.cross_entropy(head(hidden[chunk]).float(), targets[chunk], reduction="none")
+        nll.index_add_(0, rows[chunk], losses)
+    counts = scored.sum(dim=1)
+    return list(zip(nll.tolist(), counts.tolist()))
+
+
+def generate_batch(model, tokenizer, prompts, device, max_new_tokens):
+    """Greedy generation for a batch of prompts (left padded)."""
+    import torch
+
+    tokenizer.padding_side = "left"
+    enc = tokenizer(prompts, return_tensors="pt", padding=True).to(device)
+    tokenizer.padding_side = "right"
+    with torch.inference_mode():
+        out = model.generate(**enc, max_new_tokens=max_new_tokens, do_sample=False,
+                             pad_token_id=tokenizer.pad_token_id)
+    texts = tokenizer.batch_decode(out[:, enc["input_ids"].shape[1]:], skip_special_tokens=True)
+    return [t.split(END_MARKER)[0].strip() for t in texts]
+
+
+def run_shard(shard, num_shards, examples, args, adapter, out_dir):
+    import torch
+
+    if torch.cuda.is_available():
+        device = f"cuda:{shard % torch.cuda.device_count()}"
+    else:
+        device = "cpu"
+        torch.set_num_threads(max(1, (os.cpu_count() or 1) // num_shards))
+
+    mine = [ex for i, ex in enumerate(examples) if i % num_shards == shard]
+    if not mine:
+        return
+    model, tokenizer = load_model(args.base_model, adapter, device)
+    encoded = [encode(tokenizer, prompt, completion, args.max_length) for _, prompt, completion in mine]
+    lengths = [len(ids) for ids, _ in encoded]
+    sampler = TokenBudgetBatchSampler(lengths, args.max_tokens, shuffle=False)
+
+    print(f"🧪 [{adapter_name(adapter)}] shard {shard}/{num_shards} on {device}: "
+          f"{len(mine)} examples in {len(sampler)} batches")
+    start = time.time()
+    done = 0
+    with open(shard_path(out_dir, shard, num_shards), "a") as out, torch.inference_mode():
+        for batch in sampler:
+            scores = score_batch(model, tokenizer, [encoded[i] for i in batch], device)
+            generations = (generate_batch(model, tokenizer, [mine[i][1] for i in batch], device,
+                                          args.max_new_tokens) if args.generate else [None] * len(batch))
+            for i, (nll_sum, n_tokens), generation in zip(batch, scores, generations):
+                row = {"index": mine[i][0], "tokens": n_tokens, "nll": nll_sum,
+                       "loss": nll_sum / max(1, n_tokens)}
+                if generation is not None:
+                    row["generation"] = generation
+                out.write(json.dumps(row) + "\n")
+            out.flush()
+            done += len(batch)
+        print(f"✅ [{adapter_name(adapter)}] shard {shard} done: {done} examples "
+              f"in {time.time() - start:.1f}s")
+
+
+# -----------------------------
+# Summary
+# -----------------------------
+def summarize(out_dir, name):
+    """Token-weighted loss/perplexity over every shard file of one adapter."""
+    rows = {}
+    for fname in sorted(os.listdir(out_dir)):
+        if fname.startswith("shard-") and fname.endswith(".jsonl"):
+            with open(os.path.join(out_dir, fname)) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue
+                    rows[row["index"]] = row
+    total_nll = sum(r["nll"] for r in rows.values())
+    total_tokens = sum(r["tokens"] for r in rows.values())
+    loss = total_nll / max(1, total_tokens)
+    summary = {
+        "adapter": name,
+        "examples": len(rows),
+        "completion_tokens": total_tokens,
+        "loss": round(loss, 4),
+        "perplexity": round(math.exp(loss), 3),
+        "mean_example_loss": round(sum(r["loss"] for r in rows.values()) / max(1, len(rows)), 4),
+    }
+    with open(os.path.join(out_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+def evaluate_adapter(adapter, examples, args):
+    name = adapter_name(adapter)
+    out_dir = os.path.join(args.output_dir, name)
+    os.makedirs(out_dir, exist_ok=True)
+
+    done = completed_indices(out_dir)
+    pending = [ex for ex in examples if ex[0] not in done]
+    print(f"📋 [{name}] {len(done)} already scored, {len(pending)} to go")
+
+    if pending:
+        if args.workers == 1:
+            run_shard(0, 1, pending, args, adapter, out_dir)
+        else:
+            ctx = mp.get_context("spawn")  # CUDA cannot be forked
+            procs = [ctx.Process(target=run_shard, args=(shard, args.workers, pending, args, adapter, out_dir))
+                     for shard in range(args.workers)]
+            for p in procs:
+                p.start()
+            for p in procs:
+                p.join()
+            failed = [p.exitcode for p in procs if p.exitcode]
+            if failed:
+                print(f"⚠️ [{name}] {len(failed)} shard(s) failed; re-run to resume")
+    return summarize(out_dir, name)
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Batched LoRA adapter evaluation")
+    p.add_argument("--adapters", nargs="+", default=["./lora_finetuned"],
+                   help='adapter directories; "none" scores the base model')
+    p.add_argument("--base-model", default=BASE_MODEL)
+    p.add_argument("--data", default=DATA_FILE)
+    p.add_argument("--output-dir", default=OUTPUT_DIR)
+    p.add_argument("--limit", type=int, help="only the first N lines of --data")
+    p.add_argument("--max-length", type=int, default=MAX_LENGTH)
+    p.add_argument("--max-tokens", type=int, default=MAX_TOKENS, help="token budget per batch")
+    p.add_argument("--workers", type=int, default=0, help="worker processes (default: one per GPU, else 1)")
+    p.add_argument("--generate", action="store_true", help="also generate a reply for every prompt")
+    p.add_argument("--max-new-tokens", type=int, default=MAX_NEW_TOKENS)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.workers <= 0:
+        import torch
+
+        args.workers = max(1, torch.cuda.device_count())
+
+    examples = load_examples(args.data, args.limit)
+    print(f"📥 {len(examples)} examples from {args.data}")
+    summaries = [evaluate_adapter(adapter, examples, args) for adapter in args.adapters]
+
+    print(f"\n{'adapter':<28} {'examples':>9} {'loss':>8} {'ppl':>9}")
+    for s in summaries:
+        print(f"{s['adapter']:<28} {s['examples']:>9} {s['loss']:>8} {s['perplexity']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -11,15 +11,34 @@ from transformers import (
     AutoModelForCausalLM,
     BitsAndBytesConfig,
     TrainingArguments,
-    Trainer
+    DataCollatorForSeq2Seq,
 )
 import torch
+from data_pipeline import TokenBudgetTrainer, stream_jsonl, StreamStateCallback, restore_stream_state
 torch.cuda.empty_cache()
 
+MAX_LENGTH = 512
+# Batches are sized by tokens (longest example x batch size) instead of a fixed
+# count, so short conversations train in large batches and long ones in small
+# ones. Set to None to fall back to per_device_train_batch_size with
+# length-grouped sampling.
+TOKEN_BUDGET = 4096
+# Read formatted_dataset.jsonl lazily through a shuffle buffer instead of loading
+# it all (fixed memory for corpora larger than RAM). Streaming trains for
+# MAX_STEPS and batches by count (token budgets need random access).
+STREAMING = False
+MAX_STEPS = 10_000
+SAVE_STEPS = 500
+SHUFFLE_BUFFER = 10_000
+RESUME_FROM_CHECKPOINT = os.getenv("RESUME_FROM_CHECKPOINT")
+
 # ---------------------------
 # 1. Load the Formatted Dataset
 # ---------------------------
-dataset = load_dataset("json", data_files={"train": "formatted_dataset.jsonl"})
+if STREAMING:
+    dataset = {"train": stream_jsonl("formatted_dataset.jsonl", shuffle_buffer=SHUFFLE_BUFFER)}
+else:
+    dataset = load_dataset("json", data_files={"train": "formatted_dataset.jsonl"})
 
 """
     The dataset is of the format:
@@ -49,35 +68,52 @@ tokenizer.pad_token = tokenizer.eos_token
 # ---------------------------
 # 3. Define a Tokenization Function for Multi-Turn Conversations
 # ---------------------------
-def format_conversation(example):
+def format_conversations(batch):
     """
-    Convert a multi-turn conversation (with a "Messages" array)
-    into a single string formatted for fine-tuning.
-    This function concatenates user messages wrapped in [INST] ... [/INST]
+    Convert multi-turn conversations (each a "Messages" array) into single
+    strings formatted for fine-tuning, for a whole batch at once.
+    Each conversation concatenates user messages wrapped in [INST] ... [/INST]
     followed by the assistant messages, and appends an end-of-sequence token.
-    It also attaches labels (same as input_ids) for computing the loss.
+    It also attaches labels (same as input_ids) for computing the loss and the
+    token length used for bucketing. No padding here: the collator pads each
+    batch to its own longest member.
     """
-    conversation = ""
-    for msg in example["Messages"]:
-        if msg["Role"] == "user":
-            conversation += "[INST] " + msg["Content"].strip() + " [/INST] "
-        elif msg["Role"] == "assistant":
-            conversation += msg["Content"].strip() + " "
-    conversation += "</s>"  # End-of-sequence marker
-
-   
+    conversations = []
+    for messages in batch["Messages"]:
+        conversation = ""
+        for msg in messages:
+            if msg["Role"] == "user":
+                conversation += "[INST] " + msg["Content"].strip() + " [/INST] "
+            elif msg["Role"] == "assistant":
+                conversation += msg["Content"].strip() + " "
+        conversation += "</s>"  # End-of-sequence marker
+        conversations.append(conversation)
+
     tokenized = tokenizer(
-        conversation,
+        conversations,
         truncation=True,
-        padding="max_length",
-        max_length=512  # Is this max_length relevant to the issue I'm facing ?
+        max_length=MAX_LENGTH,
     )
 
-    tokenized["labels"] = tokenized["input_ids"].copy()
+    tokenized["labels"] = [ids.copy() for ids in tokenized["input_ids"]]
+    tokenized["length"] = [len(ids) for ids in tokenized["input_ids"]]
     return tokenized
 
-# Apply the tokenization function to the dataset
-tokenized_dataset = dataset.map(format_conversation, batched=False)
+# Apply the tokenization function to the dataset (batched: the fast tokenizer
+# handles a whole batch in one call instead of row-by-row Python)
+tokenized_dataset = {
+    split: ds.map(format_conversations, batched=True, remove_columns=["Messages"])
+    for split, ds in dataset.items()
+}
+
+callbacks = []
+if STREAMING:
+    if RESUME_FROM_CHECKPOINT:
+        restore_stream_state(tokenized_dataset["train"], RESUME_FROM_CHECKPOINT)
+    callbacks.append(StreamStateCallback(tokenized_dataset["train"]))
+
+# Pads input_ids with the pad token and labels with -100, per batch
+data_collator = DataCollatorForSeq2Seq(tokenizer, padding="longest", pad_to_multiple_of=8)
 
 # ---------------------------
 # 4. Load the Mistral-7B Model with 4-bit Quantization and Attach LoRA Adapters
@@ -118,29 +154,38 @@ training_args = TrainingArguments(
     output_dir="./mistral_finetuned",
     eval_strategy="no",  # Disable evaluation if no eval dataset is provided
     learning_rate=2e-5,
-    per_device_train_batch_size=1,  # Lowered batch size
+    per_device_train_batch_size=1,  # Used only when TOKEN_BUDGET is None
     gradient_accumulation_steps=4,  # Simulate a larger effective batch size
+    group_by_length=not STREAMING,  # Bucket similar lengths when batching by count
+    length_column_name="length",
     num_train_epochs=3,
     weight_decay=0.01,
     fp16=True,
     logging_steps=50,
     save_total_limit=2,
     report_to="none",
+    # an iterable dataset has no length: train for a step budget instead
+    max_steps=MAX_STEPS if STREAMING else -1,
+    save_steps=SAVE_STEPS,
+    ignore_data_skip=STREAMING,
 )
 
 # ---------------------------
 # 6. Initialize the Trainer
 # ---------------------------
-trainer = Trainer(
+trainer = TokenBudgetTrainer(
     model=model,
     args=training_args,
     train_dataset=tokenized_dataset["train"],
+    data_collator=data_collator,
+    max_tokens=None if STREAMING else TOKEN_BUDGET,
+    callbacks=callbacks,
 )
 
 # ---------------------------
 # 7. Fine-Tune the Model
 # ---------------------------
-trainer.train()
+trainer.train(resume_from_checkpoint=RESUME_FROM_CHECKPOINT)
 
 # ---------------------------
 # 8. Save the Fine-Tuned Model and Tokenizer
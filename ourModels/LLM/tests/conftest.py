@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the LLM scripts are flat modules run from ourModels/LLM
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
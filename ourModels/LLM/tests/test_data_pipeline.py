@@ -0,0 +1,144 @@
+import pytest
+
+pytest.importorskip("datasets")
+pytest.importorskip("transformers")
+
+import data_pipeline
+from datasets import Dataset, DatasetDict
+
+from data_pipeline import (IGNORE_INDEX, TokenBudgetBatchSampler, check_packing_support, load_or_build_tokenized,
+                           pack_sequences, packing_report, padding_ratio, tokenize_splits)
+
+EOS = 0
+
+
+def test_pack_sequences_fills_whole_blocks():
+    out = pack_sequences({"input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9]]}, max_length=4, eos_token_id=EOS)
+    # 4 + 3 + 5 = 12 tokens with an EOS appended to each example -> 3 full blocks
+    assert out["input_ids"] == [[1, 2, 3, EOS], [4, 5, EOS, 6], [7, 8, 9, EOS]]
+    assert all(len(row) == 4 for key in out for row in out[key])
+
+
+def test_pack_sequences_restarts_positions_per_example():
+    out = pack_sequences({"input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9]]}, max_length=4, eos_token_id=EOS)
+    assert out["position_ids"] == [[0, 1, 2, 3], [0, 1, 2, 0], [1, 2, 3, 4]]
+
+
+def test_pack_sequences_masks_first_token_of_each_example():
+    out = pack_sequences({"input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9]]}, max_length=4, eos_token_id=EOS)
+    # labels are not shifted (the model shifts); the first token of each example is never a target
+    assert out["labels"] == [[IGNORE_INDEX, 2, 3, EOS], [IGNORE_INDEX, 5, EOS, IGNORE_INDEX], [7, 8, 9, EOS]]
+
+
+def test_pack_sequences_drops_incomplete_tail_and_empty_examples():
+    out = pack_sequences({"input_ids": [[1, 2, EOS], [], [3]]}, max_length=4, eos_token_id=EOS)
+    assert out["input_ids"] == [[1, 2, EOS, 3]]
+
+
+def test_packing_report_recovers_example_lengths_from_positions():
+    out = pack_sequences({"input_ids": [[1, 2, 3], [4, 5], [6, 7, 8, 9]]}, max_length=4, eos_token_id=EOS)
+    report = packing_report(Dataset.from_dict(out), max_length=4)
+    # lengths 4, 3, 5 (EOS included); padded to 4 each, the 5 is truncated to 4
+    assert report["examples"] == 3 and report["blocks"] == 3
+    assert report["padded_utilization"] == pytest.approx(11 / 12)
+
+
+def test_check_packing_support_rejects_old_transformers(monkeypatch):
+    monkeypatch.setattr(data_pipeline.importlib.metadata, "version", lambda name: "4.46.0")
+    with pytest.raises(RuntimeError, match="attend to each other"):
+        check_packing_support()
+    monkeypatch.setattr(data_pipeline.importlib.metadata, "version", lambda name: "4.53.1")
+    check_packing_support()
+
+
+
+LENGTHS = [5, 90, 12, 64, 7, 33, 120, 8, 15, 60, 3, 100]
+
+
+def test_token_budget_batches_stay_within_budget_and_cover_every_index():
+    sampler = TokenBudgetBatchSampler(LENGTHS, max_tokens=128, max_batch_size=4)
+    batches = list(sampler)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(LENGTHS)))
+    for batch in batches:
+        assert len(batch) <= 4
+        assert max(LENGTHS[i] for i in batch) * len(batch) <= 128
+
+
+def test_token_budget_len_is_exact_and_epochs_reshuffle():
+    sampler = TokenBudgetBatchSampler(LENGTHS, max_tokens=128)
+    first = list(sampler)
+    assert len(sampler) == len(first)
+    sampler.set_epoch(1)
+    assert len(list(sampler)) == len(first)
+    sampler.set_epoch(0)
+    assert list(sampler) == first  # deterministic per (seed, epoch)
+
+
+def test_token_budget_epoch_reaches_the_sampler_like_accelerate_does():
+    sampler = TokenBudgetBatchSampler(LENGTHS, max_tokens=128, max_batch_size=2)
+    first = list(sampler)
+    # accelerate's DataLoaderShard.set_epoch: batch_sampler.sampler.set_epoch(epoch)
+    sampler.sampler.set_epoch(1)
+    assert sampler.epoch == 1
+    assert list(sampler) != first
+
+
+def test_token_budget_pads_less_than_fixed_batches():
+    sampler = TokenBudgetBatchSampler(LENGTHS, max_tokens=128, shuffle=False)
+    fixed = [list(range(i, i + 3)) for i in range(0, len(LENGTHS), 3)]
+    assert padding_ratio(LENGTHS, list(sampler)) < padding_ratio(LENGTHS, fixed)
+
+
+def test_token_budget_oversized_example_gets_its_own_batch():
+    batches = list(TokenBudgetBatchSampler([10, 500, 10], max_tokens=100, shuffle=False))
+    assert [1] in batches
+
+
+def fake_tokenize(batch):
+    return {"input_ids": [[len(word) for word in text.split()] for text in batch["text"]]}
+
+
+def test_tokenize_splits_handles_a_validation_only_dict():
+    # streaming mode caches only the validation split
+    raw = DatasetDict({"validation": Dataset.from_dict({"text": ["one two three", "", "four five"]})})
+    out = tokenize_splits(raw, fake_tokenize, num_proc=1)
+    assert list(out) == ["validation"]
+    assert out["validation"]["input_ids"] == [[3, 3, 5], [4, 4]]  # empty example filtered
+
+
+def test_tokenize_splits_packs_when_asked():
+    raw = DatasetDict({"validation": Dataset.from_dict({"text": ["aa bbb", "c dd ee"]})})
+    out = tokenize_splits(raw, fake_tokenize, num_proc=1, pack_max_length=3, eos_token_id=EOS)
+    assert out["validation"]["input_ids"] == [[2, 3, EOS], [1, 2, 2]]
+    assert out["validation"].column_names == ["input_ids", "position_ids", "labels"]
+
+
+@pytest.fixture
+def build(monkeypatch, tmp_path):
+    """load_or_build_tokenized with a fixed fingerprint and an in-memory "JSONL"."""
+    monkeypatch.setattr(data_pipeline, "dataset_fingerprint", lambda *a, **k: "fp")
+    raw = DatasetDict({"train": Dataset.from_dict({"input_ids": [[1, 2], [3]]})})
+    monkeypatch.setattr(data_pipeline, "load_dataset", lambda *a, **k: raw)
+    calls = []
+
+    def run():
+        return load_or_build_tokenized("train.jsonl", None, lambda ds, n: calls.append(1) or ds, 4,
+                                       cache_root=tmp_path, num_proc=1)
+
+    return run, calls, tmp_path / "fp"
+
+
+def test_load_or_build_tokenized_reuses_complete_cache(build):
+    run, calls, path = build
+    assert run()["train"]["input_ids"] == [[1, 2], [3]]
+    assert run()["train"]["input_ids"] == [[1, 2], [3]]
+    assert calls == [1]
+
+
+def test_load_or_build_tokenized_replaces_partial_cache(build):
+    run, calls, path = build
+    path.mkdir()
+    (path / "data-00000-of-00001.arrow").write_bytes(b"truncated")  # no dataset_dict.json
+    assert run()["train"]["input_ids"] == [[1, 2], [3]]
+    assert (path / "dataset_dict.json").exists()
+    assert not (path / "data-00000-of-00001.arrow").exists()
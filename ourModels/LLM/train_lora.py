@@ -13,7 +13,6 @@ Notes:
 
 import os
 import torch
-from datasets import load_dataset
 from transformers import (
     AutoTokenizer,
     AutoModelForCausalLM,
@@ -21,8 +20,21 @@ from transformers import (
     Trainer,
     TrainingArguments,
     DataCollatorForLanguageModeling,
+    default_data_collator,
 )
 from peft import LoraConfig, get_peft_model
+from data_pipeline import (
+    check_packing_support,
+    has_valid_input_ids,
+    pack_sequences,
+    packing_report,
+    load_or_build_tokenized,
+    record_to_text,
+    stream_tokenized,
+    tokenize_splits,
+    StreamStateCallback,
+    restore_stream_state,
+)
 
 # -----------------------------
 # Config (edit if you want)
@@ -33,14 +45,28 @@ model_name = "meta-llama/Llama-3.2-3b"  # <- change if you want another HF id
 
 # Tokenization / training hyperparameters
 MAX_LENGTH = 512
+# Pack examples into full MAX_LENGTH blocks instead of padding each one
+# (see data_pipeline.py). Set False for the old one-example-per-row layout.
+PACKING = True
 PER_DEVICE_BATCH_SIZE = 2
 GRAD_ACCUM = 8
 NUM_EPOCHS = 2
 LEARNING_RATE = 2e-4
 OUTPUT_DIR = "./lora_finetuned"
+# Stream train.jsonl lazily (fixed memory for corpora larger than RAM) instead of
+# the cached Arrow path. Streaming needs a step budget instead of epochs.
+STREAMING = False
+MAX_STEPS = 10_000
+SAVE_STEPS = 500
+SHUFFLE_BUFFER = 10_000
+RESUME_FROM_CHECKPOINT = os.getenv("RESUME_FROM_CHECKPOINT")  # e.g. ./lora_finetuned/checkpoint-500
+
+if PACKING:
+    # fail before loading anything if packed examples would not be kept apart
+    check_packing_support()
 
 # -----------------------------
-# 1) Load JSONL dataset
+# 1) JSONL dataset files
 # -----------------------------
 # Paths are relative to the current working directory (LLM/)
 data_files = {
@@ -49,15 +75,15 @@ data_files = {
     "test": "./test.jsonl",
 }
 
-print("📥 Loading JSONL dataset from:", data_files)
-dataset = load_dataset("json", data_files=data_files)
-print("✔️ Loaded dataset:", dataset)
+# Tokenized splits are cached by data_pipeline.load_or_build_tokenized (section 4),
+# so the JSONL is only read and tokenized when the data, tokenizer or prompt
+# template change.
 
 # -----------------------------
 # 2) Tokenizer + Model (bnb optional)
 # -----------------------------
 print("🔁 Loading tokenizer:", model_name)
-tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=True)
 # ensure pad token exists (required for batching / data collator)
 if tokenizer.pad_token is None:
     tokenizer.pad_token = tokenizer.eos_token
@@ -114,50 +140,16 @@ def build_prompts_and_tokenize(batch):
     """
     batch: dict of lists (datasets passes batched=True)
     We return the tokenized mapping (input_ids, attention_mask, etc.)
+    Field handling (prompt/completion, instruction/response, ...) lives in
+    data_pipeline.record_to_text so the cached and streaming paths agree.
     """
-    prompts = []
-    # detect which keys exist in this dataset
-    # note: sometimes dataset libraries return columns like 'instruction' or 'input'
-    # handle common combos. fallback to 'text'.
-    for i in range(len(next(iter(batch.values())))):  # length of batch
-        # Try instruction/response
-        instr = batch.get("instruction", [None] * len(next(iter(batch.values()))))[i]
-        resp = batch.get("response", [None] * len(next(iter(batch.values()))))[i]
-
-        # if not present, try input/output
-        if instr is None and "input" in batch:
-            instr = batch.get("input", [None])[i]
-        if resp is None and "output" in batch:
-            resp = batch.get("output", [None])[i]
-
-        # fallback single text field
-        if (instr is None or instr == "") and "text" in batch:
-            instr = batch.get("text", [None])[i]
-
-        # Normalize lists -> strings (if any entries are lists)
-        if isinstance(instr, list):
-            instr = " ".join(map(str, instr))
-        if isinstance(resp, list):
-            resp = " ".join(map(str, resp))
-
-        # Coerce to strings safely
-        instr = "" if instr is None else str(instr).strip()
-        resp = "" if resp is None else str(resp).strip()
-
-        # Build final prompt. If there's a response present, include it so model learns mapping.
-        # If you want instruction-only SFT (i.e., model to predict response), you might structure differently.
-        if instr and resp:
-            prompt = f"User: {instr}\nAssistant: {resp}"
-        elif instr:
-            prompt = f"User: {instr}\nAssistant:"
-        elif resp:
-            prompt = f"Assistant: {resp}"
-        else:
-            prompt = ""
-
-        prompts.append(prompt)
+    n = len(next(iter(batch.values())))  # length of batch
+    prompts = [record_to_text({key: values[i] for key, values in batch.items()}) for i in range(n)]
 
     # Tokenize the batch of prompts. Batched tokenizer avoids the NoneType tensor issues.
+    if PACKING:
+        # no padding/truncation: pack_sequences fills whole blocks afterwards
+        return tokenizer(prompts)
     tokenized = tokenizer(
         prompts,
         truncation=True,
@@ -166,35 +158,65 @@ def build_prompts_and_tokenize(batch):
     )
     return tokenized
 
-print("🔤 Tokenizing dataset (batched)...")
-# Use batched=True for efficiency and correct tokenizer inputs
-# remove original columns to avoid collisions later
-orig_columns = dataset["train"].column_names
-tokenized_datasets = dataset.map(
-    build_prompts_and_tokenize,
-    batched=True,
-    remove_columns=orig_columns,
-)
-
-print("✅ Tokenization done. Columns now:", tokenized_datasets["train"].column_names)
+def preprocess_splits(dataset, num_proc):
+    """Raw JSONL DatasetDict -> tokenized (and packed) splits, for the cache."""
+    return tokenize_splits(
+        dataset,
+        build_prompts_and_tokenize,
+        num_proc,
+        pack_max_length=MAX_LENGTH if PACKING else None,
+        eos_token_id=tokenizer.eos_token_id,
+    )
 
-# Optional: filter out any samples that somehow ended up empty after preprocessing
-def has_valid_input_ids(example):
-    ids = example.get("input_ids", None)
-    return ids is not None and isinstance(ids, list) and len(ids) > 0
+# In streaming mode only the (small) validation split goes through the cache;
+# train.jsonl is read, shuffled, tokenized and packed lazily while training.
+cached_files = {"validation": data_files["validation"]} if STREAMING else data_files
+tokenized_datasets = load_or_build_tokenized(
+    cached_files,
+    tokenizer,
+    preprocess_splits,
+    MAX_LENGTH,
+    extra={"packing": PACKING},
+    helper_fns=(build_prompts_and_tokenize, record_to_text, tokenize_splits, has_valid_input_ids, pack_sequences),
+)
+if PACKING:
+    # reported on cache hits too, from the packed blocks themselves
+    for split, blocks in tokenized_datasets.items():
+        packing_report(blocks, MAX_LENGTH, name=split)
 
-tokenized_datasets["train"] = tokenized_datasets["train"].filter(has_valid_input_ids)
-tokenized_datasets["validation"] = tokenized_datasets["validation"].filter(has_valid_input_ids)
+callbacks = []
+if STREAMING:
+    train_dataset = stream_tokenized(
+        data_files["train"],
+        build_prompts_and_tokenize,
+        shuffle_buffer=SHUFFLE_BUFFER,
+        pack_max_length=MAX_LENGTH if PACKING else None,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    if not PACKING:
+        train_dataset = train_dataset.filter(has_valid_input_ids)
+    if RESUME_FROM_CHECKPOINT:
+        restore_stream_state(train_dataset, RESUME_FROM_CHECKPOINT)
+    callbacks.append(StreamStateCallback(train_dataset))
+else:
+    train_dataset = tokenized_datasets["train"]
 
 # -----------------------------
 # 5) Data collator + Training args
 # -----------------------------
-data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
+if PACKING:
+    # blocks are already equal length with labels/position_ids; just stack them
+    data_collator = default_data_collator
+else:
+    data_collator = DataCollatorForLanguageModeling(tokenizer=tokenizer, mlm=False)
 
 training_args = TrainingArguments(
     output_dir=OUTPUT_DIR,
-    evaluation_strategy="epoch",
-    save_strategy="epoch",
+    # a stream may never finish an epoch: evaluate/checkpoint every SAVE_STEPS instead
+    eval_strategy="steps" if STREAMING else "epoch",
+    save_strategy="steps" if STREAMING else "epoch",
+    eval_steps=SAVE_STEPS,
+    save_steps=SAVE_STEPS,
     learning_rate=LEARNING_RATE,
     num_train_epochs=NUM_EPOCHS,
     per_device_train_batch_size=PER_DEVICE_BATCH_SIZE,
@@ -204,6 +226,12 @@ training_args = TrainingArguments(
     save_total_limit=2,
     fp16=True,
     report_to="none",
+    # keep position_ids: they carry the example boundaries inside packed blocks
+    remove_unused_columns=not PACKING,
+    # an iterable dataset has no length: train for a step budget instead
+    max_steps=MAX_STEPS if STREAMING else -1,
+    # the stream position is restored from the checkpoint, don't replay batches
+    ignore_data_skip=STREAMING,
 )
 
 # -----------------------------
@@ -212,15 +240,16 @@ training_args = TrainingArguments(
 trainer = Trainer(
     model=model,
     args=training_args,
-    train_dataset=tokenized_datasets["train"],
+    train_dataset=train_dataset,
     eval_dataset=tokenized_datasets["validation"],
     tokenizer=tokenizer,
     data_collator=data_collator,
+    callbacks=callbacks,
 )
 
 if __name__ == "__main__":
     print("🚀 Starting training...")
-    trainer.train()
+    trainer.train(resume_from_checkpoint=RESUME_FROM_CHECKPOINT)
     print("💾 Saving LoRA adapters and tokenizer to:", OUTPUT_DIR)
     model.save_pretrained(OUTPUT_DIR)
     tokenizer.save_pretrained(OUTPUT_DIR)
@@ -7,8 +7,14 @@ pip install chatterbox-tts torch sounddevice simpleaudio numpy
 pip install soundfile
 
 Change the USER SETTINGS section below to customize text, sample prompt path, and controls.
+
+The LocalTTSEngine class can also be imported and kept resident (main_api uses it
+as the "local" /synthesize backend): the model is loaded once, the generate()
+signature is resolved once, and speaker conditioning is cached per prompt file.
 """
 
+import inspect
+import os
 import sys
 import numpy as np
 import torch
@@ -24,153 +30,157 @@ SEED = None           # optional: set int for deterministic output
 VAD_TRIM = False      # optional: whether to enable VAD trimming (model-specific)
 # --------------------------------------------------
 
-# Minimal import; adjust if your package exposes a different path
-from chatterbox_tts import ChatterboxTTS
+# Keyword names used by different Chatterbox releases, in order of preference
+PROMPT_KWARGS = ("audio_prompt_path", "audio_prompt", "prompt_audio")
+CFG_KWARGS = ("cfg_weight", "cfgw")
+
 
-# Load model (will use cached weights if already downloaded)
-print("Loading Chatterbox model on", DEVICE, "...")  #remove this once if it prints correctly
-model = ChatterboxTTS.from_pretrained(device=DEVICE)
-model.eval()
-if DEVICE.startswith("cuda"):
-    # try half precision for speed (skip silently on failure)
+def load_model(device=DEVICE):
+    # Minimal import; adjust if your package exposes a different path
     try:
-        model.half()
-    except Exception:
-        pass
+        from chatterbox.tts import ChatterboxTTS
+    except ImportError:
+        from chatterbox_tts import ChatterboxTTS
+
+    # Load model (will use cached weights if already downloaded)
+    print("Loading Chatterbox model on", device, "...")
+    model = ChatterboxTTS.from_pretrained(device=device)
+    if hasattr(model, "eval"):
+        model.eval()
+    if device.startswith("cuda"):
+        # try half precision for speed (skip silently on failure)
+        try:
+            model.half()
+        except Exception:
+            pass
+    return model
+
 
-# Small wrapper that tries the common signatures (keeps code minimal & robust)
-def generate_audio(model, text, sample_path=None, exaggeration=0.5, temperature=0.8,
-                   cfgw=None, seed=None, vad_trim=False):
+class LocalTTSEngine:
     """
-    Minimal attempts to call model.generate with common param names.
-    Returns either:
-      - (torch.Tensor wav, sample_rate) or
-      - torch.Tensor wav  (we handle both).
+    Long-lived Chatterbox engine.
+
+    - generate() keyword names are resolved from the signature at load time
+      instead of probing with TypeError on every call
+    - speaker conditioning for a prompt file is computed once and reused
+      (keyed by path, mtime and exaggeration)
+    - outputs are float32 numpy arrays straight from the model, no reshaping copies
     """
-    # Normalize None -> omitted
-    kwargs_list = []
-
-    # Common variant 1: audio_prompt_path + exaggeration + temperature
-    kwargs_list.append({
-        "audio_prompt_path": sample_path,
-        "exaggeration": exaggeration,
-        "temperature": temperature,
-        "seed": seed,
-        "vad_trim": vad_trim,
-    })
-    # Common variant 2: audio_prompt + cfgw
-    kwargs_list.append({
-        "audio_prompt": sample_path,
-        "cfgw": cfgw if cfgw is not None else exaggeration,
-        "temperature": temperature,
-        "seed": seed
-    })
-    # Variant 3: prompt_audio + temperature + cfgw
-    kwargs_list.append({
-        "prompt_audio": sample_path,
-        "temperature": temperature,
-        "cfgw": cfgw if cfgw is not None else exaggeration,
-        "seed": seed
-    })
-
-    last_err = None
-    for kw in kwargs_list:
-        # remove None values to avoid unexpected keyword errors
-        kw_clean = {k: v for k, v in kw.items() if v is not None}
-        try:
-            return model.generate(text, **kw_clean)
-        except TypeError as e:
-            last_err = e
-            continue
-        except FileNotFoundError:
-            raise  # if sample file is not found, surface that error immediately
-        except Exception as e:
-            # surface other exceptions (e.g., runtime issues)
-            raise
-
-    raise RuntimeError("Couldn't call model.generate with the attempted signatures. Last error: " + str(last_err))
-
-# Call generation
-try:
-    generated = generate_audio(
-        model,
-        TEXT,
-        sample_path=SAMPLE_PROMPT_PATH if SAMPLE_PROMPT_PATH else None,
-        exaggeration=EXAGGERATION,
-        temperature=TEMPERATURE,
-        cfgw=CFGW,
-        seed=SEED,
-        vad_trim=VAD_TRIM
-    )
-except Exception as e:
-    print("Generation failed:", e)
-    sys.exit(1)
-
-# Normalize model output -> (wav_np, sr)
-def normalize_output(generated):
-    # common return shapes: (wav_tensor, sr) or wav_tensor alone
-    sr = getattr(model, "sr", None) or getattr(model, "sample_rate", None) or 24000
-    if isinstance(generated, (list, tuple)):
-        wav = generated[0]
-        if len(generated) >= 2 and isinstance(generated[1], (int, float)):
-            sr = int(generated[1])
-    else:
-        wav = generated
-
-    if isinstance(wav, torch.Tensor):
-        wav_np = wav.detach().cpu().numpy()
-    elif isinstance(wav, np.ndarray):
-        wav_np = wav
-    else:
-        raise RuntimeError(f"Unknown generated audio type: {type(wav)}")
-
-    # Ensure shape is (samples, channels)
-    if wav_np.ndim == 1:
-        wav_np = wav_np.astype(np.float32)
-    elif wav_np.ndim == 2:
-        # many libs return (channels, samples)
-        if wav_np.shape[0] <= 2 and wav_np.shape[0] != wav_np.shape[1]:
-            wav_np = wav_np.T.astype(np.float32)
-        else:
-            wav_np = wav_np.astype(np.float32)
-    else:
-        raise RuntimeError(f"Unsupported audio shape: {wav_np.shape}")
-
-    return wav_np, int(sr)
-
-wav_np, sr = normalize_output(generated)
-print("Generated audio shape:", wav_np.shape, "sr:", sr)
-
-# Play in-memory: sounddevice preferred, simpleaudio fallback
-played = False
-try:
-    import sounddevice as sd
-    print("Playing with sounddevice...")
-    sd.play(wav_np, sr)
-    sd.wait()
-    played = True
-except Exception as e:
-    print("sounddevice not available or failed:", e)
-
-if not played:
+
+    def __init__(self, device=DEVICE, prompt_path=SAMPLE_PROMPT_PATH, exaggeration=EXAGGERATION,
+                 temperature=TEMPERATURE, cfgw=CFGW, seed=SEED, vad_trim=VAD_TRIM):
+        self.device = device
+        self.prompt_path = prompt_path
+        self.exaggeration = exaggeration
+        self.temperature = temperature
+        self.cfgw = cfgw
+        self.seed = seed
+        self.vad_trim = vad_trim
+        self.model = load_model(device)
+        self.sr = int(getattr(self.model, "sr", None) or getattr(self.model, "sample_rate", None) or 24000)
+        self._conds = {}
+        self._resolve_generate()
+
+    def _resolve_generate(self):
+        """Picks the generate() keyword names this Chatterbox release understands."""
+        params = inspect.signature(self.model.generate).parameters
+        accepts_any = any(p.kind == inspect.Parameter.VAR_KEYWORD for p in params.values())
+
+        def pick(candidates):
+            for name in candidates:
+                if name in params:
+                    return name
+            return candidates[0] if accepts_any else None
+
+        self._prompt_kw = pick(PROMPT_KWARGS)
+        self._cfg_kw = pick(CFG_KWARGS)
+        self._static_kwargs = {}
+        for name, value in (("exaggeration", self.exaggeration), ("temperature", self.temperature),
+                            ("seed", self.seed), ("vad_trim", self.vad_trim)):
+            if value is not None and (name in params or accepts_any):
+                self._static_kwargs[name] = value
+        if self._cfg_kw and self.cfgw is not None:
+            self._static_kwargs[self._cfg_kw] = self.cfgw
+        # models exposing prepare_conditionals() let us cache the speaker embedding
+        self._can_cache_conds = hasattr(self.model, "prepare_conditionals") and hasattr(self.model, "conds")
+
+    def _use_prompt(self, prompt_path):
+        """
+        Activates the conditioning for prompt_path. Returns the extra kwargs
+        generate() still needs (none when the conditioning is cached).
+        """
+        if not prompt_path:
+            return {}
+        if not self._can_cache_conds:
+            return {self._prompt_kw: prompt_path} if self._prompt_kw else {}
+
+        key = (os.path.abspath(prompt_path), os.path.getmtime(prompt_path), self.exaggeration)
+        conds = self._conds.get(key)
+        if conds is None:
+            self.model.prepare_conditionals(prompt_path, exaggeration=self.exaggeration)
+            conds = self._conds[key] = self.model.conds
+        self.model.conds = conds
+        return {}
+
+    def _to_float32(self, generated):
+        # common return shapes: (wav_tensor, sr) or wav_tensor alone
+        wav = generated[0] if isinstance(generated, (list, tuple)) else generated
+        if isinstance(wav, torch.Tensor):
+            wav = wav.detach().float().cpu().numpy()
+        wav = np.asarray(wav, dtype=np.float32)  # no copy when already float32
+        return wav.reshape(-1) if wav.ndim == 2 and 1 in wav.shape else wav
+
+    def generate(self, text, prompt_path=None):
+        """Synthesizes one utterance; returns float32 samples at self.sr."""
+        prompt_kwargs = self._use_prompt(prompt_path or self.prompt_path)
+        with torch.inference_mode():
+            if self.seed is not None:
+                torch.manual_seed(self.seed)
+            return self._to_float32(self.model.generate(text, **prompt_kwargs, **self._static_kwargs))
+
+
+if __name__ == "__main__":
+    # Call generation
     try:
-        import simpleaudio as sa
-        print("Playing with simpleaudio (fallback)...")
-        # convert to int16 PCM
-        if wav_np.ndim == 1:
-            pcm = (wav_np * 32767.0).astype(np.int16)
-            raw = pcm.tobytes()
-            channels = 1
-        else:
-            pcm = (wav_np * 32767.0).astype(np.int16)
-            raw = pcm.flatten().tobytes()
-            channels = wav_np.shape[1]
-        wave_obj = sa.WaveObject(raw, num_channels=channels, bytes_per_sample=2, sample_rate=sr)
-        play_obj = wave_obj.play()
-        play_obj.wait_done()
+        engine = LocalTTSEngine()
+        wav_np = engine.generate(TEXT)
+        sr = engine.sr
+    except Exception as e:
+        print("Generation failed:", e)
+        sys.exit(1)
+
+    print("Generated audio shape:", wav_np.shape, "sr:", sr)
+
+    # Play in-memory: sounddevice preferred, simpleaudio fallback
+    played = False
+    try:
+        import sounddevice as sd
+        print("Playing with sounddevice...")
+        sd.play(wav_np, sr)
+        sd.wait()
         played = True
     except Exception as e:
-        print("simpleaudio playback failed:", e)
+        print("sounddevice not available or failed:", e)
+
+    if not played:
+        try:
+            import simpleaudio as sa
+            print("Playing with simpleaudio (fallback)...")
+            # convert to int16 PCM
+            if wav_np.ndim == 1:
+                pcm = (wav_np * 32767.0).astype(np.int16)
+                raw = pcm.tobytes()
+                channels = 1
+            else:
+                pcm = (wav_np * 32767.0).astype(np.int16)
+                raw = pcm.flatten().tobytes()
+                channels = wav_np.shape[1]
+            wave_obj = sa.WaveObject(raw, num_channels=channels, bytes_per_sample=2, sample_rate=sr)
+            play_obj = wave_obj.play()
+            play_obj.wait_done()
+            played = True
+        except Exception as e:
+            print("simpleaudio playback failed:", e)
 
-if not played:
-    print("No playback available. You can save wav_np to disk manually if you want to debug.")
+    if not played:
+        print("No playback available. You can save wav_np to disk manually if you want to debug.")
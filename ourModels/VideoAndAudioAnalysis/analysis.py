@@ -0,0 +1,138 @@
+"""
+The /analyze pipeline (audio demux, frame sampling, ViT face emotion,
+Whisper + wav2vec2 voice emotion), shared by the synchronous endpoint in
+main_api.py and the job workers in jobs.py. face_emotions_from_frames() and
+voice_from_audio() are the in-memory entry points (live sessions).
+"""
+
+import os
+from collections import Counter
+
+import numpy as np
+from moviepy import VideoFileClip
+from frame_utils import extract_frame_arrays
+from load_control import LoadController, tier_settings
+from model_server import ModelClient, socket_for
+from service_metrics import stage
+
+# With MODEL_SERVER_SOCKET set the models live in model_server.py processes
+# and this process never loads them; frames and PCM go over shared memory.
+if socket_for("vit"):
+    vit_client = ModelClient(socket_for("vit"))
+else:
+    from inference_vit import predict_emotion_vit_frames
+if socket_for("voice"):
+    import librosa
+
+    voice_client = ModelClient(socket_for("voice"))
+else:
+    from inference_wav2vec2 import predict_emotion_and_text_wav2vec2, predict_emotion_and_text_array
+
+# Job workers pick their quality tier from how long jobs waited in the queue
+job_load_controller = LoadController()
+
+
+def face_emotions_from_frames(frames):
+    """ViT on RGB uint8 frames (N x H x W x 3), wherever the model lives."""
+    if socket_for("vit"):
+        return vit_client.predict_emotion_vit_frames(frames)
+    return predict_emotion_vit_frames(frames)
+
+
+def voice_from_audio(audio, sr=16000, **options):
+    """Transcript + voice emotion for 16 kHz float32 samples, wherever the models live."""
+    if socket_for("voice"):
+        return voice_client.predict_emotion_and_text_array(audio, sr, **options)
+    return predict_emotion_and_text_array(audio, sr, **options)
+
+
+def voice_emotion_at(timeline, labels, times):
+    """
+    Voice emotion at each face-frame time: mean probabilities of the
+    wav2vec2 windows covering t, or None where nobody speaks.
+    """
+    aligned = []
+    for t in times:
+        covering = [w["probs"] for w in timeline if w["start"] <= t <= w["end"]]
+        if not covering:
+            aligned.append(None)
+            continue
+        mean = np.mean(covering, axis=0)
+        i = int(mean.argmax())
+        aligned.append({"emotion": labels[i], "confidence": round(float(mean[i]), 4)})
+    return aligned
+
+
+def run_analysis(video_path, temp_id, tier=None):
+    """
+    Analyzes a saved video and returns the /analyze response dict.
+    tier is a load_control.py quality tier (default "full").
+    The intermediate temp/<temp_id>.wav is removed; the video itself
+    belongs to the caller.
+    """
+    tier = tier or "full"
+    settings = tier_settings(tier)
+    fps_sample = settings["fps_sample"]
+    voice_options = {"asr_model": settings["asr_model"], "voice_emotion": settings["voice_emotion"]}
+    os.makedirs("temp", exist_ok=True)
+    audio_path = f"temp/{temp_id}.wav"
+    try:
+        # Extract audio from video
+        with stage("demux"):
+            clip = VideoFileClip(video_path)
+            clip.audio.write_audiofile(audio_path, logger=None)  # disable verbose logs
+            clip.close()
+
+        # Extract frames (in memory) + Face Emotion, batched
+        with stage("frames"):
+            frames, face_times = extract_frame_arrays(video_path, fps_sample)
+        with stage("vit"):
+            face_results = face_emotions_from_frames(frames)
+        face_emotions = [res['emotion'] for res in face_results]
+        face_confidences = [res['confidence'] for res in face_results]
+
+        # Voice Emotion + Transcription
+        with stage("voice"):
+            if socket_for("voice"):
+                audio, sr = librosa.load(audio_path, sr=16000)
+                voice_result = voice_from_audio(audio, sr, **voice_options)
+            else:
+                voice_result = predict_emotion_and_text_wav2vec2(audio_path, **voice_options)
+
+        # Aggregate (most common emotion)
+        final_face_emotion = Counter(face_emotions).most_common(1)[0][0] if face_emotions else "unknown"
+        avg_face_conf = sum(face_confidences)/len(face_confidences) if face_confidences else 0
+
+        # Per-frame timeline: face emotion next to the voice emotion at the same time
+        voice_at = voice_emotion_at(voice_result.get("emotion_timeline", []),
+                                    list(voice_result.get("emotion_probs", {})), face_times)
+        timeline = [
+            {"time": t, "face_emotion": face["emotion"], "voice_emotion": voice["emotion"] if voice else None}
+            for t, face, voice in zip(face_times, face_results, voice_at)
+        ]
+
+        return {
+            "face_emotion": final_face_emotion,
+            "avg_confidence": round(avg_face_conf, 2),
+            "voice_emotion": voice_result.get("emotion", "unknown"),
+            "transcription": voice_result.get("transcript", ""),
+            "speech_segments": voice_result.get("speech_segments", []),
+            "timeline": timeline,
+            "quality_tier": tier
+        }
+
+    finally:
+        # Cleanup temp files
+        if os.path.exists(audio_path):
+            os.remove(audio_path)
+
+
+def run_analysis_job(payload):
+    """jobs.py handler: analyzes payload["video_path"] and deletes the upload."""
+    video_path = payload["video_path"]
+    tier = job_load_controller.observe_wait(payload.get("queue_wait_s", 0.0))
+    try:
+        return run_analysis(video_path, payload["temp_id"], tier)
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
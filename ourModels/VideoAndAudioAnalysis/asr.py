@@ -0,0 +1,108 @@
+"""
+Whisper speech-to-text with a fast decode path.
+
+  - ASR_MODEL picks whisper tiny, base or small (openai/whisper-<size>)
+  - language and task are pinned, so generate() skips language detection
+  - max_new_tokens follows the audio length and is rounded up to one of
+    TOKEN_BUCKETS, so the static KV cache (and the compiled decoder) only ever
+    sees a handful of shapes
+  - ASR_COMPILE torch.compile's the decoder step; warmup() runs every bucket
+    once at load so no request pays for compilation
+
+    from asr import get_asr
+    text = get_asr().transcribe(audio, 16000)          # default ASR_MODEL
+    text = get_asr("tiny").transcribe(audio, 16000)    # smaller model, e.g. under load
+
+bench_asr.py reports the real-time factor of each option.
+"""
+
+import math
+import os
+import threading
+
+import numpy as np
+import torch
+from transformers import WhisperForConditionalGeneration, WhisperProcessor
+
+from service_metrics import model_forward, model_load
+
+# ---------- CONFIG: change only if needed ----------
+ASR_MODEL = os.getenv("ASR_MODEL", "small")                # tiny | base | small
+ASR_LANGUAGE = os.getenv("ASR_LANGUAGE", "en")
+ASR_TASK = "transcribe"
+ASR_STATIC_CACHE = os.getenv("ASR_STATIC_CACHE", "1") == "1"
+ASR_COMPILE = os.getenv("ASR_COMPILE", "1" if torch.cuda.is_available() else "0") == "1"
+ASR_WARMUP = os.getenv("ASR_WARMUP", "1") == "1"
+TOKENS_PER_SECOND = 6        # fast English speech is ~4-5 tokens/s
+MIN_NEW_TOKENS = 16
+TOKEN_BUCKETS = (32, 64, 128, 224)  # 30 s (Whisper's window) * 6 + 16 fits the last one
+# ---------------------------------------------------
+
+ASR_SIZES = ("tiny", "base", "small")
+DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+
+def max_new_tokens_for(seconds):
+    """Token budget for `seconds` of audio, rounded up to a bucket."""
+    needed = math.ceil(min(seconds, 30.0) * TOKENS_PER_SECOND) + MIN_NEW_TOKENS
+    return next((b for b in TOKEN_BUCKETS if b >= needed), TOKEN_BUCKETS[-1])
+
+
+class WhisperASR:
+    """One Whisper checkpoint plus its decode settings."""
+
+    def __init__(self, size=ASR_MODEL, static_cache=ASR_STATIC_CACHE, compiled=ASR_COMPILE, pinned=True):
+        if size not in ASR_SIZES:
+            raise ValueError(f"ASR model must be one of {ASR_SIZES}, got {size!r}")
+        self.size = size
+        self.pinned = pinned
+        name = f"openai/whisper-{size}"
+        with model_load(f"whisper-{size}"):
+            self.processor = WhisperProcessor.from_pretrained(name)
+            self.model = WhisperForConditionalGeneration.from_pretrained(name).to(DEVICE)
+            self.model.eval()
+        if static_cache:
+            self.model.generation_config.cache_implementation = "static"
+        if compiled:
+            # only the decoder step runs once per token; the encoder runs once per clip
+            decoder = self.model.model.decoder
+            decoder.forward = torch.compile(
+                decoder.forward, mode="reduce-overhead" if DEVICE.type == "cuda" else "default"
+            )
+        self._lock = threading.Lock()  # static caches and CUDA graphs are not reentrant
+
+    def generate_kwargs(self, seconds):
+        if not self.pinned:
+            return {}
+        return {"language": ASR_LANGUAGE, "task": ASR_TASK, "max_new_tokens": max_new_tokens_for(seconds)}
+
+    def transcribe(self, audio: np.ndarray, sr: int = 16000) -> str:
+        inputs = self.processor(audio, sampling_rate=sr, return_tensors="pt").to(DEVICE)
+        with self._lock, torch.no_grad(), model_forward("whisper"):
+            ids = self.model.generate(**inputs, **self.generate_kwargs(len(audio) / sr))
+        return self.processor.batch_decode(ids, skip_special_tokens=True)[0].strip()
+
+    def warmup(self):
+        """Runs each token bucket once (twice with CUDA graphs) so shapes are compiled before traffic."""
+        rng = np.random.default_rng(0)
+        for bucket in TOKEN_BUCKETS:
+            seconds = max(1.0, (bucket - MIN_NEW_TOKENS) / TOKENS_PER_SECOND)
+            audio = (0.01 * rng.standard_normal(int(seconds * 16000))).astype(np.float32)
+            for _ in range(2 if DEVICE.type == "cuda" else 1):
+                self.transcribe(audio)
+
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_asr(size=None):
+    """Shared WhisperASR for `size` (default ASR_MODEL), loaded and warmed up on first use."""
+    size = size or ASR_MODEL
+    with _models_lock:
+        if size not in _models:
+            asr = WhisperASR(size)
+            if ASR_WARMUP and (ASR_COMPILE or ASR_STATIC_CACHE):
+                asr.warmup()
+            _models[size] = asr
+        return _models[size]
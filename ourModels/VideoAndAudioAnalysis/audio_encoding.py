@@ -0,0 +1,138 @@
+import shutil
+import subprocess
+import threading
+
+# ---------- CONFIG: change only if needed ----------
+# Output encodings for /synthesize. "wav" means pass the backend output through.
+FORMATS = {
+    "opus": {
+        "mime": "audio/ogg",
+        "bitrate": "32k",
+        # small Ogg pages so the first frames leave ffmpeg right away
+        "args": ["-c:a", "libopus", "-application", "voip", "-page_duration", "20000", "-f", "ogg"],
+    },
+    "mp3": {
+        "mime": "audio/mpeg",
+        "bitrate": "64k",
+        "args": ["-c:a", "libmp3lame", "-f", "mp3"],
+    },
+    "wav": None,
+}
+ACCEPT_TO_FORMAT = {
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/mpeg": "mp3",
+    "audio/mp3": "mp3",
+    "audio/wav": "wav",
+    "audio/x-wav": "wav",
+}
+MAX_BITRATE_KBPS = 192
+READ_SIZE = 4096
+# ---------------------------------------------------
+
+
+def choose_format(query_format=None, query_bitrate=None, accept=None):
+    """
+    Picks (format, bitrate) for a response. An explicit ?format= wins; otherwise
+    the first audio type in the Accept header we can produce; otherwise "wav".
+    Bitrates look like "48k" and are capped at MAX_BITRATE_KBPS; anything
+    else raises ValueError.
+    """
+    fmt = (query_format or "").lower()
+    if fmt not in FORMATS:
+        fmt = "wav"
+        for part in (accept or "").split(","):
+            mime = part.split(";")[0].strip().lower()
+            if mime in ACCEPT_TO_FORMAT:
+                fmt = ACCEPT_TO_FORMAT[mime]
+                break
+
+    bitrate = None
+    if FORMATS[fmt] is not None:
+        bitrate = FORMATS[fmt]["bitrate"]
+        if query_bitrate:
+            kbps = int(str(query_bitrate).lower().rstrip("k"))
+            bitrate = f"{max(8, min(kbps, MAX_BITRATE_KBPS))}k"
+    return fmt, bitrate
+
+
+def mime_for(fmt):
+    return FORMATS[fmt]["mime"] if FORMATS.get(fmt) else "audio/wav"
+
+
+class TranscodeError(RuntimeError):
+    """ffmpeg could not start or produced no output."""
+
+
+def ffmpeg_available():
+    return shutil.which("ffmpeg") is not None
+
+
+def transcode_stream(chunks, fmt, bitrate=None):
+    """
+    Pipes chunks (any container ffmpeg can probe, including the open-ended
+    WAV from tts_stream) through ffmpeg and returns a generator of encoded
+    bytes, yielded as soon as ffmpeg emits them.
+
+    ffmpeg is started and its first output read before this returns, so a
+    missing binary or a failing encoder raises TranscodeError while the
+    caller can still answer with an error status instead of an empty 200.
+    """
+    spec = FORMATS[fmt]
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-ac", "1",
+        "-b:a", bitrate or spec["bitrate"],
+        *spec["args"],
+        "-flush_packets", "1",
+        "pipe:1",
+    ]
+    try:
+        proc = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    except OSError as e:
+        if hasattr(chunks, "close"):
+            chunks.close()
+        raise TranscodeError(f"cannot start ffmpeg: {e}") from e
+
+    def feed():
+        try:
+            for chunk in chunks:
+                proc.stdin.write(chunk)
+                proc.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            pass  # ffmpeg exited (client disconnected or bad input)
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+            # stop upstream work (e.g. pending sentence generations)
+            if hasattr(chunks, "close"):
+                chunks.close()
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+
+    def stop():
+        proc.stdout.close()
+        if proc.poll() is None:
+            proc.kill()
+        proc.wait()
+        writer.join(timeout=1)
+
+    first = proc.stdout.read1(READ_SIZE)
+    if not first:
+        stop()
+        raise TranscodeError(f"ffmpeg produced no {fmt} output (exit code {proc.returncode})")
+
+    def pump():
+        try:
+            data = first
+            while data:
+                yield data
+                data = proc.stdout.read1(READ_SIZE)
+        finally:
+            stop()
+
+    return pump()
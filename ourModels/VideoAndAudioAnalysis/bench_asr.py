@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+bench_asr.py — real-time factor of the Whisper decode options in asr.py.
+
+For each model size (tiny, base, small) and each option, transcribes the same
+clips and reports RTF = decode seconds / audio seconds (lower is faster; 0.1
+means 10 s of audio in 1 s), plus load and warmup time and how close the
+transcript is to the reference (whisper-small, default decoding).
+
+Options (cumulative):
+  default   generate() as it used to be called: dynamic cache, language detection, no length limit
+  pinned    language/task pinned + max_new_tokens from the audio length
+  static    pinned + static KV cache
+  compiled  static + torch.compile'd decoder (warmed up before timing)
+
+Each (size, option) runs in its own process so compile caches and memory are
+not shared. Use real speech (--audio a.wav b.wav); without it a synthetic
+speech-like signal is used, which only measures speed.
+
+Usage:
+    python bench_asr.py --audio samples/*.wav
+    python bench_asr.py --sizes tiny small --options default compiled --json asr.json
+"""
+
+import argparse
+import difflib
+import json
+import multiprocessing as mp
+import sys
+import time
+
+import numpy as np
+
+OPTIONS = {
+    "default": {"pinned": False, "static_cache": False, "compiled": False},
+    "pinned": {"pinned": True, "static_cache": False, "compiled": False},
+    "static": {"pinned": True, "static_cache": True, "compiled": False},
+    "compiled": {"pinned": True, "static_cache": True, "compiled": True},
+}
+SIZES = ("tiny", "base", "small")
+REFERENCE = ("small", "default")
+SYNTHETIC_DURATIONS = (5, 15, 30)  # seconds
+
+
+def load_clips(paths):
+    import librosa
+
+    if paths:
+        return [(p, librosa.load(p, sr=16000)[0]) for p in paths]
+    from bench_endpoints import speech_like
+
+    print("⚠️ No --audio given: synthetic audio, transcripts are meaningless (speed only)")
+    return [(f"synthetic_{d}s", speech_like(d).astype(np.float32)) for d in SYNTHETIC_DURATIONS]
+
+
+def _worker(size, option, clips, repeat, queue):
+    try:
+        from asr import WhisperASR
+
+        start = time.perf_counter()
+        asr = WhisperASR(size, **OPTIONS[option])
+        load_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if OPTIONS[option]["static_cache"]:
+            asr.warmup()
+        else:
+            asr.transcribe(clips[0][1])  # one untimed call, same as the warmed-up options
+        warmup_s = time.perf_counter() - start
+
+        rtfs, transcripts = [], {}
+        for name, audio in clips:
+            for _ in range(repeat):
+                start = time.perf_counter()
+                transcripts[name] = asr.transcribe(audio)
+                rtfs.append((time.perf_counter() - start) / (len(audio) / 16000))
+        queue.put({"size": size, "option": option, "load_s": round(load_s, 2), "warmup_s": round(warmup_s, 2),
+                   "rtf_mean": round(float(np.mean(rtfs)), 4), "rtf_p95": round(float(np.percentile(rtfs, 95)), 4),
+                   "transcripts": transcripts})
+    except Exception as e:
+        queue.put({"size": size, "option": option, "error": repr(e)})
+
+
+def similarity(a, b):
+    return difflib.SequenceMatcher(None, a.lower().split(), b.lower().split()).ratio()
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Whisper real-time factor benchmark")
+    p.add_argument("--audio", nargs="*", default=[], help="WAV/MP3 files (resampled to 16 kHz)")
+    p.add_argument("--sizes", nargs="+", default=list(SIZES), choices=SIZES)
+    p.add_argument("--options", nargs="+", default=list(OPTIONS), choices=list(OPTIONS))
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--json", help="write results to this file")
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    clips = load_clips(args.audio)
+    print(f"🎧 {len(clips)} clips, {sum(len(a) for _, a in clips) / 16000:.0f}s of audio")
+
+    runs = [(s, o) for s in args.sizes for o in args.options]
+    if REFERENCE not in runs:
+        runs.append(REFERENCE)
+
+    ctx = mp.get_context("spawn")
+    results = []
+    for size, option in runs:
+        print(f"🚀 whisper-{size} / {option} ...")
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_worker, args=(size, option, clips, args.repeat, queue))
+        proc.start()
+        results.append(queue.get())
+        proc.join()
+
+    reference = next((r for r in results if (r["size"], r["option"]) == REFERENCE and "error" not in r), None)
+    print(f"\n{'model':<14}{'option':<10}{'load s':>8}{'warmup s':>10}{'RTF':>9}{'RTF p95':>9}{'vs ref':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{'whisper-' + r['size']:<14}{r['option']:<10}  ❌ {r['error']}")
+            continue
+        if reference:
+            r["vs_reference"] = round(float(np.mean([similarity(r["transcripts"][n], t)
+                                                     for n, t in reference["transcripts"].items()])), 3)
+        print(f"{'whisper-' + r['size']:<14}{r['option']:<10}{r['load_s']:>8.1f}{r['warmup_s']:>10.1f}"
+              f"{r['rtf_mean']:>9.3f}{r['rtf_p95']:>9.3f}{r.get('vs_reference', float('nan')):>8.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+        print("💾 Results written to", args.json)
+    if any("error" in r for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+bench_endpoints.py — end-to-end latency benchmark for the analysis endpoints.
+
+  main_api.py   POST /analyze         (video: save, demux, frames, ViT, Whisper, wav2vec2)
+  processor.py  POST /analyze-audio   (save, decode, pitch, intensity, transcription, sentiment)
+  processor.py  POST /analyze-video   (save, convert, face)
+
+Test media is generated locally (numpy tones / speech-like audio, ffmpeg lavfi
+video in several lengths, resolutions and codecs), the Flask apps are driven
+in-process through test_client(), and each stage is timed by wrapping the
+function that implements it. By default the models are replaced by
+lightweight stubs (--stub-latency-ms can simulate their cost), so the numbers
+measure our own pipeline; --real-models uses the real ones.
+
+Usage:
+    python bench_endpoints.py --quick
+    python bench_endpoints.py --json bench.json
+    python bench_endpoints.py --json bench.json --baseline bench_baseline.json --tolerance 0.25
+"""
+
+import argparse
+import functools
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+import wave
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+HERE = Path(__file__).resolve().parent
+ROOT = HERE.parent.parent  # processor.py lives at the repo root
+
+# ---------- CONFIG: change only if needed ----------
+VIDEO_DURATIONS = (3, 10)                   # seconds
+VIDEO_RESOLUTIONS = ("320x240", "1280x720")
+VIDEO_CODECS = {
+    "h264": (".mp4", ["-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-c:a", "aac"]),
+    "vp9": (".webm", ["-c:v", "libvpx-vp9", "-deadline", "realtime", "-cpu-used", "8", "-c:a", "libopus"]),
+}
+AUDIO_DURATIONS = (5, 20)
+AUDIO_KINDS = ("tone", "speech")
+AUDIO_SR = 16000
+REPEAT = 5
+WARMUP = 1
+# p95 must not grow by more than TOLERANCE; stages faster than MIN_MS are ignored
+TOLERANCE = 0.25
+MIN_MS = 5.0
+# ---------------------------------------------------
+
+
+# -----------------------------
+# Synthetic media
+# -----------------------------
+def write_wav(path, audio, sr=AUDIO_SR):
+    pcm = (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+    with wave.open(str(path), "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(pcm.tobytes())
+
+
+def tone(duration, sr=AUDIO_SR, freq=220.0):
+    t = np.arange(int(duration * sr)) / sr
+    return 0.5 * np.sin(2 * np.pi * freq * t)
+
+
+def speech_like(duration, sr=AUDIO_SR, seed=0):
+    """Harmonic voice with a wandering pitch, ~4 syllables/s and pauses, plus noise."""
+    rng = np.random.default_rng(seed)
+    n = int(duration * sr)
+    t = np.arange(n) / sr
+    f0 = 140 + 40 * np.sin(2 * np.pi * 0.3 * t) + 15 * np.sin(2 * np.pi * 2.1 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    syllables = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) ** 2
+    pauses = (np.sin(2 * np.pi * 0.25 * t) > -0.6).astype(float)
+    audio = 0.3 * voice * syllables * pauses + 0.01 * rng.standard_normal(n)
+    return audio / max(1e-6, np.abs(audio).max()) * 0.8
+
+
+def make_video(path, duration, size, codec):
+    _, args = VIDEO_CODECS[codec]
+    command = [
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={size}:rate=25:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=220:sample_rate=44100:duration={duration}",
+        "-shortest", *args, str(path),
+    ]
+    subprocess.run(command, check=True)
+
+
+def generate_media(out_dir, quick):
+    """{"audio": [(case, path)], "video": [(case, path)]}"""
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    durations = VIDEO_DURATIONS[:1] if quick else VIDEO_DURATIONS
+    resolutions = VIDEO_RESOLUTIONS[:1] if quick else VIDEO_RESOLUTIONS
+    codecs = list(VIDEO_CODECS)[:1] if quick else list(VIDEO_CODECS)
+
+    media = {"audio": [], "video": []}
+    for kind in AUDIO_KINDS:
+        for duration in (AUDIO_DURATIONS[:1] if quick else AUDIO_DURATIONS):
+            case = f"{kind}-{duration}s"
+            path = out_dir / f"{case}.wav"
+            write_wav(path, tone(duration) if kind == "tone" else speech_like(duration))
+            media["audio"].append((case, path))
+    for codec in codecs:
+        for size in resolutions:
+            for duration in durations:
+                case = f"{codec}-{size}-{duration}s"
+                path = out_dir / f"{case}{VIDEO_CODECS[codec][0]}"
+                make_video(path, duration, size, codec)
+                media["video"].append((case, path))
+    return media
+
+
+# -----------------------------
+# Stub models
+# -----------------------------
+class _StubLatency:
+    """Sleeps for the simulated model latency of a stage (milliseconds)."""
+
+    def __init__(self, latencies):
+        self.latencies = latencies
+
+    def __call__(self, stage):
+        ms = self.latencies.get(stage, 0)
+        if ms:
+            time.sleep(ms / 1000)
+
+
+def install_stub_models(latency):
+    """
+    Registers stand-ins for the model modules before main_api / processor are
+    imported. They keep the attribute names the real modules use (stt_model,
+    emo_model, DeepFace.analyze, ...) so stage wrapping is the same in both modes.
+    """
+    import cv2
+    import librosa
+
+    labels = ["neutral", "calm", "happy", "sad", "angry", "fearful", "disgust", "surprise"]
+
+    vit = types.ModuleType("inference_vit")
+
+    def predict_emotion_vit(image_path):
+        img = cv2.resize(cv2.imread(image_path), (96, 96))
+        latency("vit")
+        return {"emotion": labels[int(img.mean()) % len(labels)], "confidence": 0.5}
+
+    def predict_emotion_vit_frames(frames):
+        results = []
+        for frame in frames:
+            img = cv2.resize(np.asarray(frame), (96, 96))
+            latency("vit")
+            results.append({"emotion": labels[int(img.mean()) % len(labels)], "confidence": 0.5})
+        return results
+
+    vit.EMOTION_LABELS = labels
+    vit.predict_emotion_vit = predict_emotion_vit
+    vit.predict_emotion_vit_frames = predict_emotion_vit_frames
+
+    w2v = types.ModuleType("inference_wav2vec2")
+
+    class _Whisper:
+        def generate(self, audio):
+            latency("whisper")
+            return "stub transcript"
+
+    class _Wav2Vec2:
+        def forward(self, audio):
+            latency("wav2vec2")
+            return labels[int(np.abs(audio).mean() * 1000) % len(labels)]
+
+    w2v.stt_model, w2v.emo_model = _Whisper(), _Wav2Vec2()
+
+    def predict_emotion_and_text_array(audio, sr=16000, **options):
+        return {"transcript": w2v.stt_model.generate(audio), "emotion": w2v.emo_model.forward(audio)}
+
+    def predict_emotion_and_text_wav2vec2(wav_path, **options):
+        audio, _ = librosa.load(wav_path, sr=16000)
+        return predict_emotion_and_text_array(audio)
+
+    w2v.predict_emotion_and_text_wav2vec2 = predict_emotion_and_text_wav2vec2
+    w2v.predict_emotion_and_text_array = predict_emotion_and_text_array
+
+    deepface = types.ModuleType("deepface")
+
+    class DeepFace:
+        @staticmethod
+        def analyze(frame, actions=None, enforce_detection=True):
+            latency("face")
+            return [{"dominant_emotion": "neutral"}]
+
+    deepface.DeepFace = DeepFace
+
+    aai = types.ModuleType("assemblyai")
+    aai.settings = types.SimpleNamespace(api_key=None)
+
+    class Transcriber:
+        def transcribe(self, audio_file):
+            latency("transcription")
+            return types.SimpleNamespace(text="stub transcript")
+
+    aai.Transcriber = Transcriber
+
+    sys.modules.update({"inference_vit": vit, "inference_wav2vec2": w2v,
+                        "deepface": deepface, "assemblyai": aai})
+
+
+def stub_sentiment_pipeline(latency):
+    def pipeline(task, model=None, **kwargs):
+        def classify(text):
+            latency("sentiment")
+            return [{"label": "POSITIVE", "score": 0.5}]
+        return classify
+    return pipeline
+
+
+# -----------------------------
+# Stage timing
+# -----------------------------
+class StageTimer:
+    """Accumulates wall time per stage into the dict of the running request."""
+
+    def __init__(self):
+        self.current = None
+
+    def wrap(self, fn, stage):
+        @functools.wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                if self.current is not None:
+                    self.current[stage] += time.perf_counter() - start
+        return timed
+
+    def patch(self, owner, name, stage):
+        setattr(owner, name, self.wrap(getattr(owner, name), stage))
+
+
+def instrument(timer, real_models):
+    """Imports the services and wraps the functions behind every stage."""
+    import librosa
+    from werkzeug.datastructures import FileStorage
+
+    sys.path[:0] = [str(HERE), str(ROOT)]
+    os.environ.setdefault("TTS_BACKEND", "http")  # no Space connection at import
+    import analysis
+    import main_api
+    import processor
+    import inference_wav2vec2
+
+    timer.patch(FileStorage, "save", "save")
+    timer.patch(librosa, "load", "decode")
+    timer.patch(librosa, "yin", "pitch")
+    timer.patch(librosa.feature, "rms", "intensity")
+
+    # main_api /analyze (analysis.run_analysis): demux = open the container + write the WAV track
+    open_clip = analysis.VideoFileClip
+
+    def timed_clip(*args, **kwargs):
+        clip = timer.wrap(open_clip, "demux")(*args, **kwargs)
+        clip.audio.write_audiofile = timer.wrap(clip.audio.write_audiofile, "demux")
+        return clip
+
+    analysis.VideoFileClip = timed_clip
+    timer.patch(analysis, "extract_frame_arrays", "frames")
+    timer.patch(analysis, "face_emotions_from_frames", "vit")
+    timer.patch(inference_wav2vec2.stt_model, "generate", "whisper")
+    timer.patch(inference_wav2vec2.emo_model, "forward", "wav2vec2")
+
+    # processor
+    if not real_models:
+        processor.pipeline = stub_sentiment_pipeline(timer.latency)
+    make_pipeline = processor.pipeline
+
+    def timed_pipeline(*args, **kwargs):
+        return timer.wrap(timer.wrap(make_pipeline, "sentiment_load")(*args, **kwargs), "sentiment")
+
+    processor.pipeline = timed_pipeline
+    timer.patch(processor.aai.Transcriber, "transcribe", "transcription")
+    timer.patch(processor, "convert_webm_to_mp4", "convert")
+    timer.patch(processor.DeepFace, "analyze", "face")
+    return main_api.app, processor.app
+
+
+# -----------------------------
+# Driver
+# -----------------------------
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def run_case(client, url, path, timer, repeat, warmup):
+    samples = defaultdict(list)
+    errors = 0
+    for i in range(warmup + repeat):
+        timer.current = defaultdict(float)
+        start = time.perf_counter()
+        with open(path, "rb") as f:
+            response = client.post(url, data={"file": (f, path.name)}, content_type="multipart/form-data")
+        total = time.perf_counter() - start
+        stages, timer.current = timer.current, None
+        if response.status_code != 200:
+            errors += 1
+            print(f"  ⚠️ {url} {path.name}: HTTP {response.status_code} {response.get_data(as_text=True)[:200]}")
+            continue
+        if i < warmup:
+            continue
+        samples["total"].append(total)
+        for stage, seconds in stages.items():
+            samples[stage].append(seconds)
+    return {
+        "runs": len(samples["total"]),
+        "errors": errors,
+        "stages_ms": {stage: {"p50": round(percentile(v, 50), 2), "p95": round(percentile(v, 95), 2)}
+                      for stage, v in sorted(samples.items())},
+    }
+
+
+def compare(results, baseline, tolerance, min_ms):
+    """Stage p95s that grew more than tolerance over the baseline."""
+    problems = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for stage, now in result["stages_ms"].items():
+            before = base["stages_ms"].get(stage)
+            if not before or max(now["p95"], before["p95"]) < min_ms:
+                continue
+            if now["p95"] > before["p95"] * (1 + tolerance):
+                problems.append(f"{name} {stage}: p95 {now['p95']}ms vs baseline {before['p95']}ms")
+        if result["errors"] > base.get("errors", 0):
+            problems.append(f"{name}: {result['errors']} failed requests")
+    return problems
+
+
+def print_table(results):
+    for name, result in results.items():
+        print(f"\n{name}  ({result['runs']} runs, {result['errors']} errors)")
+        for stage, ms in result["stages_ms"].items():
+            print(f"  {stage:<16} p50 {ms['p50']:>9.1f} ms   p95 {ms['p95']:>9.1f} ms")
+
+
+def parse_latency(spec):
+    """"vit=5,whisper=300" -> {"vit": 5.0, "whisper": 300.0}"""
+    latencies = {}
+    for part in filter(None, (spec or "").split(",")):
+        stage, ms = part.split("=")
+        latencies[stage.strip()] = float(ms)
+    return latencies
+
+
+def parse_args():
+    p = argparse.ArgumentParser(description="Analysis endpoint latency benchmark")
+    p.add_argument("--targets", nargs="+", default=["analyze", "analyze-audio", "analyze-video"],
+                   choices=["analyze", "analyze-audio", "analyze-video"])
+    p.add_argument("--quick", action="store_true", help="one media case per kind, 3 runs")
+    p.add_argument("--repeat", type=int, default=REPEAT)
+    p.add_argument("--warmup", type=int, default=WARMUP)
+    p.add_argument("--real-models", action="store_true", help="load the real models instead of stubs")
+    p.add_argument("--stub-latency-ms", default="",
+                   help="simulated stub cost per stage, e.g. vit=5,whisper=300,wav2vec2=80")
+    p.add_argument("--media-dir", help="keep generated media here (default: temporary)")
+    p.add_argument("--json", help="write results to this file")
+    p.add_argument("--baseline", help="results JSON to compare against")
+    p.add_argument("--tolerance", type=float, default=TOLERANCE)
+    p.add_argument("--min-ms", type=float, default=MIN_MS)
+    return p.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.quick:
+        args.repeat = min(args.repeat, 3)
+
+    invoked_from = Path.cwd()
+    workdir = tempfile.mkdtemp(prefix="bench_endpoints_")
+    media_dir = Path(args.media_dir or Path(workdir) / "media").resolve()
+    print("🎬 Generating test media in", media_dir)
+    media = generate_media(media_dir, args.quick)
+
+    os.environ.setdefault("JOBS_DB", os.path.join(workdir, "jobs.db"))  # main_api opens its job queue at import
+    timer = StageTimer()
+    timer.latency = _StubLatency(parse_latency(args.stub_latency_ms))
+    if not args.real_models:
+        install_stub_models(timer.latency)
+    main_app, processor_app = instrument(timer, args.real_models)
+
+    # both services write to ./temp relative to the working directory
+    os.chdir(workdir)
+    os.makedirs("temp", exist_ok=True)
+
+    plan = {
+        "analyze": (main_app, "/analyze", "video"),
+        "analyze-audio": (processor_app, "/analyze-audio", "audio"),
+        "analyze-video": (processor_app, "/analyze-video", "video"),
+    }
+    results = {}
+    for target in args.targets:
+        app, url, kind = plan[target]
+        client = app.test_client()
+        for case, path in media[kind]:
+            name = f"{url}:{case}"
+            print("⏱️", name)
+            results[name] = run_case(client, url, path, timer, args.repeat, args.warmup)
+
+    print_table(results)
+    report = {
+        "meta": {"models": "real" if args.real_models else "stub",
+                 "stub_latency_ms": parse_latency(args.stub_latency_ms),
+                 "repeat": args.repeat, "python": sys.version.split()[0]},
+        "results": results,
+    }
+    if args.json:
+        out = invoked_from / args.json
+        out.write_text(json.dumps(report, indent=2))
+        print("💾 Results written to", out)
+
+    if args.baseline:
+        baseline_path = invoked_from / args.baseline
+        problems = compare(results, json.loads(baseline_path.read_text()), args.tolerance, args.min_ms)
+        for msg in problems:
+            print("❌ Regression:", msg)
+        if problems:
+            sys.exit(1)
+        print("✅ No regressions against", baseline_path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Checkpoint conversion and fast model loading.
+
+best_vit_model.pth and best.pth are pickles: loading them runs the unpickler
+(weights_only=False for the ViT), and the models used to be built with random
+init (timm.create_model / from_pretrained) only to be overwritten. Converting
+them once to safetensors, with key fixes applied at conversion time
+(DataParallel "module." prefixes, the ViT's "head.1.*" from a
+Sequential(Dropout, Linear) head), lets the services:
+
+  - build the model on the meta device (no allocation, no random init)
+  - read the weights from a memory-mapped file, shared between processes
+  - load_state_dict(assign=True), so parameters are the loaded tensors, not copies
+  - fail loudly on missing or unexpected keys (the old strict=False ViT load
+    silently kept a random head)
+
+    python checkpoints.py convert            # writes *.safetensors next to the .pth files
+    python checkpoints.py convert --only vit
+
+Without a (fresh) .safetensors file, load_model() falls back to the .pth.
+"""
+
+import argparse
+import os
+
+import torch
+
+# ---------- CONFIG: change only if needed ----------
+# name -> (pickled checkpoint, safetensors file)
+CHECKPOINTS = {
+    "vit": ("best_vit_model.pth", "best_vit_model.safetensors"),
+    "wav2vec2": ("best.pth", "best.safetensors"),
+}
+# ---------------------------------------------------
+
+
+def _unwrap(obj):
+    """State dict out of whatever torch.save was given (module, training checkpoint dict, state dict)."""
+    if isinstance(obj, torch.nn.Module):
+        return obj.state_dict()
+    for key in ("state_dict", "model_state_dict", "model"):
+        if isinstance(obj, dict) and isinstance(obj.get(key), dict):
+            return obj[key]
+    return obj
+
+
+def remap_keys(name, state):
+    """Checkpoint keys -> the keys of the model the services build."""
+    state = {k[len("module."):] if k.startswith("module.") else k: v for k, v in state.items()}
+    if name == "vit" and "head.weight" not in state:
+        # trained with head = Sequential(Dropout, Linear); timm's head is the Linear itself
+        heads = {k for k in state if k.startswith("head.") and k.count(".") == 2}
+        if heads:
+            state = {("head." + k.split(".", 2)[2] if k in heads else k): v for k, v in state.items()}
+    return state
+
+
+def read_pth(name, path):
+    return remap_keys(name, _unwrap(torch.load(path, map_location="cpu", weights_only=False)))
+
+
+def convert(name):
+    from safetensors.torch import save_file
+
+    pth, out = CHECKPOINTS[name]
+    state = read_pth(name, pth)
+    tensors = {k: v.detach().contiguous() for k, v in state.items() if isinstance(v, torch.Tensor)}
+    skipped = sorted(set(state) - set(tensors))
+    if skipped:
+        print(f"⚠️ {name}: dropped non-tensor entries {skipped}")
+    save_file(tensors, out, metadata={"source": os.path.basename(pth)})
+    print(f"✅ {pth} -> {out} ({len(tensors)} tensors)")
+
+
+def _fresh(pth, out):
+    if not os.path.exists(out):
+        return False
+    if os.path.exists(pth) and os.path.getmtime(pth) > os.path.getmtime(out):
+        print(f"⚠️ {out} is older than {pth}; run `python checkpoints.py convert` again")
+        return False
+    return True
+
+
+def load_model(name, build, device="cpu"):
+    """
+    build() constructs the architecture; it is called on the meta device.
+    Returns the model in eval mode on `device`, with every parameter and
+    buffer taken from the checkpoint.
+    """
+    pth, out = CHECKPOINTS[name]
+    if _fresh(pth, out):
+        from safetensors.torch import load_file
+
+        state = load_file(out)  # memory-mapped; already remapped at conversion
+    else:
+        state = read_pth(name, pth)
+
+    with torch.device("meta"):
+        model = build()
+    # strict: raises on missing/unexpected keys, after the modules' own load
+    # hooks (e.g. weight_norm weight_g/weight_v -> parametrizations) have run
+    model.load_state_dict(state, strict=True, assign=True)
+
+    # non-persistent buffers are not in any checkpoint; nothing may be left on meta
+    on_meta = [n for n, t in list(model.named_parameters()) + list(model.named_buffers()) if t.is_meta]
+    if on_meta:
+        raise RuntimeError(f"{name}: tensors not initialized by the checkpoint: {on_meta[:5]}")
+    return model.to(device).eval()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert model checkpoints to safetensors")
+    parser.add_argument("command", choices=["convert"])
+    parser.add_argument("--only", choices=list(CHECKPOINTS), action="append")
+    args = parser.parse_args()
+    for name in args.only or CHECKPOINTS:
+        convert(name)
@@ -40,3 +40,32 @@ def extract_frames(video_path: str, temp_id: str, fps_sample: int = 2) -> list:
 
     cap.release()
     return frame_paths
+
+
+def extract_frame_arrays(video_path: str, fps_sample: int = 2):
+    """
+    Same sampling as extract_frames(), but keeps the frames in memory instead
+    of writing JPEGs.
+
+    Returns:
+      (frames, timestamps): RGB uint8 array of shape (N, H, W, 3) and the
+      time in seconds of each frame.
+    """
+    cap = cv2.VideoCapture(video_path)
+    vid_fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    duration = total_frames / vid_fps
+
+    frames, times = [], []
+    for t in np.arange(0, int(duration), 1 / fps_sample):
+        cap.set(cv2.CAP_PROP_POS_FRAMES, int(t * vid_fps))
+        ret, frame = cap.read()
+        if not ret:
+            continue
+        frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+        times.append(float(t))
+
+    cap.release()
+    if not frames:
+        return np.zeros((0, 1, 1, 3), dtype=np.uint8), []
+    return np.stack(frames), times
@@ -1,32 +1,110 @@
+import os
+
+import numpy as np
 import torch
+import torch.nn.functional as F
 import timm
 from PIL import Image
-from torchvision import transforms
+from checkpoints import load_model
+from service_metrics import model_forward, model_load
+
+# ---------- CONFIG: change only if needed ----------
+# compile: torch.compile specialized to each batch size | jit: traced + frozen TorchScript per batch size | eager
+VIT_BACKEND = os.getenv("VIT_BACKEND", "compile")
+VIT_BATCH_SIZES = (1, 4, 8, 16)   # batches are padded up to one of these; larger inputs are split
+VIT_WARMUP = os.getenv("VIT_WARMUP", "1") == "1"
+# ---------------------------------------------------
 
 # Label list must match training
 EMOTION_LABELS = ["neutral", "calm", "happy", "sad", "angry", "fearful", "disgust", "surprise"]
+IMG_SIZE = 96
+
+# Load the fine-tuned ViT model (exactly as trained: 96x96 input, patch16).
+# Built on the meta device and filled from best_vit_model.safetensors
+# (checkpoints.py; the head.1 -> head key fix is applied there).
+with model_load("vit"):
+    model = load_model("vit", lambda: timm.create_model(
+        'vit_base_patch16_224',   # ViT-Base with 16x16 patches
+        pretrained=False,
+        num_classes=len(EMOTION_LABELS),
+        img_size=IMG_SIZE         # match 96x96 training resolution
+    ))
+    model.requires_grad_(False)
+
+# Preprocessing: uint8 RGB -> resize to 96x96 -> normalize (ImageNet stats),
+# as one tensor op chain; (x / 255 - mean) / std is folded into x * scale + shift
+MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+SCALE, SHIFT = 1 / (255 * STD), -MEAN / STD
+
+
+def preprocess_frames(frames) -> torch.Tensor:
+    """
+    RGB uint8 frames (N x H x W x 3 array, or a list of H x W x 3 arrays of
+    any sizes) -> normalized (N, 3, 96, 96) float tensor.
+    """
+    if isinstance(frames, np.ndarray) and frames.ndim == 4:
+        groups = [frames]
+    else:
+        groups = [np.asarray(frame)[None] for frame in frames]
+    batches = []
+    for group in groups:
+        x = torch.from_numpy(np.ascontiguousarray(group)).permute(0, 3, 1, 2).float()
+        if x.shape[-2:] != (IMG_SIZE, IMG_SIZE):
+            # antialiased bilinear, like transforms.Resize on PIL images
+            x = F.interpolate(x, size=(IMG_SIZE, IMG_SIZE), mode="bilinear", antialias=True, align_corners=False)
+        batches.append(x.mul_(SCALE).add_(SHIFT))
+    return torch.cat(batches)
+
+
+def _specialize(backend):
+    """batch size -> callable; every entry only ever sees (b, 3, 96, 96)."""
+    if backend == "compile":
+        compiled = torch.compile(model, dynamic=False)  # one graph per batch size, built in warmup
+        return {b: compiled for b in VIT_BATCH_SIZES}
+    if backend == "jit":
+        with torch.no_grad():
+            return {b: torch.jit.freeze(torch.jit.trace(model, torch.zeros(b, 3, IMG_SIZE, IMG_SIZE)))
+                    for b in VIT_BATCH_SIZES}
+    return {b: model for b in VIT_BATCH_SIZES}
+
+
+with model_load(f"vit-{VIT_BACKEND}"):
+    try:
+        runners = _specialize(VIT_BACKEND)
+        if VIT_WARMUP:
+            with torch.inference_mode():
+                for b, run in runners.items():
+                    run(torch.zeros(b, 3, IMG_SIZE, IMG_SIZE))
+    except Exception as e:  # e.g. no C++ compiler for inductor
+        print(f"⚠️ ViT {VIT_BACKEND} backend unavailable, running eager:", e)
+        runners = _specialize("eager")
+
+
+def predict_emotion_vit_batch(batch: torch.Tensor) -> list:
+    """
+    ViT on a preprocessed (N, 3, 96, 96) batch. Runs in chunks of the largest
+    VIT_BATCH_SIZES entry, each padded up to the nearest specialized size.
+    Returns one {'emotion', 'confidence'} dict per row.
+    """
+    largest = VIT_BATCH_SIZES[-1]
+    results = []
+    for start in range(0, len(batch), largest):
+        chunk = batch[start:start + largest]
+        n = len(chunk)
+        size = next(b for b in VIT_BATCH_SIZES if b >= n)
+        if size > n:
+            chunk = torch.cat([chunk, chunk[-1:].expand(size - n, -1, -1, -1)])
+
+        with torch.inference_mode(), model_forward("vit"):
+            probs = torch.softmax(runners[size](chunk)[:n].float(), dim=1)
+            conf, idx = torch.max(probs, dim=1)
+        results.extend(
+            {'emotion': EMOTION_LABELS[i], 'confidence': c}
+            for i, c in zip(idx.tolist(), conf.tolist())
+        )
+    return results
 
-# Load the fine-tuned ViT model (exactly as trained: 96x96 input, patch16)
-model = timm.create_model(
-    'vit_base_patch16_224',   # ViT-Base with 16x16 patches
-    pretrained=False,
-    num_classes=len(EMOTION_LABELS),
-    img_size=96               # match 96x96 training resolution
-)
-# Load checkpoint with non-strict to accommodate head.1 vs head mismatch
-state = torch.load('best_vit_model.pth', map_location='cpu', weights_only=False)
-model.load_state_dict(state, strict=False)
-model.eval()
-
-# Preprocessing: resize to 96x96, normalize (ImageNet stats)
-preprocess = transforms.Compose([
-    transforms.Resize((96, 96)),
-    transforms.ToTensor(),
-    transforms.Normalize(
-        mean=[0.485, 0.456, 0.406],
-        std=[0.229, 0.224, 0.225]
-    )
-])
 
 def predict_emotion_vit(image_path: str) -> dict:
     """
@@ -36,15 +114,15 @@ def predict_emotion_vit(image_path: str) -> dict:
         'confidence': <float 0-1>
       }
     """
-    img = Image.open(image_path).convert('RGB')
-    tensor = preprocess(img).unsqueeze(0)  # shape: (1, 3, 96, 96)
+    img = np.asarray(Image.open(image_path).convert('RGB'))
+    return predict_emotion_vit_batch(preprocess_frames(img[None]))[0]
 
-    with torch.no_grad():
-        logits = model(tensor)
-        probs = torch.softmax(logits, dim=1).squeeze(0)
-        conf, idx = torch.max(probs, dim=0)
 
-    return {
-        'emotion': EMOTION_LABELS[idx.item()],
-        'confidence': conf.item()
-    }
+def predict_emotion_vit_frames(frames) -> list:
+    """
+    Batched variant for in-memory frames: a sequence (or N x H x W x 3 array)
+    of RGB uint8 images. Returns one {'emotion', 'confidence'} dict per frame.
+    """
+    if len(frames) == 0:
+        return []
+    return predict_emotion_vit_batch(preprocess_frames(frames))
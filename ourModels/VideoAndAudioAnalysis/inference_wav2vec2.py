@@ -1,40 +1,80 @@
+import os
 import torch
 import librosa
 import numpy as np
 from transformers import (
+    Wav2Vec2Config,
     Wav2Vec2Processor,
-    Wav2Vec2ForSequenceClassification,
-    WhisperProcessor,
-    WhisperForConditionalGeneration
+    Wav2Vec2ForSequenceClassification
 )
+from asr import get_asr
+from checkpoints import load_model
+from load_control import tier_asr_models
+from service_metrics import model_forward, model_load
+from vad import gate_silence
 
 # Set device
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Windowed emotion: fixed overlapping windows run as batches, so memory does not
+# grow with clip length and we get a per-window timeline. 0 = one full-clip pass.
+EMO_WINDOWED = os.getenv("EMO_WINDOWED", "1") == "1"
+EMO_WINDOW_S = 4.0
+EMO_HOP_S = 2.0
+EMO_BATCH_SIZE = 8
+
 # Emotion labels (update this list based on your training labels)
 emotion_labels = [
     "neutral", "calm", "happy", "sad", "angry", "fearful", "disgust", "surprise"
 ]
 
-# Load Wav2Vec2 Emotion Model
-EMO_MODEL_PATH = "best.pth"
-emo_model = Wav2Vec2ForSequenceClassification.from_pretrained(
-    "facebook/wav2vec2-base", num_labels=len(emotion_labels)
-).to(DEVICE)
-emo_processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base")
+# Load Wav2Vec2 Emotion Model: architecture from the base config only (no
+# pretrained weights to download and overwrite), trained weights from
+# best.safetensors / best.pth (checkpoints.py)
+with model_load("wav2vec2"):
+    emo_config = Wav2Vec2Config.from_pretrained("facebook/wav2vec2-base", num_labels=len(emotion_labels))
+    emo_model = load_model("wav2vec2", lambda: Wav2Vec2ForSequenceClassification(emo_config), DEVICE)
+    emo_processor = Wav2Vec2Processor.from_pretrained("facebook/wav2vec2-base")
+
+# Load Whisper for Speech-to-Text (size, static cache, compile: asr.py / ASR_MODEL)
+stt = get_asr()
+stt_processor, stt_model = stt.processor, stt.model
+# smaller models used by degraded quality tiers (load_control.py), loaded now
+# rather than in the middle of a traffic spike
+for size in tier_asr_models():
+    get_asr(size)
+
+def emotion_windows(audio: np.ndarray, sr: int = 16000, window_s: float = EMO_WINDOW_S,
+                    hop_s: float = EMO_HOP_S, batch_size: int = EMO_BATCH_SIZE):
+    """
+    Runs wav2vec2 over overlapping windows, batch_size windows per forward pass.
+
+    Returns (probs, spans): probs is (n_windows, n_labels), spans the
+    (start, end) sample range of each window. All windows have the same
+    length (the last one is aligned to the end of the clip), so batches need
+    no padding; clips shorter than one window are a single window.
+    """
+    win, hop, n = int(window_s * sr), int(hop_s * sr), len(audio)
+    if n <= win:
+        starts = [0]
+    else:
+        starts = list(range(0, n - win + 1, hop))
+        if starts[-1] + win < n:
+            starts.append(n - win)
+    spans = [(s, min(n, s + win)) for s in starts]
 
-# Load trained weights
-state = torch.load(EMO_MODEL_PATH, map_location=DEVICE)
-emo_model.load_state_dict(state)
-emo_model.eval()
+    probs = []
+    for i in range(0, len(spans), batch_size):
+        batch = [audio[s:e] for s, e in spans[i:i + batch_size]]
+        inputs = emo_processor(batch, sampling_rate=sr, return_tensors='pt', padding=True).to(DEVICE)
+        with torch.no_grad(), model_forward("wav2vec2"):
+            logits = emo_model(**inputs).logits
+        probs.append(torch.softmax(logits.float(), dim=-1).cpu().numpy())
+    return np.concatenate(probs), spans
 
-# Load Whisper for Speech-to-Text
-stt_processor = WhisperProcessor.from_pretrained("openai/whisper-small")
-stt_model = WhisperForConditionalGeneration.from_pretrained("openai/whisper-small").to(DEVICE)
-stt_model.eval()
 
 # Inference function
-def predict_emotion_and_text_wav2vec2(wav_path: str) -> dict:
+def predict_emotion_and_text_wav2vec2(wav_path: str, **options) -> dict:
     """
     Given a path to a WAV file, returns:
       {
@@ -45,21 +85,59 @@ def predict_emotion_and_text_wav2vec2(wav_path: str) -> dict:
 
     # Load & resample to 16kHz
     audio, sr = librosa.load(wav_path, sr=16000)
+    return predict_emotion_and_text_array(audio, sr, **options)
+
+
+def predict_emotion_and_text_array(audio: np.ndarray, sr: int = 16000,
+                                   asr_model: str = None, voice_emotion: bool = True) -> dict:
+    """
+    Same as predict_emotion_and_text_wav2vec2 for 16 kHz mono float32 samples.
+    Silence is cut out first (vad.py), so both models only see voiced audio;
+    'speech_segments' lists the voiced (start, end) seconds of the input.
+    asr_model picks the Whisper size (default ASR_MODEL); voice_emotion=False
+    skips wav2vec2 (no 'emotion' in the result).
+    """
+    voiced = gate_silence(audio, sr)
+    if not voiced.has_speech:
+        return {"transcript": "", "emotion": "neutral", "speech_segments": []}
+    audio = voiced.audio
 
     # --- 1. Speech-to-Text using Whisper ---
-    stt_inputs = stt_processor(audio, sampling_rate=sr, return_tensors='pt').to(DEVICE)
-    with torch.no_grad():
-        generated_ids = stt_model.generate(**stt_inputs)
-        transcription = stt_processor.batch_decode(generated_ids, skip_special_tokens=True)[0]
+    transcription = get_asr(asr_model).transcribe(audio, sr)
+    if not voice_emotion:
+        return {"transcript": transcription, "speech_segments": voiced.segment_times()}
 
     # --- 2. Emotion Classification using Wav2Vec2 ---
-    emo_inputs = emo_processor(audio, sampling_rate=sr, return_tensors='pt', padding=True).to(DEVICE)
-    with torch.no_grad():
-        logits = emo_model(**emo_inputs).logits
-        predicted_id = torch.argmax(logits, dim=-1).item()
-        emotion = emotion_labels[predicted_id]
+    if not EMO_WINDOWED:
+        emo_inputs = emo_processor(audio, sampling_rate=sr, return_tensors='pt', padding=True).to(DEVICE)
+        with torch.no_grad(), model_forward("wav2vec2"):
+            logits = emo_model(**emo_inputs).logits
+            predicted_id = torch.argmax(logits, dim=-1).item()
+            emotion = emotion_labels[predicted_id]
+        return {
+            "transcript": transcription,
+            "emotion": emotion,
+            "speech_segments": voiced.segment_times()
+        }
+
+    probs, spans = emotion_windows(audio, sr)
+    # aggregate: mean probability over windows
+    mean = probs.mean(axis=0)
+    # timeline in the original recording's time (windows are cut from voiced audio)
+    timeline = [
+        {
+            "start": round(voiced.to_original(s / sr), 2),
+            "end": round(voiced.to_original(e / sr), 2),
+            "emotion": emotion_labels[int(p.argmax())],
+            "probs": [round(float(x), 4) for x in p],
+        }
+        for (s, e), p in zip(spans, probs)
+    ]
 
     return {
         "transcript": transcription,
-        "emotion": emotion
+        "emotion": emotion_labels[int(mean.argmax())],
+        "emotion_probs": dict(zip(emotion_labels, (round(float(x), 4) for x in mean))),
+        "emotion_timeline": timeline,
+        "speech_segments": voiced.segment_times()
     }
@@ -0,0 +1,369 @@
+"""
+Asynchronous analysis jobs: a bounded SQLite-backed queue plus worker processes.
+
+    POST /jobs/analyze   -> 202 {"job_id": ...}            (main_api.py)
+                         -> 429 + Retry-After when the queue is full
+    GET  /jobs/<job_id>  -> {"status": "queued|running|done|failed", "result": ...}
+
+Workers claim jobs with a lease and renew it every JOB_HEARTBEAT_SECONDS while
+the job runs, so a job whose worker died is picked up again within
+JOB_LEASE_SECONDS (at most JOB_MAX_ATTEMPTS times), however long a healthy run
+takes. Uploads of a job that is given up are deleted. If the job carries a
+callback_url, the final status is POSTed there as JSON; callbacks may only go
+to JOBS_CALLBACK_HOSTS, or, when that is unset, to public addresses.
+
+main_api.py starts JOBS_LOCAL_WORKERS `python jobs.py worker` processes, so
+they load only the analysis code, not the server. More can run anywhere
+that sees the same JOBS_DB and JOBS_UPLOAD_DIR (e.g. a shared volume):
+
+    python jobs.py worker            # one worker
+    python jobs.py worker -n 3       # three worker processes
+"""
+
+import argparse
+import atexit
+import importlib
+import ipaddress
+import json
+import math
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from contextlib import closing
+from urllib.parse import urlsplit
+
+import requests
+
+# ---------- CONFIG: change only if needed ----------
+JOBS_DB = os.getenv("JOBS_DB", "jobs.db")
+JOBS_UPLOAD_DIR = os.getenv("JOBS_UPLOAD_DIR", "job_uploads")
+JOBS_MAX_QUEUED = int(os.getenv("JOBS_MAX_QUEUED", "32"))      # beyond this, submit -> 429
+JOBS_LOCAL_WORKERS = int(os.getenv("JOBS_LOCAL_WORKERS", "1"))  # started by main_api.py
+JOB_LEASE_SECONDS = 60           # a job is reclaimed this long after its last heartbeat
+JOB_HEARTBEAT_SECONDS = 20
+JOB_MAX_ATTEMPTS = 2
+JOB_RESULT_TTL = 24 * 60 * 60     # finished jobs are purged after this
+POLL_INTERVAL = 0.5
+CALLBACK_TIMEOUT = 10
+CALLBACK_ATTEMPTS = 3
+DEFAULT_JOB_SECONDS = 20          # Retry-After estimate before any job has finished
+# Hosts callback_url may point at (comma separated). Unset: any host that
+# resolves only to public addresses (no loopback, private, link-local, ...).
+JOBS_CALLBACK_HOSTS = {h.strip().lower() for h in os.getenv("JOBS_CALLBACK_HOSTS", "").split(",") if h.strip()}
+# job kind -> "module:function"; handlers take the payload dict and return a JSON-able result
+HANDLERS = {
+    "analyze": "analysis:run_analysis_job",
+}
+# ---------------------------------------------------
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id           TEXT PRIMARY KEY,
+    kind         TEXT NOT NULL,
+    status       TEXT NOT NULL,
+    payload      TEXT NOT NULL,
+    result       TEXT,
+    error        TEXT,
+    callback_url TEXT,
+    attempts     INTEGER NOT NULL DEFAULT 0,
+    worker       TEXT,
+    created      REAL NOT NULL,
+    started      REAL,
+    finished     REAL,
+    lease_until  REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created);
+"""
+
+
+class QueueFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"job queue is full, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def check_callback_url(url):
+    """Raises ValueError unless the server may POST to `url` (see JOBS_CALLBACK_HOSTS)."""
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError("callback_url must be an http(s) URL")
+    host = parts.hostname.lower()
+    if JOBS_CALLBACK_HOSTS:
+        if host not in JOBS_CALLBACK_HOSTS:
+            raise ValueError(f"callback host {host} is not allowed")
+        return
+    try:
+        infos = socket.getaddrinfo(host, parts.port or (443 if parts.scheme == "https" else 80))
+    except socket.gaierror:
+        raise ValueError(f"callback host {host} does not resolve")
+    for info in infos:
+        if not ipaddress.ip_address(info[4][0].split("%")[0]).is_global:
+            raise ValueError(f"callback host {host} is not a public address")
+
+
+def _remove_uploads(payload):
+    """Deletes the payload's files inside JOBS_UPLOAD_DIR (the job owns them)."""
+    upload_dir = os.path.abspath(JOBS_UPLOAD_DIR)
+    for value in payload.values():
+        if isinstance(value, str) and os.path.dirname(os.path.abspath(value)) == upload_dir:
+            if os.path.exists(value):
+                os.remove(value)
+
+
+class JobQueue:
+    """
+    SQLite job broker. Every call opens its own connection, so one instance
+    can be shared by Flask threads and each process gets independent handles.
+    """
+
+    def __init__(self, path=JOBS_DB, max_queued=JOBS_MAX_QUEUED):
+        self.path = path
+        self.max_queued = max_queued
+        with closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def depth(self):
+        with closing(self._connect()) as conn:
+            return conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+
+    def retry_after(self, workers=JOBS_LOCAL_WORKERS):
+        """Seconds until the queue should have room: queued jobs x recent mean duration / workers."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT AVG(finished - started) FROM (SELECT finished, started FROM jobs "
+                "WHERE status = 'done' ORDER BY finished DESC LIMIT 20)"
+            ).fetchone()
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        mean = row[0] or DEFAULT_JOB_SECONDS
+        backlog = max(1, queued - self.max_queued + 1)
+        return max(1, math.ceil(backlog * mean / max(1, workers)))
+
+    def check_capacity(self):
+        """Raises QueueFull early, before the caller stores a large upload."""
+        if self.depth() >= self.max_queued:
+            raise QueueFull(self.retry_after())
+
+    def submit(self, kind, payload, callback_url=None):
+        """Enqueues a job and returns its id, or raises QueueFull."""
+        job_id = uuid.uuid4().hex
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")  # count + insert atomically across processes
+            queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            if queued >= self.max_queued:
+                conn.execute("ROLLBACK")
+                raise QueueFull(self.retry_after())
+            conn.execute(
+                "INSERT INTO jobs (id, kind, status, payload, callback_url, created) VALUES (?, ?, 'queued', ?, ?, ?)",
+                (job_id, kind, json.dumps(payload), callback_url, time.time()),
+            )
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        return job_id
+
+    def claim(self, worker_id):
+        """Leases the oldest runnable job (queued, or running with an expired lease)."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'queued' OR (status = 'running' AND lease_until < ?) "
+                "ORDER BY created LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            if row["attempts"] >= JOB_MAX_ATTEMPTS:
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', error = ?, finished = ?, lease_until = NULL WHERE id = ?",
+                    (f"gave up after {row['attempts']} attempts (worker lost)", now, row["id"]),
+                )
+                conn.execute("COMMIT")
+                _remove_uploads(json.loads(row["payload"]))
+                return self.claim(worker_id)
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, attempts = attempts + 1, "
+                "started = ?, lease_until = ? WHERE id = ?",
+                (worker_id, now, now + JOB_LEASE_SECONDS, row["id"]),
+            )
+            conn.execute("COMMIT")
+            return dict(row)
+        finally:
+            conn.close()
+
+    def renew(self, job_id, worker_id):
+        """Extends the lease of a job this worker is running; False if it lost the job."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (time.time() + JOB_LEASE_SECONDS, job_id, worker_id),
+            )
+            return cur.rowcount == 1
+
+    def _finish(self, job_id, worker_id, status, result=None, error=None):
+        """Records the outcome if this worker still holds the job; False if it lost it."""
+        with closing(self._connect()) as conn:
+            cur = conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, lease_until = NULL "
+                "WHERE id = ? AND worker = ? AND status = 'running'",
+                (status, json.dumps(result) if result is not None else None, error, time.time(),
+                 job_id, worker_id),
+            )
+            return cur.rowcount == 1
+
+    def complete(self, job_id, worker_id, result):
+        return self._finish(job_id, worker_id, "done", result=result)
+
+    def fail(self, job_id, worker_id, error):
+        return self._finish(job_id, worker_id, "failed", error=error)
+
+    def get(self, job_id):
+        """Public view of a job, or None."""
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            position = None
+            if row["status"] == "queued":
+                position = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND created < ?", (row["created"],)
+                ).fetchone()[0]
+        job = {"job_id": row["id"], "kind": row["kind"], "status": row["status"], "created": row["created"],
+               "started": row["started"], "finished": row["finished"]}
+        if position is not None:
+            job["queue_position"] = position
+        if row["result"] is not None:
+            job["result"] = json.loads(row["result"])
+        if row["error"] is not None:
+            job["error"] = row["error"]
+        return job
+
+    def purge(self, max_age=JOB_RESULT_TTL):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+                         (time.time() - max_age,))
+
+
+# -----------------------------
+# Workers
+# -----------------------------
+def _resolve(handler):
+    module, func = handler.split(":")
+    return getattr(importlib.import_module(module), func)
+
+
+def send_callback(url, body):
+    try:
+        check_callback_url(url)  # again: DNS may have changed since submission
+    except ValueError as e:
+        print(f"⚠️ Callback to {url} refused:", e)
+        return
+    for attempt in range(CALLBACK_ATTEMPTS):
+        try:
+            requests.post(url, json=body, timeout=CALLBACK_TIMEOUT, allow_redirects=False).raise_for_status()
+            return
+        except requests.RequestException as e:
+            print(f"⚠️ Callback to {url} failed ({attempt + 1}/{CALLBACK_ATTEMPTS}):", e)
+            time.sleep(2 ** attempt)
+
+
+def _heartbeat(queue, job_id, worker_id, done):
+    """Keeps the job's lease alive until `done` is set."""
+    while not done.wait(JOB_HEARTBEAT_SECONDS):
+        try:
+            if not queue.renew(job_id, worker_id):
+                print(f"⚠️ {worker_id} lost the lease on job {job_id}")
+                return
+        except sqlite3.Error as e:
+            print("⚠️ Lease renewal failed:", e)
+
+
+def worker_main(db_path=JOBS_DB):
+    """Claims and runs jobs forever. Models load once, on the first job of each kind."""
+    queue = JobQueue(db_path)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    handlers = {}
+    last_purge = 0.0
+    print("👷 Job worker", worker_id, "started")
+    while True:
+        if time.time() - last_purge > 3600:
+            queue.purge()
+            last_purge = time.time()
+
+        job = queue.claim(worker_id)
+        if job is None:
+            time.sleep(POLL_INTERVAL)
+            continue
+
+        print(f"👷 {worker_id} running {job['kind']} job {job['id']}")
+        done = threading.Event()
+        threading.Thread(target=_heartbeat, args=(queue, job["id"], worker_id, done), daemon=True).start()
+        try:
+            if job["kind"] not in handlers:
+                handlers[job["kind"]] = _resolve(HANDLERS[job["kind"]])
+            payload = json.loads(job["payload"])
+            payload["queue_wait_s"] = time.time() - job["created"]  # handlers may adapt to the backlog
+            result = handlers[job["kind"]](payload)
+            recorded = queue.complete(job["id"], worker_id, result)
+            body = {"job_id": job["id"], "status": "done", "result": result}
+        except Exception as e:
+            recorded = queue.fail(job["id"], worker_id, str(e))
+            body = {"job_id": job["id"], "status": "failed", "error": str(e)}
+        finally:
+            done.set()
+        if not recorded:
+            # the lease expired and another worker owns the job now; its outcome stands
+            print(f"⚠️ {worker_id} lost job {job['id']}, dropping its {body['status']} result")
+            continue
+        if job["callback_url"]:
+            send_callback(job["callback_url"], body)
+
+
+def start_workers(n=JOBS_LOCAL_WORKERS, db_path=JOBS_DB):
+    """Starts n `python jobs.py worker` processes.
+
+    A fresh interpreter on this file imports only the job handlers, not the
+    caller's module (main_api's Flask app, TTS client pool and models).
+    """
+    procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "worker", "--db", db_path])
+             for _ in range(n)]
+    atexit.register(_stop_workers, procs)
+    return procs
+
+
+def _stop_workers(procs):
+    for proc in procs:
+        if proc.poll() is None:
+            proc.terminate()
+    for proc in procs:
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analysis job worker")
+    parser.add_argument("command", choices=["worker"])
+    parser.add_argument("-n", "--workers", type=int, default=1)
+    parser.add_argument("--db", default=JOBS_DB)
+    args = parser.parse_args()
+    if args.workers == 1:
+        worker_main(args.db)
+    else:
+        for proc in start_workers(args.workers, args.db):
+            proc.wait()
@@ -0,0 +1,245 @@
+"""
+Live analysis over a WebSocket (main_api.py: /ws/live).
+
+Protocol
+--------
+client -> server
+  text   {"type": "start", "sample_rate": 16000, "format": "s16le" | "f32le"}   (optional, these are the defaults;
+                                            other rates are resampled to 16 kHz as one continuous stream)
+  binary 0x01 + PCM mono samples            audio chunk, any size
+  binary 0x02 + JPEG/PNG bytes              video frame (a few per second is plenty)
+  text   {"type": "stop"}                   ends the session
+server -> client
+  text   {"type": "update", "time": s, "face": {...} | null, "voice": {...} | null, "transcript": "..."}
+  text   {"type": "error", "error": "..."}
+
+Every session holds a fixed ring buffer of the last LIVE_RING_SECONDS of
+audio and only the newest frame, so per-session memory and work are bounded
+however long the session runs. A worker thread runs ViT on the newest frame
+and the voice models (VAD + Whisper + windowed wav2vec2, analysis.voice_from_audio)
+on the ring every LIVE_VOICE_INTERVAL_S; the socket thread pushes an update
+every LIVE_UPDATE_INTERVAL_S when something changed.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from analysis import face_emotions_from_frames, voice_from_audio
+from service_metrics import stage
+
+# ---------- CONFIG: change only if needed ----------
+LIVE_MAX_SESSIONS = int(os.getenv("LIVE_MAX_SESSIONS", "4"))
+LIVE_SAMPLE_RATE = 16000          # what the voice models expect
+LIVE_INPUT_RATES = (8000, 192000) # accepted client sample rates (min, max)
+LIVE_RING_SECONDS = 8.0           # audio context kept per session
+LIVE_UPDATE_INTERVAL_S = 0.3      # push cadence
+LIVE_VOICE_INTERVAL_S = 1.0       # voice models re-run at most this often
+LIVE_MIN_NEW_AUDIO_S = 0.5        # ...and only after this much new audio
+LIVE_IDLE_TIMEOUT_S = 30          # close sessions that stop sending
+LIVE_MAX_MESSAGE_BYTES = 2 * 1024 * 1024
+# ---------------------------------------------------
+
+AUDIO, FRAME = 0x01, 0x02
+PCM_FORMATS = {"s16le": (np.int16, 32768.0), "f32le": (np.float32, 1.0)}
+live_slots = threading.BoundedSemaphore(LIVE_MAX_SESSIONS)
+
+
+class AudioRing:
+    """Fixed-size float32 ring of the most recent samples."""
+
+    def __init__(self, seconds, sr):
+        self.sr = sr
+        self.buf = np.zeros(int(seconds * sr), dtype=np.float32)
+        self.written = 0  # total samples ever written (the session's audio clock)
+        self._lock = threading.Lock()
+
+    def write(self, samples):
+        size = len(self.buf)
+        with self._lock:
+            if len(samples) > size:  # only the tail survives; keep the clock exact
+                self.written += len(samples) - size
+                samples = samples[-size:]
+            idx = self.written % size
+            first = min(len(samples), size - idx)
+            self.buf[idx:idx + first] = samples[:first]
+            self.buf[:len(samples) - first] = samples[first:]
+            self.written += len(samples)
+
+    def latest(self):
+        """(samples in time order, audio clock in seconds)."""
+        size = len(self.buf)
+        with self._lock:
+            if self.written < size:
+                return self.buf[:self.written].copy(), self.written / self.sr
+            idx = self.written % size
+            return np.concatenate([self.buf[idx:], self.buf[:idx]]), self.written / self.sr
+
+    @property
+    def seconds(self):
+        return self.written / self.sr
+
+
+def decode_pcm(payload, fmt):
+    dtype, scale = PCM_FORMATS[fmt]
+    return np.frombuffer(payload, dtype=dtype).astype(np.float32) / scale
+
+
+def input_resampler(sr):
+    """
+    None when sr is already LIVE_SAMPLE_RATE, else a soxr stream that keeps
+    its filter state between chunks (resampling each chunk on its own leaves
+    a click at every chunk boundary).
+    """
+    if sr == LIVE_SAMPLE_RATE:
+        return None
+    import soxr
+
+    return soxr.ResampleStream(sr, LIVE_SAMPLE_RATE, 1, dtype="float32")
+
+
+class LiveSession:
+    def __init__(self):
+        self.audio = AudioRing(LIVE_RING_SECONDS, LIVE_SAMPLE_RATE)
+        self.fmt, self.sr = "s16le", LIVE_SAMPLE_RATE
+        self._resampler = None
+        self._frame = None                # newest undecoded frame only
+        self._frame_lock = threading.Lock()
+        self.face = self.voice = None
+        self.transcript = ""
+        self.version = 0                  # bumped whenever an estimate changes
+        self.errors = queue.Queue()
+        self._stop = threading.Event()
+        self._worker = threading.Thread(target=self._run, daemon=True)
+
+    # -- input (socket thread) --
+    def handle_message(self, message):
+        """Returns False when the client asked to stop."""
+        if isinstance(message, str):
+            msg = json.loads(message)
+            if msg.get("type") == "start":
+                self.configure(msg.get("sample_rate", LIVE_SAMPLE_RATE), msg.get("format", "s16le"))
+            return msg.get("type") != "stop"
+        if len(message) > LIVE_MAX_MESSAGE_BYTES or not message:
+            raise ValueError("message empty or too large")
+        kind, payload = message[0], bytes(message[1:])
+        if kind == AUDIO:
+            samples = decode_pcm(payload, self.fmt)
+            if self._resampler is not None:
+                samples = self._resampler.resample_chunk(samples)
+            self.audio.write(samples)
+        elif kind == FRAME:
+            with self._frame_lock:
+                self._frame = payload  # older unprocessed frames are simply dropped
+        return True
+
+    def configure(self, sample_rate, fmt):
+        """Validates the client's "start" settings; ValueError goes back to the client."""
+        if fmt not in PCM_FORMATS:
+            raise ValueError(f"format must be one of {sorted(PCM_FORMATS)}")
+        low, high = LIVE_INPUT_RATES
+        if not isinstance(sample_rate, int) or not low <= sample_rate <= high:
+            raise ValueError(f"sample_rate must be an integer between {low} and {high}")
+        self.fmt, self.sr = fmt, sample_rate
+        self._resampler = input_resampler(sample_rate)
+
+    # -- analysis (worker thread) --
+    def start(self):
+        self._worker.start()
+
+    def stop(self):
+        self._stop.set()
+        self._worker.join(timeout=5)
+
+    def _run(self):
+        last_voice_at, last_voice_clock = 0.0, 0.0
+        while not self._stop.is_set():
+            did_work = False
+            with self._frame_lock:
+                frame, self._frame = self._frame, None
+            try:
+                if frame is not None:
+                    image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+                    if image is not None:
+                        with stage("live_face"):
+                            result = face_emotions_from_frames(cv2.cvtColor(image, cv2.COLOR_BGR2RGB)[None])[0]
+                        self.face = {"emotion": result["emotion"], "confidence": round(result["confidence"], 4),
+                                     "time": round(self.audio.seconds, 2)}
+                        self.version += 1
+                    did_work = True
+
+                now = time.monotonic()
+                if (now - last_voice_at >= LIVE_VOICE_INTERVAL_S
+                        and self.audio.seconds - last_voice_clock >= LIVE_MIN_NEW_AUDIO_S):
+                    samples, clock = self.audio.latest()
+                    with stage("live_voice"):
+                        result = voice_from_audio(samples, LIVE_SAMPLE_RATE)
+                    last_voice_at, last_voice_clock = now, clock
+                    self.voice = self._current_voice(result, clock, len(samples) / LIVE_SAMPLE_RATE)
+                    self.transcript = result.get("transcript", "")
+                    self.version += 1
+                    did_work = True
+            except Exception as e:
+                self.errors.put(str(e))
+            if not did_work:
+                self._stop.wait(0.05)
+
+    @staticmethod
+    def _current_voice(result, clock, ring_seconds):
+        """Latest window of the timeline (ring time -> session time), else the aggregate."""
+        timeline = result.get("emotion_timeline") or []
+        offset = clock - ring_seconds
+        if timeline:
+            last = timeline[-1]
+            return {"emotion": last["emotion"], "confidence": round(max(last["probs"]), 4),
+                    "start": round(offset + last["start"], 2), "end": round(offset + last["end"], 2)}
+        if not result.get("speech_segments"):
+            return None  # silence in the whole ring
+        return {"emotion": result.get("emotion"), "start": round(offset, 2), "end": round(clock, 2)}
+
+    def update(self):
+        return {"type": "update", "time": round(self.audio.seconds, 2), "face": self.face,
+                "voice": self.voice, "transcript": self.transcript}
+
+
+def serve_socket(ws):
+    """flask-sock handler body: one live session per connection."""
+    if not live_slots.acquire(blocking=False):
+        ws.send(json.dumps({"type": "error", "error": "too many live sessions, retry later"}))
+        ws.close(reason=1013)  # try again later
+        return
+
+    session = LiveSession()
+    session.start()
+    sent_version, next_push, last_message = -1, time.monotonic(), time.monotonic()
+    try:
+        while True:
+            timeout = max(0.0, next_push - time.monotonic())
+            message = ws.receive(timeout=timeout)
+            now = time.monotonic()
+            if message is not None:
+                last_message = now
+                try:
+                    if not session.handle_message(message):
+                        ws.send(json.dumps(session.update()))
+                        break
+                except ValueError as e:  # bad JSON, bad PCM length, oversized message
+                    ws.send(json.dumps({"type": "error", "error": str(e)}))
+            elif now - last_message > LIVE_IDLE_TIMEOUT_S:
+                break
+
+            while not session.errors.empty():
+                ws.send(json.dumps({"type": "error", "error": session.errors.get()}))
+            if now >= next_push:
+                if session.version != sent_version:
+                    sent_version = session.version
+                    ws.send(json.dumps(session.update()))
+                next_push = now + LIVE_UPDATE_INTERVAL_S
+    finally:
+        session.stop()
+        live_slots.release()
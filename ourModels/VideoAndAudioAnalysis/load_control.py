@@ -0,0 +1,106 @@
+"""
+Load-aware quality tiers for /analyze.
+
+Under load every request degrading a little keeps p95 latency stable, where
+running the full pipeline for everyone makes them all time out.
+LoadController watches the number of analyses in flight and how long
+requests waited for a slot (or a job for a worker), and moves one tier at a
+time:
+
+    full      2 frames/s, ASR_MODEL (whisper-small), windowed wav2vec2
+    reduced   1 frame/s,  whisper-base,              windowed wav2vec2
+    minimal   0.5 frame/s, whisper-tiny,             no voice emotion model
+
+It steps down when either signal is over its high mark, at most one tier per
+LOAD_STEP_DOWN_S, so a single burst costs one tier rather than all of them.
+It steps back up only when both signals are under their low marks and the
+tier has been held for LOAD_TIER_HOLD_S. LOAD_MAX_TIER=full disables it.
+
+    load_controller.enter()                   # request accepted (waiting counts as in flight)
+    try:
+        ...wait for a slot...
+        tier = load_controller.observe_wait(wait_s)
+        run_analysis(..., tier=tier)
+    finally:
+        load_controller.exit()
+"""
+
+import os
+import threading
+import time
+
+# ---------- CONFIG: change only if needed ----------
+TIERS = {
+    "full": {"fps_sample": 2, "asr_model": None, "voice_emotion": True},   # None: ASR_MODEL
+    "reduced": {"fps_sample": 1, "asr_model": "base", "voice_emotion": True},
+    "minimal": {"fps_sample": 0.5, "asr_model": "tiny", "voice_emotion": False},
+}
+LOAD_MAX_TIER = os.getenv("LOAD_MAX_TIER", "minimal")   # lowest tier allowed
+IN_FLIGHT_HIGH = int(os.getenv("LOAD_IN_FLIGHT_HIGH", "2"))
+IN_FLIGHT_LOW = int(os.getenv("LOAD_IN_FLIGHT_LOW", "1"))
+WAIT_HIGH_S = float(os.getenv("LOAD_WAIT_HIGH_S", "2.0"))
+WAIT_LOW_S = float(os.getenv("LOAD_WAIT_LOW_S", "0.5"))
+LOAD_STEP_DOWN_S = 2.0   # min time between two step-downs
+LOAD_TIER_HOLD_S = 10.0  # min time in a tier before stepping back up
+WAIT_SMOOTHING = 0.3     # EWMA weight of the newest wait sample
+# ---------------------------------------------------
+
+TIER_NAMES = list(TIERS)
+
+
+class LoadController:
+    def __init__(self, max_tier=LOAD_MAX_TIER):
+        self.max_level = TIER_NAMES.index(max_tier)
+        self.level = 0
+        self.in_flight = 0
+        self.wait_s = 0.0                    # smoothed
+        self._changed = float("-inf")       # last tier change (monotonic)
+        self._lock = threading.Lock()
+
+    @property
+    def tier(self):
+        return TIER_NAMES[self.level]
+
+    def _update(self):
+        now = time.monotonic()
+        held = now - self._changed
+        if self.in_flight > IN_FLIGHT_HIGH or self.wait_s > WAIT_HIGH_S:
+            if self.level >= self.max_level or held < LOAD_STEP_DOWN_S:
+                return
+            self.level += 1
+        elif (self.in_flight <= IN_FLIGHT_LOW and self.wait_s < WAIT_LOW_S and self.level > 0
+              and held >= LOAD_TIER_HOLD_S):
+            self.level -= 1
+        else:
+            return
+        self._changed = now
+        print(f"🎚️ Analysis quality -> {self.tier} (in flight {self.in_flight}, wait {self.wait_s:.1f}s)")
+
+    def observe_wait(self, wait_s):
+        """Records one queue wait and returns the tier to use for that request."""
+        with self._lock:
+            self.wait_s += WAIT_SMOOTHING * (wait_s - self.wait_s)
+            self._update()
+            return self.tier
+
+    def enter(self):
+        with self._lock:
+            self.in_flight += 1
+            self._update()
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+            if self.in_flight == 0:
+                self.wait_s *= 1 - WAIT_SMOOTHING  # idle: nobody is waiting any more
+            self._update()
+
+
+def tier_settings(tier):
+    return TIERS[tier or "full"]
+
+
+def tier_asr_models(max_tier=LOAD_MAX_TIER):
+    """Whisper sizes the allowed degraded tiers use (to preload them)."""
+    allowed = TIER_NAMES[:TIER_NAMES.index(max_tier) + 1]
+    return [TIERS[t]["asr_model"] for t in allowed if TIERS[t]["asr_model"]]
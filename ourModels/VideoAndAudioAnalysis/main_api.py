@@ -1,86 +1,83 @@
-from flask import Flask, request, jsonify,render_template_string,Response
+from flask import Flask, request, jsonify,render_template_string,Response,stream_with_context,send_file
 import os
+import time
 import uuid
-from pathlib import Path
-from moviepy import VideoFileClip
-from inference_vit import predict_emotion_vit
-from inference_wav2vec2 import predict_emotion_and_text_wav2vec2
-from frame_utils import extract_frames
-from collections import Counter
-from gradio_client import Client, handle_file
-from pathlib import Path
-import base64, requests, mimetypes, os
+import threading
+from analysis import run_analysis
+from load_control import LoadController
+from jobs import JobQueue, QueueFull, JOBS_UPLOAD_DIR, JOBS_LOCAL_WORKERS, start_workers, check_callback_url
+from tts_cache import TTSCache, cache_key, WARMUP_PHRASES
+from tts_backend import create_backend, start_download_janitor
+from tts_stream import synthesize_stream
+from audio_encoding import TranscodeError, choose_format, ffmpeg_available, mime_for, transcode_stream
+from service_metrics import install_metrics, stage, track_queue
+from request_profiler import install_profiler
+
+try:
+    from flask_sock import Sock
+except ImportError:  # optional: pip install flask-sock for /ws/live
+    Sock = None
 
 app = Flask(__name__)
+install_metrics(app)
+install_profiler(app, paths=("/analyze", "/synthesize"))
+sock = Sock(app) if Sock else None
 PORT = 5173
 
 # ---------- CONFIG: change only if needed ----------
-HF_SPACE = "ResembleAI/Chatterbox"   # Hugging Face Space used
-SAMPLE_PROMPT_URL = "https://github.com/gradio-app/gradio/raw/main/test/test_files/audio_sample.wav"
-# Fixed parameters for every request:
-PARAM_EXAGGERATION = 0.6
-PARAM_TEMPERATURE = 0.75
-PARAM_SEED = 0
-PARAM_CFGW =0.35
-PARAM_VAD_TRIM = False
-API_NAME = "/generate_tts_audio"
-DOWNLOAD_DIR = "./downloads"  # where gradio_client will place downloaded files
+TTS_WARMUP = os.getenv("TTS_WARMUP", "1") == "1"  # preload WARMUP_PHRASES at startup
+# Synchronous /analyze calls handled at once; others wait up to ANALYZE_MAX_WAIT_S,
+# then get 429 (use /jobs/analyze for long videos)
+ANALYZE_MAX_CONCURRENT = int(os.getenv("ANALYZE_MAX_CONCURRENT", "2"))
+ANALYZE_MAX_WAIT_S = float(os.getenv("ANALYZE_MAX_WAIT_S", "5"))
+ANALYZE_RETRY_AFTER = 10  # seconds
+# TTS backend settings (Space, voice prompt, fixed params) live in tts_backend.py
 # ---------------------------------------------------
 
+# Long-lived backend (pooled Space clients) shared by every /synthesize call
+tts_backend = create_backend()
+tts_cache = TTSCache()
+# Bounded job queue for /jobs/analyze (workers: jobs.py)
+job_queue = JobQueue()
+track_queue("analysis_jobs", job_queue.depth)
+analyze_slots = threading.BoundedSemaphore(ANALYZE_MAX_CONCURRENT)
+# Picks the /analyze quality tier from in-flight requests and slot wait (load_control.py)
+load_controller = LoadController()
 
-def ensure_download_dir():
-    Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
 
-def result_to_bytes_and_mime(result, download_dir=DOWNLOAD_DIR):
+def tts_cache_key(text):
+    return cache_key(text, tts_backend.params())
+
+
+def cached_synthesize(text):
+    """(audio_bytes, mime) for text, through the cache."""
+    return tts_cache.get_or_create(tts_cache_key(text), lambda: tts_backend.synthesize(text))
+
+
+def encoded_response(chunks, fmt, bitrate):
+    """chunks transcoded to fmt; a failed ffmpeg start is a 500, not an empty 200."""
+    try:
+        return Response(transcode_stream(chunks, fmt, bitrate), mimetype=mime_for(fmt))
+    except TranscodeError as e:
+        return jsonify({"error": str(e)}), 500
+
+
+def audio_response(source):
     """
-    Accepts raw result from client.predict and returns (bytes, mime_type).
-    Handles:
-      - bytes / bytearray
-      - data:audio/...;base64,...
-      - http(s) URL pointing to audio (downloads it)
-      - server-local path string (client may have downloaded it to download_dir)
-      - list/tuple (unwraps first element)
+    Sends a cached AudioSource without buffering it:
+      - open cache files through send_file (file wrapper, Range requests)
+      - a URL result still being downloaded into the cache chunk by chunk,
+        as it arrives
+      - in-memory bytes as-is
     """
-    # unwrap list/tuple
-    if isinstance(result, (list, tuple)) and result:
-        result = result[0]
-
-    # raw bytes
-    if isinstance(result, (bytes, bytearray)):
-        return bytes(result), "application/octet-stream"
-
-    # string cases
-    if isinstance(result, str):
-        s = result.strip()
-
-        # 1) data URI
-        if s.startswith("data:audio"):
-            header, b64 = s.split(",", 1)
-            mime = header.split(";")[0].split(":")[1] if ":" in header else "audio/wav"
-            return base64.b64decode(b64), mime
-
-        # 2) http(s) URL -> download
-        if s.startswith("http://") or s.startswith("https://"):
-            r = requests.get(s, stream=True, timeout=30)
-            r.raise_for_status()
-            mime = r.headers.get("Content-Type", "audio/mpeg")
-            return r.content, mime or "audio/mpeg"
-
-        # 3) server-local path string returned by the Space.
-        p = Path(s)
-        if p.exists():
-            raw = p.read_bytes()
-            mime, _ = mimetypes.guess_type(str(p))
-            return raw, mime or "application/octet-stream"
-
-        # 4) check downloads folder for a basename match
-        maybe = Path(download_dir) / Path(s).name
-        if maybe.exists():
-            raw = maybe.read_bytes()
-            mime, _ = mimetypes.guess_type(str(maybe))
-            return raw, mime or "application/octet-stream"
-
-    raise RuntimeError(f"Unhandled model result type: {type(result)} | value: {str(result)[:300]}")
+    if source.file is not None:
+        rv = send_file(source.file, mimetype=source.mime, conditional=False, etag=False)
+        rv.content_length = source.length
+        return rv.make_conditional(request, accept_ranges=True, complete_length=source.length)
+    if source.stream is not None:
+        headers = {"Content-Length": str(source.length)} if source.length else {}
+        return Response(stream_with_context(source.stream), mimetype=source.mime, headers=headers)
+    return Response(source.data, mimetype=source.mime)
 
 
 @app.route("/", methods=["GET"])
@@ -96,50 +93,100 @@ def analyze_video():
     if file.filename == "":
         return jsonify({"error": "Empty filename"}), 400
 
-    temp_id = str(uuid.uuid4())
-    os.makedirs("temp", exist_ok=True)
-    video_path = f"temp/{temp_id}.mp4"
-    audio_path = f"temp/{temp_id}.wav"
+    load_controller.enter()
+    try:
+        waited = time.monotonic()
+        if not analyze_slots.acquire(timeout=ANALYZE_MAX_WAIT_S):
+            load_controller.observe_wait(ANALYZE_MAX_WAIT_S)
+            return too_busy(ANALYZE_RETRY_AFTER, "analysis capacity exhausted")
+        # coarser analysis under load (fewer frames, smaller ASR, no wav2vec2)
+        tier = load_controller.observe_wait(time.monotonic() - waited)
+
+        temp_id = str(uuid.uuid4())
+        os.makedirs("temp", exist_ok=True)
+        video_path = f"temp/{temp_id}.mp4"
+
+        try:
+            # Save video file
+            with stage("save"):
+                file.save(video_path)
+
+            return jsonify(run_analysis(video_path, temp_id, tier))
+
+        finally:
+            analyze_slots.release()
+            # Cleanup temp files
+            if os.path.exists(video_path):
+                os.remove(video_path)
+    finally:
+        load_controller.exit()
+
+
+def too_busy(retry_after, message):
+    response = jsonify({"error": message, "retry_after": retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(retry_after)
+    return response
+
+
+@app.route("/jobs/analyze", methods=["POST"])
+def submit_analyze_job():
+    """Queues an /analyze run and returns 202 with the job id right away."""
+    if "file" not in request.files:
+        return jsonify({"error": "No file uploaded"}), 400
 
+    file = request.files["file"]
+    if file.filename == "":
+        return jsonify({"error": "Empty filename"}), 400
+
+    callback_url = request.form.get("callback_url") or None
+    if callback_url:
+        try:
+            check_callback_url(callback_url)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    # refuse before storing the upload when there is clearly no room
     try:
-        # Save video file
+        job_queue.check_capacity()
+    except QueueFull as e:
+        return too_busy(e.retry_after, "job queue is full")
+
+    temp_id = str(uuid.uuid4())
+    os.makedirs(JOBS_UPLOAD_DIR, exist_ok=True)
+    video_path = os.path.abspath(os.path.join(JOBS_UPLOAD_DIR, f"{temp_id}.mp4"))
+    with stage("save"):
         file.save(video_path)
 
-        # Extract audio from video
-        clip = VideoFileClip(video_path)
-        clip.audio.write_audiofile(audio_path, logger=None)  # disable verbose logs
-        clip.close() 
+    try:
+        job_id = job_queue.submit("analyze", {"video_path": video_path, "temp_id": temp_id}, callback_url)
+    except QueueFull as e:
+        os.remove(video_path)
+        return too_busy(e.retry_after, "job queue is full")
 
-        # Extract frames
-        frame_paths = extract_frames(video_path, temp_id)
+    response = jsonify({"job_id": job_id, "status": "queued", "status_url": f"/jobs/{job_id}"})
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job_id}"
+    return response
 
-        # Face Emotion
-        face_results = [predict_emotion_vit(fp) for fp in frame_paths]
-        face_emotions = [res['emotion'] for res in face_results]
-        face_confidences = [res['confidence'] for res in face_results]
 
-        # Voice Emotion + Transcription
-        voice_result = predict_emotion_and_text_wav2vec2(audio_path)
+@app.route("/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "unknown job"}), 404
+    return jsonify(job)
 
-        # Aggregate (most common emotion)
-        final_face_emotion = Counter(face_emotions).most_common(1)[0][0] if face_emotions else "unknown"
-        avg_face_conf = sum(face_confidences)/len(face_confidences) if face_confidences else 0
 
-        return jsonify({
-            "face_emotion": final_face_emotion,
-            "avg_confidence": round(avg_face_conf, 2),
-            "voice_emotion": voice_result.get("emotion", "unknown"),
-            "transcription": voice_result.get("transcript", "")
-        })
+if sock:
+    from live_session import serve_socket
 
-    finally:
-        # Cleanup temp files
-        if os.path.exists(video_path):
-            os.remove(video_path)
-        if os.path.exists(audio_path):
-            os.remove(audio_path)
-        for fp in Path("temp").glob(f"{temp_id}_frame_*.jpg"):
-            os.remove(fp)
+    @sock.route("/ws/live")
+    def live_session(ws):
+        """Live audio chunks + frames in, emotion/transcript updates out (protocol: live_session.py)."""
+        serve_socket(ws)
+else:
+    print("⚠️ flask-sock not installed: /ws/live is disabled")
 
 
 @app.route("/synthesize", methods=["POST"])
@@ -149,36 +196,60 @@ def synth():
     if not text:
         return jsonify({"error": "text required"}), 400
 
-    ensure_download_dir()
-
-    # Create client with download_files so any server-local paths are downloaded into DOWNLOAD_DIR
-    client = Client(HF_SPACE, download_files=DOWNLOAD_DIR)
-
+    # Output encoding: ?format=opus|mp3|wav (&bitrate=48k) or the Accept header
     try:
-        result = client.predict(
-            text_input=text,
-            audio_prompt_path_input=handle_file(SAMPLE_PROMPT_URL),
-            exaggeration_input=PARAM_EXAGGERATION,
-            temperature_input=PARAM_TEMPERATURE,
-            seed_num_input=PARAM_SEED,
-            cfgw_input=PARAM_CFGW,
-            vad_trim_input=PARAM_VAD_TRIM,
-            api_name=API_NAME,
+        fmt, bitrate = choose_format(
+            data.get("format") or request.args.get("format"),
+            data.get("bitrate") or request.args.get("bitrate"),
+            request.headers.get("Accept"),
         )
+    except ValueError:
+        return jsonify({"error": "invalid bitrate"}), 400
+    if fmt != "wav" and not ffmpeg_available():
+        return jsonify({"error": f"{fmt} encoding unavailable (ffmpeg not installed)"}), 503
+
+    # Streaming mode: synthesize sentence by sentence in parallel and send
+    # audio as soon as the first sentence is ready (16-bit mono WAV unless encoded)
+    if data.get("stream") or request.args.get("stream") == "1":
+        chunks = synthesize_stream(text, cached_synthesize)
+        try:
+            first = next(chunks)
+        except Exception as e:
+            return str(e), 500
+
+        def generate():
+            yield first
+            yield from chunks
+
+        if fmt != "wav":
+            return encoded_response(generate(), fmt, bitrate)
+        return Response(stream_with_context(generate()), mimetype="audio/wav")
+
+    # Output is deterministic for fixed params, so identical texts are served
+    # from the cache and concurrent identical requests share one generation.
+    key = tts_cache_key(text)
+    try:
+        with stage("tts"):
+            source = tts_cache.get_or_create_source(key, lambda: tts_backend.synthesize_source(text))
+        if fmt != "wav":
+            # encoded frames go out while ffmpeg is still reading the source
+            return encoded_response(source.iter_chunks(), fmt, bitrate)
+        return audio_response(source)
     except Exception as e:
         # return exception message for debugging (could be quota or timeout)
         return str(e), 500
 
-    try:
-        audio_bytes, mime = result_to_bytes_and_mime(result, download_dir=DOWNLOAD_DIR)
-    except Exception as e:
-        return f"Could not convert model result: {e}", 500
-
-    # Return audio bytes (stream) with MIME
-    return Response(audio_bytes, mimetype=(mime or "audio/mpeg"))
-
 
 if __name__ == "__main__":
+    start_download_janitor()
+    if JOBS_LOCAL_WORKERS > 0:
+        start_workers(JOBS_LOCAL_WORKERS)
+    if TTS_WARMUP:
+        threading.Thread(
+            target=tts_cache.warmup,
+            args=(WARMUP_PHRASES, tts_cache_key, tts_backend.synthesize),
+            daemon=True,
+        ).start()
     print("App running on port ", PORT)
     app.run(host="0.0.0.0", port=PORT, debug=False)
     
@@ -0,0 +1,197 @@
+"""
+Out-of-process model server for the ViT face model and the Whisper +
+wav2vec2 voice models, so they are loaded once per host instead of once per
+web worker, and model compute does not share the GIL with request handling.
+
+    python model_server.py                               # all models, MODEL_SERVER_SOCKET
+    python model_server.py --models vit --socket /tmp/aitherapist-vit.sock
+    python model_server.py --models voice --socket /tmp/aitherapist-voice.sock
+
+Web workers (analysis.py) use ModelClient when MODEL_SERVER_SOCKET is set;
+MODEL_SERVER_SOCKET_VIT / MODEL_SERVER_SOCKET_VOICE point a model at its own
+server instead.
+
+Transport: multiprocessing.connection over a Unix socket carries only small
+request dicts. Arrays (frames, PCM) are written by the client into a
+multiprocessing.shared_memory block, and the server maps that block as a
+numpy view, so array data is never pickled or sent through the socket.
+"""
+
+import argparse
+import os
+import threading
+from multiprocessing import resource_tracker, shared_memory
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+# ---------- CONFIG: change only if needed ----------
+MODEL_SERVER_SOCKET = os.getenv("MODEL_SERVER_SOCKET")   # unset: models run in-process
+MODEL_SERVER_AUTHKEY = os.getenv("MODEL_SERVER_AUTHKEY", "aitherapist-models").encode()
+DEFAULT_SOCKET = "/tmp/aitherapist-models.sock"
+# ---------------------------------------------------
+
+
+def socket_for(model):
+    """Socket of the server hosting `model` ("vit" or "voice"), or None for in-process."""
+    return os.getenv(f"MODEL_SERVER_SOCKET_{model.upper()}") or MODEL_SERVER_SOCKET
+
+
+# -----------------------------
+# Shared memory helpers
+# -----------------------------
+def _attach(spec):
+    """Maps a client's block as a read-only array (no copy)."""
+    shm = shared_memory.SharedMemory(name=spec["shm"])
+    # the client owns the block; keep this process's tracker from unlinking it at exit
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    array = np.ndarray(spec["shape"], dtype=spec["dtype"], buffer=shm.buf)
+    array.flags.writeable = False
+    return shm, array
+
+
+def _share(array):
+    """Copies `array` into a new shared block; returns (shm, spec)."""
+    array = np.ascontiguousarray(array)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm, {"shm": shm.name, "shape": list(array.shape), "dtype": array.dtype.str}
+
+
+# -----------------------------
+# Server
+# -----------------------------
+def load_ops(models):
+    """op name -> (lock, fn(*arrays, **kwargs)). Each model runs one call at a time."""
+    ops = {}
+    if "vit" in models:
+        from inference_vit import predict_emotion_vit_frames
+
+        ops["vit"] = (threading.Lock(), predict_emotion_vit_frames)
+    if "voice" in models:
+        from inference_wav2vec2 import predict_emotion_and_text_array
+
+        ops["voice"] = (threading.Lock(), predict_emotion_and_text_array)
+    return ops
+
+
+def serve_connection(conn, ops):
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            break
+        if msg.get("op") not in ops:
+            conn.send({"ok": False, "error": f"model '{msg.get('op')}' is not served here"})
+            continue
+        lock, fn = ops[msg["op"]]
+        attached = []
+        try:
+            attached = [_attach(spec) for spec in msg.get("arrays", [])]
+            with lock:
+                result = fn(*(array for _, array in attached), **msg.get("kwargs", {}))
+            conn.send({"ok": True, "result": result})
+        except Exception as e:
+            conn.send({"ok": False, "error": repr(e)})
+        finally:
+            blocks = [shm for shm, _ in attached]
+            attached.clear()  # drop the array views before unmapping
+            for shm in blocks:
+                try:
+                    shm.close()
+                except BufferError:
+                    pass  # a view is still referenced; the mapping goes away with it
+    conn.close()
+
+
+def serve(socket_path, models):
+    ops = load_ops(models)
+    if os.path.exists(socket_path):
+        os.remove(socket_path)
+    listener = Listener(socket_path, family="AF_UNIX", authkey=MODEL_SERVER_AUTHKEY)
+    os.chmod(socket_path, 0o600)
+    print(f"🧠 Model server ({', '.join(ops)}) listening on {socket_path}")
+    try:
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:  # failed handshake, e.g. wrong authkey
+                print("⚠️ Rejected model client:", e)
+                continue
+            threading.Thread(target=serve_connection, args=(conn, ops), daemon=True).start()
+    finally:
+        listener.close()
+
+
+# -----------------------------
+# Client
+# -----------------------------
+class ModelServerError(RuntimeError):
+    pass
+
+
+class ModelClient:
+    """
+    Thread-safe client: one connection per thread, reconnected once on failure.
+    Shared blocks are created per call and unlinked as soon as the reply arrives.
+    """
+
+    def __init__(self, socket_path):
+        self.socket_path = socket_path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = Client(self.socket_path, family="AF_UNIX", authkey=MODEL_SERVER_AUTHKEY)
+        return conn
+
+    def _drop(self):
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            try:
+                conn.close()
+            except OSError:
+                pass
+
+    def call(self, op, *arrays, **kwargs):
+        shared = [_share(a) for a in arrays]
+        try:
+            msg = {"op": op, "arrays": [spec for _, spec in shared], "kwargs": kwargs}
+            for attempt in range(2):
+                try:
+                    conn = self._conn()
+                    conn.send(msg)
+                    reply = conn.recv()
+                    break
+                except (EOFError, OSError):
+                    self._drop()  # server restarted: reconnect once
+                    if attempt:
+                        raise
+        finally:
+            for shm, _ in shared:
+                shm.close()
+                shm.unlink()
+        if not reply["ok"]:
+            raise ModelServerError(reply["error"])
+        return reply["result"]
+
+    def predict_emotion_vit_frames(self, frames):
+        if len(frames) == 0:
+            return []
+        return self.call("vit", np.asarray(frames, dtype=np.uint8))
+
+    def predict_emotion_and_text_array(self, audio, sr=16000, **options):
+        return self.call("voice", np.asarray(audio, dtype=np.float32), sr=sr, **options)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local model server")
+    parser.add_argument("--models", default="vit,voice", help="comma separated: vit, voice")
+    parser.add_argument("--socket", default=MODEL_SERVER_SOCKET or DEFAULT_SOCKET)
+    args = parser.parse_args()
+    serve(args.socket, set(args.models.split(",")))
@@ -0,0 +1,189 @@
+"""
+Opt-in per-request profiling for the Flask services (main_api.py,
+processor.py, mental_chat.py).
+
+    from request_profiler import install_profiler
+    install_profiler(app, paths=("/analyze",))
+
+A request to one of `paths` is profiled when
+  - it carries `X-Profile: cprofile` or `X-Profile: torch` together with
+    `X-Admin-Token: $PROFILE_ADMIN_TOKEN`, or
+  - it is picked by PROFILE_SAMPLE_RATE (cProfile only).
+
+The trace is saved as profiles/<time>_<request id>_<path>.prof (cProfile,
+open with snakeviz / pstats) or .json (torch profiler, chrome://tracing).
+The directory rotates at PROFILE_MAX_FILES / PROFILE_MAX_BYTES. The
+response carries X-Request-ID and X-Profile-Id, and GET /profiles and
+GET /profiles/<name> (admin token required) list and download the traces.
+
+Only one request is profiled at a time: a request that asks for (or is
+sampled for) a profile while another one is running is served unprofiled.
+This is required, not just cheaper: on Python 3.12+ cProfile is built on
+sys.monitoring, which allows a single active profiler per process.
+
+What a cProfile trace covers depends on the Python version. Before 3.12 it
+records the request thread only, so for /chat, where generation runs on the
+batch worker, use the torch profiler. From 3.12 on it records every thread
+in the process while it is enabled, so concurrent requests and background
+workers show up in the trace too.
+"""
+
+import cProfile
+import hmac
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from pathlib import Path
+
+from flask import abort, g, jsonify, request, send_from_directory
+
+# ---------- CONFIG: change only if needed ----------
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "profiles")).resolve()
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")   # unset: header trigger and /profiles disabled
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))   # e.g. 0.01 = 1% of requests
+PROFILE_MAX_FILES = 50
+PROFILE_MAX_BYTES = 512 * 1024 * 1024
+# ---------------------------------------------------
+
+# held while a profile runs; sampling skips requests instead of waiting for it
+_busy = threading.Lock()
+
+
+def is_admin():
+    """True when the request carries X-Admin-Token == PROFILE_ADMIN_TOKEN (also guards other admin endpoints)."""
+    token = request.headers.get("X-Admin-Token", "")
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token, PROFILE_ADMIN_TOKEN)
+
+
+def _wanted_mode():
+    """'cprofile', 'torch' or None for the current request."""
+    mode = request.headers.get("X-Profile", "").lower()
+    if mode in ("cprofile", "torch", "1") and is_admin():
+        return "torch" if mode == "torch" else "cprofile"
+    if PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        return "cprofile"
+    return None
+
+
+def _request_id():
+    rid = request.headers.get("X-Request-ID") or uuid.uuid4().hex[:12]
+    return re.sub(r"[^A-Za-z0-9_-]", "", rid)[:64] or uuid.uuid4().hex[:12]
+
+
+class _TorchProfile:
+    def __init__(self):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self._prof = profile(activities=activities, record_shapes=True)
+
+    def start(self):
+        self._prof.__enter__()
+
+    def stop(self, path):
+        self._prof.__exit__(None, None, None)
+        self._prof.export_chrome_trace(str(path))
+
+
+class _CProfile:
+    def __init__(self):
+        self._prof = cProfile.Profile()
+
+    def start(self):
+        self._prof.enable()
+
+    def stop(self, path):
+        self._prof.disable()
+        self._prof.dump_stats(str(path))
+
+
+def rotate(directory=PROFILE_DIR, max_files=PROFILE_MAX_FILES, max_bytes=PROFILE_MAX_BYTES):
+    """Deletes the oldest traces until the directory fits both limits."""
+    files = sorted((p for p in directory.glob("*") if p.is_file()), key=lambda p: p.stat().st_mtime)
+    total = sum(p.stat().st_size for p in files)
+    while files and (len(files) > max_files or total > max_bytes):
+        oldest = files.pop(0)
+        total -= oldest.stat().st_size
+        oldest.unlink(missing_ok=True)
+
+
+def _start(mode):
+    if not _busy.acquire(blocking=False):
+        return None
+    try:
+        profiler = _TorchProfile() if mode == "torch" else _CProfile()
+        profiler.start()
+        return profiler
+    except Exception as e:
+        _busy.release()
+        print("⚠️ Profiler failed to start:", e)
+        return None
+
+
+def _finish():
+    profiler = g.pop("_profiler", None)
+    if profiler is None:
+        return None
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", request.path).strip("-") or "root"
+    ext = "json" if isinstance(profiler, _TorchProfile) else "prof"
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}_{g._request_id}_{slug}.{ext}"
+    try:
+        PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+        profiler.stop(PROFILE_DIR / name)
+        rotate()
+        print(f"🔬 Profile for {request.method} {request.path} saved as {name}")
+        return name
+    except Exception as e:
+        print("⚠️ Saving profile failed:", e)
+        return None
+    finally:
+        _busy.release()
+
+
+def install_profiler(app, paths):
+    """Profiles requests to `paths` on demand and adds the /profiles endpoints."""
+    paths = set(paths)
+
+    @app.before_request
+    def _profile_start():
+        g._request_id = _request_id()
+        if request.path in paths:
+            mode = _wanted_mode()
+            if mode:
+                g._profiler = _start(mode)
+
+    @app.after_request
+    def _profile_stop(response):
+        # streamed bodies are not covered: the trace ends when the handler returns
+        name = _finish()
+        response.headers["X-Request-ID"] = g.get("_request_id", "")
+        if name:
+            response.headers["X-Profile-Id"] = name
+        return response
+
+    @app.teardown_request
+    def _profile_teardown(exc):
+        _finish()  # the handler raised before after_request
+
+    @app.route("/profiles", methods=["GET"])
+    def list_profiles():
+        if not is_admin():
+            abort(403)
+        files = sorted(PROFILE_DIR.glob("*"), key=lambda p: p.stat().st_mtime, reverse=True) \
+            if PROFILE_DIR.is_dir() else []
+        return jsonify([
+            {"name": p.name, "bytes": p.stat().st_size, "created": p.stat().st_mtime}
+            for p in files if p.is_file()
+        ])
+
+    @app.route("/profiles/<name>", methods=["GET"])
+    def download_profile(name):
+        if not is_admin():
+            abort(403)
+        return send_from_directory(PROFILE_DIR, name, as_attachment=True)
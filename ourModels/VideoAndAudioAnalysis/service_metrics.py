@@ -0,0 +1,131 @@
+"""
+Prometheus metrics shared by the Flask services (main_api.py, processor.py,
+mental_chat.py).
+
+    from service_metrics import install_metrics, stage, model_forward, model_load
+    install_metrics(app)                 # per-request metrics + GET /metrics
+    with stage("frames"): ...            # pipeline stage latency
+    with model_forward("vit"): ...       # one model forward pass
+    with model_load("whisper"): ...      # model load time (gauge)
+    track_queue("chat", pending.qsize)   # queue depth, read at scrape time
+
+prometheus_client is optional: without it every helper is a no-op and
+/metrics answers 503, so the services still run.
+"""
+
+import time
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+try:
+    from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+except ImportError:  # pragma: no cover - optional dependency
+    Counter = Gauge = Histogram = None
+
+# ---------- CONFIG: change only if needed ----------
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+SIZE_BUCKETS = tuple(2 ** p for p in range(10, 32, 2))   # 1 KiB .. 1 GiB
+# ---------------------------------------------------
+
+
+class _Noop:
+    """Stands in for every metric when prometheus_client is missing."""
+
+    def labels(self, *args, **kwargs):
+        return self
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+if Counter is not None:
+    REQUESTS = Counter("http_requests_total", "HTTP requests", ["endpoint", "method", "status"])
+    IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled", ["endpoint"])
+    REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Time to response (first byte for streams)",
+                                ["endpoint"], buckets=LATENCY_BUCKETS)
+    UPLOAD_BYTES = Histogram("http_upload_size_bytes", "Request body size", ["endpoint"], buckets=SIZE_BUCKETS)
+    STAGE_LATENCY = Histogram("pipeline_stage_duration_seconds", "Pipeline stage latency", ["stage"],
+                              buckets=LATENCY_BUCKETS)
+    MODEL_FORWARD = Histogram("model_forward_duration_seconds", "Model forward pass latency", ["model"],
+                              buckets=LATENCY_BUCKETS)
+    MODEL_LOAD = Gauge("model_load_seconds", "Time taken to load a model", ["model"])
+    QUEUE_DEPTH = Gauge("queue_depth", "Items waiting in a queue", ["queue"])
+else:
+    REQUESTS = IN_FLIGHT = REQUEST_LATENCY = UPLOAD_BYTES = _Noop()
+    STAGE_LATENCY = MODEL_FORWARD = MODEL_LOAD = QUEUE_DEPTH = _Noop()
+
+
+def _endpoint():
+    # the route pattern, not the raw path, keeps label cardinality bounded
+    return request.url_rule.rule if request.url_rule is not None else "unmatched"
+
+
+def install_metrics(app):
+    """Adds request count/latency/in-flight/upload-size metrics and GET /metrics."""
+
+    @app.before_request
+    def _metrics_start():
+        if request.path == "/metrics":
+            return
+        g._metrics_start = time.perf_counter()
+        g._metrics_endpoint = _endpoint()
+        IN_FLIGHT.labels(g._metrics_endpoint).inc()
+        if request.content_length:
+            UPLOAD_BYTES.labels(g._metrics_endpoint).observe(request.content_length)
+
+    @app.after_request
+    def _metrics_done(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            endpoint = g._metrics_endpoint
+            REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - start)
+            REQUESTS.labels(endpoint, request.method, str(response.status_code)).inc()
+        return response
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        endpoint = g.pop("_metrics_endpoint", None)
+        if endpoint is not None:
+            IN_FLIGHT.labels(endpoint).dec()
+            # after_request never ran for this one: count it as a failure
+            if g.pop("_metrics_start", None) is not None:
+                REQUESTS.labels(endpoint, request.method, "500").inc()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        if Counter is None:
+            return Response("prometheus_client is not installed\n", status=503, mimetype="text/plain")
+        return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
+
+@contextmanager
+def stage(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_LATENCY.labels(name).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def model_forward(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        MODEL_FORWARD.labels(name).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def model_load(name):
+    start = time.perf_counter()
+    yield
+    seconds = time.perf_counter() - start
+    MODEL_LOAD.labels(name).set(seconds)
+    print(f"⏱️ Loaded {name} in {seconds:.1f}s")
+
+
+def track_queue(name, depth_fn):
+    """Reports depth_fn() as queue_depth{queue=name} whenever /metrics is scraped."""
+    QUEUE_DEPTH.labels(name).set_function(depth_fn)
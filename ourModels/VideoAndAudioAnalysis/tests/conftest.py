@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the service modules are flat scripts run from ourModels/VideoAndAudioAnalysis
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
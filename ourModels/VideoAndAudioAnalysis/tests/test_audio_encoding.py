@@ -0,0 +1,68 @@
+import subprocess
+import sys
+
+import pytest
+
+import audio_encoding
+from audio_encoding import TranscodeError, choose_format, transcode_stream
+
+
+class Chunks:
+    """Iterable of byte chunks that records whether it was closed."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.closed = False
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """Runs `script` (python source reading stdin) instead of ffmpeg."""
+    popen = subprocess.Popen
+
+    def use(script):
+        monkeypatch.setattr(audio_encoding.subprocess, "Popen",
+                            lambda command, **kwargs: popen([sys.executable, "-c", script], **kwargs))
+
+    return use
+
+
+def test_choose_format_prefers_query_then_accept():
+    assert choose_format("mp3") == ("mp3", "64k")
+    assert choose_format(None, None, "text/html, audio/ogg;q=0.9") == ("opus", "32k")
+    assert choose_format(None, None, "text/html") == ("wav", None)
+    assert choose_format("opus", "999k") == ("opus", f"{audio_encoding.MAX_BITRATE_KBPS}k")
+    with pytest.raises(ValueError):
+        choose_format("mp3", "fast")
+
+
+def test_transcode_stream_yields_ffmpeg_output(fake_ffmpeg):
+    fake_ffmpeg("import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)")
+    chunks = Chunks([b"RIFF", b"data"])
+    assert b"".join(transcode_stream(chunks, "mp3")) == b"RIFFdata"
+    assert chunks.closed
+
+
+def test_transcode_stream_raises_before_responding_when_ffmpeg_fails(fake_ffmpeg):
+    fake_ffmpeg("import sys; sys.stdin.buffer.read(); sys.exit(1)")
+    chunks = Chunks([b"RIFF"])
+    with pytest.raises(TranscodeError, match="no mp3 output"):
+        transcode_stream(chunks, "mp3")
+    assert chunks.closed
+
+
+def test_transcode_stream_raises_when_ffmpeg_is_missing(monkeypatch):
+    def missing(*args, **kwargs):
+        raise FileNotFoundError("ffmpeg")
+
+    monkeypatch.setattr(audio_encoding.subprocess, "Popen", missing)
+    chunks = Chunks([b"RIFF"])
+    with pytest.raises(TranscodeError, match="cannot start ffmpeg"):
+        transcode_stream(chunks, "opus")
+    assert chunks.closed
@@ -0,0 +1,32 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from checkpoints import _unwrap, remap_keys
+
+
+def test_strips_data_parallel_prefix():
+    state = {"module.blocks.0.attn.qkv.weight": 1, "module.head.weight": 2}
+    assert remap_keys("wav2vec2", state) == {"blocks.0.attn.qkv.weight": 1, "head.weight": 2}
+
+
+def test_vit_sequential_head_is_renamed():
+    state = {"blocks.0.norm1.weight": 1, "head.1.weight": 2, "head.1.bias": 3}
+    assert remap_keys("vit", state) == {"blocks.0.norm1.weight": 1, "head.weight": 2, "head.bias": 3}
+
+
+def test_vit_plain_head_is_kept():
+    state = {"head.weight": 2, "head.bias": 3}
+    assert remap_keys("vit", state) == state
+
+
+def test_head_rename_is_vit_only():
+    state = {"head.1.weight": 2}
+    assert remap_keys("wav2vec2", state) == state
+
+
+def test_unwrap_training_checkpoint_and_module():
+    linear = torch.nn.Linear(2, 2)
+    assert _unwrap({"model_state_dict": {"a": 1}, "epoch": 3}) == {"a": 1}
+    assert set(_unwrap(linear)) == {"weight", "bias"}
+    assert _unwrap({"a": 1}) == {"a": 1}
@@ -0,0 +1,152 @@
+import socket
+import types
+
+import pytest
+
+pytest.importorskip("requests")
+
+import jobs
+from jobs import JobQueue, QueueFull, check_callback_url
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(jobs, "time", types.SimpleNamespace(time=clock.time, sleep=lambda s: None))
+    return clock
+
+
+@pytest.fixture
+def queue(tmp_path, clock):
+    return JobQueue(str(tmp_path / "jobs.db"), max_queued=2)
+
+
+def test_claims_oldest_queued_job_first(queue, clock):
+    first = queue.submit("analyze", {"n": 1})
+    clock.now += 1
+    queue.submit("analyze", {"n": 2})
+    job = queue.claim("w1")
+    assert job["id"] == first
+    assert queue.get(first)["status"] == "running"
+
+
+def test_claim_returns_none_when_nothing_is_runnable(queue):
+    queue.submit("analyze", {})
+    queue.claim("w1")
+    assert queue.claim("w2") is None  # the only job is leased to w1
+
+
+def test_submit_refuses_beyond_max_queued(queue):
+    queue.submit("analyze", {})
+    queue.submit("analyze", {})
+    with pytest.raises(QueueFull) as err:
+        queue.submit("analyze", {})
+    assert err.value.retry_after >= 1
+
+
+def test_expired_lease_is_reclaimed(queue, clock):
+    job_id = queue.submit("analyze", {})
+    queue.claim("w1")
+    clock.now += jobs.JOB_LEASE_SECONDS + 1
+    job = queue.claim("w2")
+    assert job["id"] == job_id
+    assert job["attempts"] == 1  # row as read before this claim's increment
+
+
+def test_renewed_lease_is_not_reclaimed(queue, clock):
+    job_id = queue.submit("analyze", {})
+    queue.claim("w1")
+    for _ in range(5):  # a run much longer than one lease, with heartbeats
+        clock.now += jobs.JOB_HEARTBEAT_SECONDS
+        assert queue.renew(job_id, "w1")
+        assert queue.claim("w2") is None
+
+
+def test_renew_fails_for_a_worker_that_lost_the_job(queue, clock):
+    job_id = queue.submit("analyze", {})
+    queue.claim("w1")
+    clock.now += jobs.JOB_LEASE_SECONDS + 1
+    queue.claim("w2")
+    assert not queue.renew(job_id, "w1")
+    assert queue.renew(job_id, "w2")
+
+
+def test_gives_up_after_max_attempts_and_removes_the_upload(queue, clock, tmp_path, monkeypatch):
+    upload_dir = tmp_path / "uploads"
+    upload_dir.mkdir()
+    monkeypatch.setattr(jobs, "JOBS_UPLOAD_DIR", str(upload_dir))
+    upload = upload_dir / "video.mp4"
+    upload.write_bytes(b"x")
+    job_id = queue.submit("analyze", {"video_path": str(upload), "temp_id": "video"})
+
+    for _ in range(jobs.JOB_MAX_ATTEMPTS):
+        assert queue.claim("w")["id"] == job_id
+        clock.now += jobs.JOB_LEASE_SECONDS + 1  # worker died
+
+    assert queue.claim("w") is None
+    job = queue.get(job_id)
+    assert job["status"] == "failed" and "gave up" in job["error"]
+    assert not upload.exists()
+
+
+def test_complete_stores_the_result(queue):
+    job_id = queue.submit("analyze", {})
+    queue.claim("w")
+    assert queue.complete(job_id, "w", {"face_emotion": "happy"})
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"face_emotion": "happy"}
+
+
+def test_stale_worker_cannot_overwrite_the_new_owners_result(queue, clock):
+    job_id = queue.submit("analyze", {})
+    queue.claim("w1")
+    clock.now += jobs.JOB_LEASE_SECONDS + 1
+    queue.claim("w2")
+    assert queue.complete(job_id, "w2", {"face_emotion": "happy"})
+    assert not queue.fail(job_id, "w1", "late failure")
+    job = queue.get(job_id)
+    assert job["status"] == "done" and job["result"] == {"face_emotion": "happy"}
+
+
+def _resolves_to(monkeypatch, address):
+    monkeypatch.setattr(jobs.socket, "getaddrinfo",
+                        lambda host, port: [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (address, port))])
+
+
+@pytest.mark.parametrize("address", ["127.0.0.1", "10.0.0.5", "192.168.1.2", "169.254.169.254", "::1"])
+def test_callback_to_internal_addresses_is_refused(monkeypatch, address):
+    monkeypatch.setattr(jobs, "JOBS_CALLBACK_HOSTS", set())
+    _resolves_to(monkeypatch, address)
+    with pytest.raises(ValueError):
+        check_callback_url("http://hooks.example.com/done")
+
+
+def test_callback_to_public_address_is_allowed(monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_CALLBACK_HOSTS", set())
+    _resolves_to(monkeypatch, "93.184.216.34")
+    check_callback_url("https://hooks.example.com/done")
+
+
+def test_callback_allow_list(monkeypatch):
+    monkeypatch.setattr(jobs, "JOBS_CALLBACK_HOSTS", {"hooks.internal"})
+    check_callback_url("http://hooks.internal/done")
+    with pytest.raises(ValueError):
+        check_callback_url("http://other.example.com/done")
+    with pytest.raises(ValueError):
+        check_callback_url("ftp://hooks.internal/done")
+
+
+def test_start_workers_runs_this_module_as_a_script(monkeypatch):
+    commands = []
+    monkeypatch.setattr(jobs.subprocess, "Popen", lambda command: commands.append(command) or command)
+    monkeypatch.setattr(jobs.atexit, "register", lambda fn, procs: None)
+    jobs.start_workers(2, "shared.db")
+    assert commands == [[jobs.sys.executable, jobs.__file__, "worker", "--db", "shared.db"]] * 2
@@ -0,0 +1,93 @@
+import pytest
+
+import load_control
+from load_control import LoadController, tier_asr_models
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(load_control.time, "monotonic", clock.monotonic)
+    return clock
+
+
+def busy(controller, n):
+    for _ in range(n):
+        controller.enter()
+
+
+def idle(controller, n):
+    for _ in range(n):
+        controller.exit()
+
+
+def test_starts_at_full_quality(clock):
+    assert LoadController().tier == "full"
+
+
+def test_burst_steps_down_one_tier_per_interval(clock):
+    c = LoadController()
+    busy(c, 10)
+    for _ in range(10):
+        c.observe_wait(5.0)
+    assert c.tier == "reduced"  # one step for the whole burst
+
+    clock.now += load_control.LOAD_STEP_DOWN_S
+    c.observe_wait(5.0)
+    assert c.tier == "minimal"
+
+
+def test_never_goes_below_max_tier(clock):
+    c = LoadController(max_tier="reduced")
+    busy(c, 10)
+    for _ in range(5):
+        clock.now += load_control.LOAD_STEP_DOWN_S
+        c.observe_wait(5.0)
+    assert c.tier == "reduced"
+
+
+def test_steps_up_only_after_hold_time(clock):
+    c = LoadController()
+    busy(c, 10)
+    c.observe_wait(5.0)
+    assert c.tier == "reduced"
+
+    idle(c, 10)
+    for _ in range(10):
+        c.observe_wait(0.0)
+    assert c.tier == "reduced"  # load is gone but the tier is held
+
+    clock.now += load_control.LOAD_TIER_HOLD_S
+    assert c.observe_wait(0.0) == "full"
+
+
+def test_stays_put_between_the_marks(clock):
+    c = LoadController()
+    busy(c, load_control.IN_FLIGHT_HIGH + 1)
+    assert c.tier == "reduced"
+    idle(c, 1)  # in flight == IN_FLIGHT_HIGH: not high, not low
+    clock.now += load_control.LOAD_TIER_HOLD_S
+    c.observe_wait(0.0)
+    assert c.tier == "reduced"
+
+
+def test_idle_decays_the_wait_estimate(clock):
+    c = LoadController()
+    c.enter()
+    c.observe_wait(10.0)
+    high = c.wait_s
+    c.exit()
+    assert c.wait_s < high
+
+
+def test_tier_asr_models():
+    assert tier_asr_models("full") == []
+    assert tier_asr_models("minimal") == ["base", "tiny"]
@@ -0,0 +1,48 @@
+import pytest
+
+pytest.importorskip("requests")
+httpx = pytest.importorskip("httpx")
+
+from tts_backend import GradioSpaceBackend, _SpaceConnection
+
+
+class FakeClient:
+    """gradio Client stand-in: fails `failures` times with an httpx error, then returns audio bytes."""
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = 0
+
+    def predict(self, **kwargs):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise httpx.ConnectError("Space restarted")
+        return b"RIFFaudio"
+
+
+@pytest.fixture
+def backend():
+    backend = GradioSpaceBackend(pool_size=0, health_interval=0)
+    yield backend
+    backend.close()
+
+
+def test_httpx_error_reconnects_and_retries_once(backend):
+    broken, fresh = FakeClient(failures=1), FakeClient()
+    backend._pool.put(_SpaceConnection(broken, "prompt"))
+    backend._connect = lambda: _SpaceConnection(fresh, "prompt")
+
+    source = backend.synthesize_source("hello")
+
+    assert source.data == b"RIFFaudio"
+    assert (broken.calls, fresh.calls) == (1, 1)
+    assert backend._pool.get_nowait().client is fresh  # the new connection replaces the dead one
+
+
+def test_second_failure_is_raised_and_slot_is_freed(backend):
+    backend._pool.put(_SpaceConnection(FakeClient(failures=1), "prompt"))
+    backend._connect = lambda: _SpaceConnection(FakeClient(failures=1), "prompt")
+
+    with pytest.raises(httpx.HTTPError):
+        backend.synthesize_source("hello")
+    assert backend._pool.qsize() == 1
@@ -0,0 +1,208 @@
+import os
+import threading
+import time
+
+import pytest
+
+pytest.importorskip("requests")  # via tts_backend
+
+import tts_cache
+from tts_backend import AudioSource
+from tts_cache import TTSCache, cache_key
+
+
+class FakeResponse:
+    def __init__(self, chunks, mime="audio/wav"):
+        self.chunks = chunks
+        self.headers = {"Content-Type": mime}
+        self.closed = False
+
+    def iter_content(self, chunk_size):
+        yield from self.chunks
+
+    def close(self):
+        self.closed = True
+
+
+def url_source(response, opened):
+    source = AudioSource("audio/mpeg", url="http://tts.invalid/clip.wav")
+
+    def open_url(headers=None):
+        opened.append(response)
+        return response
+
+    source.open_url = open_url
+    return source
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return TTSCache(cache_dir=tmp_path, memory_limit=1024, disk_limit=1024)
+
+
+def test_cache_key_is_stable_and_covers_params():
+    params = {"seed": 0, "temperature": 0.75}
+    assert cache_key("hi", params) == cache_key("hi", dict(reversed(list(params.items()))))
+    assert cache_key("hi", params) != cache_key("hi", {**params, "seed": 1})
+    assert cache_key("hi", params) != cache_key("hello", params)
+
+
+def test_get_or_create_calls_producer_once_for_concurrent_misses(cache):
+    calls = []
+    release = threading.Event()
+
+    def producer():
+        calls.append(1)
+        release.wait(5)
+        return b"audio", "audio/wav"
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create("k", producer)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    while cache.coalesced < 7:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert calls == [1]
+    assert results == [(b"audio", "audio/wav")] * 8
+    assert cache.stats()["misses"] == 1
+    assert cache.get_or_create("k", producer) == (b"audio", "audio/wav")
+    assert cache.hits == 1
+
+
+def test_producer_error_reaches_every_waiter_and_is_not_cached(cache):
+    def producer():
+        raise RuntimeError("quota")
+
+    with pytest.raises(RuntimeError):
+        cache.get_or_create("k", producer)
+    assert cache.get_or_create("k", lambda: (b"ok", "audio/wav")) == (b"ok", "audio/wav")
+
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = TTSCache(cache_dir=tmp_path, memory_limit=10, disk_limit=1024)
+    cache.put("a", b"aaaa", "audio/wav")
+    cache.put("b", b"bbbb", "audio/wav")
+    cache.get("a")
+    cache.put("c", b"cccc", "audio/wav")
+    assert list(cache._lru) == ["a", "c"]
+    assert cache.stats()["memory_bytes"] == 8
+    assert cache.get("b") == (b"bbbb", "audio/wav")  # still on disk
+
+
+def test_disk_total_is_tracked_and_evicts_oldest(cache):
+    for i, key in enumerate("abc"):
+        cache.put(key, bytes(300), "audio/wav")
+        os.utime(cache._disk_paths(key)[0], (1000 + i, 1000 + i))
+    assert cache._disk_bytes == 900
+    cache.put("d", bytes(300), "audio/wav")  # over 1024: evicts down to DISK_EVICT_TO
+    assert cache._disk_bytes == 900 <= 1024 * tts_cache.DISK_EVICT_TO
+    assert not cache._disk_paths("a")[0].exists()
+    assert all(cache._disk_paths(k)[0].exists() for k in "bcd")
+
+
+def test_replacing_an_entry_does_not_double_count(cache):
+    cache.put("a", bytes(100), "audio/wav")
+    cache.put("a", bytes(40), "audio/wav")
+    assert cache._disk_bytes == 40
+    assert TTSCache(cache_dir=cache.cache_dir)._disk_bytes == 40  # rescanned on startup
+
+
+class GatedResponse(FakeResponse):
+    """Upstream that hands out one chunk per gate.set()."""
+
+    def __init__(self, chunks, fail=False):
+        super().__init__(chunks)
+        self.gate = threading.Semaphore(0)
+        self.fail = fail
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.gate.acquire()
+            yield chunk
+        if self.fail:
+            raise ConnectionError("reset")
+
+
+def test_url_source_streams_while_it_is_cached(cache):
+    opened = []
+    response = GatedResponse([b"RIFF", b"data"])
+    sources = [cache.get_or_create_source("k", lambda: url_source(response, opened)) for _ in range(2)]
+    readers = [s.iter_chunks() for s in sources]
+
+    response.gate.release()
+    # first bytes reach every caller before the download has finished
+    assert [next(r) for r in readers] == [b"RIFF", b"RIFF"]
+    assert cache.get_source("k") is None  # not committed yet
+
+    response.gate.release()
+    assert [b"".join(r) for r in readers] == [b"data", b"data"]
+    assert len(opened) == 1 and response.closed
+    assert sources[0].mime == "audio/wav"  # the response's Content-Type wins
+    assert cache.get_source("k").read() == b"RIFFdata"
+    assert not list(cache.cache_dir.glob("*.tmp"))
+
+
+def test_concurrent_url_misses_share_one_download(cache):
+    opened = []
+    response = FakeResponse([b"RIFF", b"data"])
+    release = threading.Event()
+
+    def producer():
+        release.wait(5)
+        return url_source(response, opened)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_create_source("k", producer)))
+               for _ in range(4)]
+    for t in threads:
+        t.start()
+    while cache.coalesced < 3:
+        time.sleep(0.01)
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert [r.read() for r in results] == [b"RIFFdata"] * 4
+    assert len(opened) == 1
+
+
+def test_failed_url_download_leaves_no_entry(cache):
+    response = GatedResponse([b"RIFF"], fail=True)
+    source = cache.get_or_create_source("k", lambda: url_source(response, []))
+    response.gate.release()
+    with pytest.raises(ConnectionError):
+        source.read()
+    assert response.closed
+    assert cache.get_source("k") is None
+    assert not list(cache.cache_dir.glob("*.tmp"))
+
+
+def test_leader_rechecks_the_cache_before_producing(cache):
+    # a caller that missed just before the previous leader committed becomes
+    # the next leader; it must find the committed entry instead of regenerating
+    cache.put("k", b"audio", "audio/wav")
+    calls = []
+    assert cache._single_flight("k", lambda: calls.append(1), lambda: cache.get("k")) == (b"audio", "audio/wav")
+    assert calls == []
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 0
+
+
+def test_disk_hit_survives_eviction_while_being_sent(tmp_path):
+    cache = TTSCache(cache_dir=tmp_path, memory_limit=0, disk_limit=500)
+    cache.put("a", b"A" * 300, "audio/wav")
+    os.utime(cache._disk_paths("a")[0], (1000, 1000))
+    source = cache.get_source("a")
+    assert source.file is not None and source.length == 300
+    os.utime(cache._disk_paths("a")[0], (1000, 1000))
+
+    cache.put("b", b"B" * 300, "audio/wav")  # evicts "a" (oldest), never the clip just written
+
+    assert cache.get_source("b") is not None
+    if not cache._disk_paths("a")[0].exists():  # POSIX: deleted, yet the open file still reads
+        assert cache.get_source("a") is None
+    assert source.read() == b"A" * 300
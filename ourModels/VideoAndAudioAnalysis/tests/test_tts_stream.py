@@ -0,0 +1,56 @@
+import io
+import struct
+import wave
+
+from tts_stream import split_sentences, synthesize_stream, wav_stream_header
+
+
+def test_split_sentences_at_sentence_ends():
+    text = "I hear you, and that sounds hard. What happened after that? Take all the time you need!"
+    assert split_sentences(text) == [
+        "I hear you, and that sounds hard.", "What happened after that?", "Take all the time you need!"]
+
+
+def test_split_sentences_merges_short_ones_forward():
+    assert split_sentences("Okay. I understand how you feel.") == ["Okay. I understand how you feel."]
+    # a short last sentence joins the one before it
+    assert split_sentences("That sounds really difficult to carry. Yes.") == ["That sounds really difficult to carry. Yes."]
+
+
+def test_split_sentences_splits_long_ones_at_clauses():
+    clauses = [f"clause number {i} goes here" for i in range(6)]
+    chunks = split_sentences(", ".join(clauses) + ".", max_chars=60, min_chars=1)
+    assert len(chunks) > 1
+    assert all(len(c) <= 60 for c in chunks)
+    assert " ".join(chunks) == ", ".join(clauses) + "."
+
+
+def test_split_sentences_empty_text():
+    assert split_sentences("   ") == []
+
+
+def test_wav_stream_header_is_a_valid_open_ended_wav():
+    header = wav_stream_header(sample_rate=24000, channels=1, sampwidth=2)
+    assert len(header) == 44
+    assert header[:4] == b"RIFF" and header[8:12] == b"WAVE"
+    assert struct.unpack("<I", header[4:8])[0] == 0xFFFFFFFF
+    assert struct.unpack("<I", header[40:44])[0] == 0xFFFFFFFF
+    fmt = struct.unpack("<HHIIHH", header[20:36])
+    assert fmt == (1, 1, 24000, 48000, 2, 16)
+
+
+def _wav(frames, sample_rate=24000):
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(frames)
+    return buf.getvalue()
+
+
+def test_synthesize_stream_yields_header_then_pcm_in_order():
+    text = "This is the first sentence here. And this is the second one here."
+    pcm = {s: bytes([i + 1]) * 4 for i, s in enumerate(split_sentences(text))}
+    parts = list(synthesize_stream(text, lambda s: (_wav(pcm[s]), "audio/wav")))
+    assert parts == [wav_stream_header() + b"\x01" * 4, b"\x02" * 4]
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+import vad
+from vad import detect_speech, frame_rms, gate_silence
+
+SR = 16000
+
+
+def tone(seconds, amplitude=0.3, freq=220):
+    t = np.arange(int(SR * seconds)) / SR
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def silence(seconds, noise=1e-4, seed=0):
+    return (noise * np.random.default_rng(seed).standard_normal(int(SR * seconds))).astype(np.float32)
+
+
+def test_frame_rms_matches_direct_computation():
+    audio = np.random.default_rng(1).standard_normal(1000)
+    rms = frame_rms(audio, frame_length=100, hop_length=40)
+    expected = [np.sqrt(np.mean(audio[s:s + 100] ** 2)) for s in range(0, 901, 40)]
+    np.testing.assert_allclose(rms, expected)
+
+
+def test_detect_speech_finds_voiced_region_with_padding():
+    audio = np.concatenate([silence(1), tone(1), silence(1)])
+    [(start, end)] = detect_speech(audio, SR)
+    pad = SR * vad.PAD_MS // 1000
+    assert abs(start - (SR - pad)) < SR * 0.05
+    assert abs(end - (2 * SR + pad)) < SR * 0.05
+
+
+def test_detect_speech_keeps_short_pauses_and_splits_long_ones():
+    short = np.concatenate([silence(1), tone(0.5), silence(0.3), tone(0.5), silence(1)])
+    assert len(detect_speech(short, SR)) == 1
+    long = np.concatenate([silence(1), tone(0.5), silence(2), tone(0.5), silence(1)])
+    assert len(detect_speech(long, SR)) == 2
+
+
+def test_detect_speech_drops_clicks_and_silence():
+    click = np.concatenate([silence(1), tone(0.05), silence(1)])
+    assert detect_speech(click, SR) == []
+    assert detect_speech(silence(2), SR) == []
+    assert detect_speech(np.zeros(0, dtype=np.float32), SR) == []
+
+
+def test_detect_speech_reuses_a_precomputed_rms_track():
+    audio = np.concatenate([silence(1), tone(1), silence(1)])
+    hop, frame = 160, 400
+    rms = frame_rms(audio, frame, hop)
+    assert detect_speech(audio, SR, rms=rms, hop_length=hop, frame_length=frame) == detect_speech(audio, SR)
+
+
+def test_detect_speech_requires_hop_length_with_rms():
+    audio = tone(1)
+    with pytest.raises(ValueError, match="hop_length"):
+        detect_speech(audio, SR, rms=frame_rms(audio, 400, 160))
+
+
+def test_gate_silence_joins_segments_and_maps_times_back():
+    audio = np.concatenate([silence(1), tone(0.5), silence(2), tone(0.5), silence(1)])
+    voiced = gate_silence(audio, SR)
+    assert voiced.has_speech and len(voiced.segments) == 2
+    first, second = voiced.segments
+    gap = SR * vad.GAP_MS // 1000
+    assert len(voiced.audio) == (first[1] - first[0]) + gap + (second[1] - second[0])
+    # the start of the second segment in the gated audio is its start in the recording
+    gated_start = (first[1] - first[0] + gap) / SR
+    assert voiced.to_original(gated_start) == pytest.approx(second[0] / SR)
+    assert voiced.to_original(0.0) == pytest.approx(first[0] / SR)
+
+
+def test_gate_silence_disabled_keeps_everything(monkeypatch):
+    monkeypatch.setattr(vad, "VAD_ENABLED", False)
+    audio = silence(1)
+    voiced = gate_silence(audio, SR)
+    assert voiced.segments == [(0, len(audio))]
+    assert voiced.duration == pytest.approx(1.0)
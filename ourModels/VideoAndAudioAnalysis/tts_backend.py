@@ -0,0 +1,529 @@
+import base64
+import mimetypes
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# ---------- CONFIG: change only if needed ----------
+TTS_BACKEND = os.getenv("TTS_BACKEND", "space")   # "space" (HF Space), "local" (resident Chatterbox) or "http" (stand-in server)
+TTS_BACKEND_URL = os.getenv("TTS_BACKEND_URL", "http://127.0.0.1:5200/synthesize")  # used by "http"
+LOCAL_TTS_DIR = Path(__file__).resolve().parent.parent / "TTS"   # where local_tts.py lives
+LOCAL_PROMPT_PATH = os.getenv("TTS_LOCAL_PROMPT", str(LOCAL_TTS_DIR / "Sample_Voice.mpeg"))
+LOCAL_DEVICE = os.getenv("TTS_LOCAL_DEVICE", "cpu")
+HF_SPACE = "ResembleAI/Chatterbox"   # Hugging Face Space used
+SAMPLE_PROMPT_URL = "https://github.com/gradio-app/gradio/raw/main/test/test_files/audio_sample.wav"
+# Fixed parameters for every request:
+PARAM_EXAGGERATION = 0.6
+PARAM_TEMPERATURE = 0.75
+PARAM_SEED = 0
+PARAM_CFGW =0.35
+PARAM_VAD_TRIM = False
+API_NAME = "/generate_tts_audio"
+DOWNLOAD_DIR = "./downloads"  # where gradio_client will place downloaded files
+POOL_SIZE = int(os.getenv("TTS_POOL_SIZE", "2"))      # long-lived Space clients
+HEALTH_INTERVAL = 60                                  # seconds between pool health checks
+REQUEST_TIMEOUT = 120
+# False: the Space returns file URLs, streamed to the client while the cache
+# writes them into its disk tier, instead of downloaded by gradio_client first
+DOWNLOAD_FILES = os.getenv("TTS_DOWNLOAD_FILES", "1") == "1"
+CHUNK_SIZE = 64 * 1024
+DOWNLOAD_MAX_BYTES = 512 * 1024 * 1024   # janitor budget for DOWNLOAD_DIR
+DOWNLOAD_MAX_AGE = 60 * 60               # seconds
+JANITOR_INTERVAL = 5 * 60
+# ---------------------------------------------------
+
+
+def ensure_download_dir():
+    Path(DOWNLOAD_DIR).mkdir(parents=True, exist_ok=True)
+
+
+# Pooled keep-alive connections for fetching results from the Space
+http_session = requests.Session()
+http_session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+http_session.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+
+class AudioSource:
+    """
+    Where a synthesis result lives, without loading it. Exactly one of
+    data (in-memory bytes), path (local file), url (remote file), file (an
+    open binary file, e.g. a cache entry kept open while it is sent) or
+    stream (an iterator of bytes, e.g. a cache entry still downloading) is
+    set. length is the size in bytes when known.
+    """
+
+    def __init__(self, mime, data=None, path=None, url=None, file=None, stream=None, length=None):
+        self.mime = mime
+        self.data = data
+        self.path = path
+        self.url = url
+        self.file = file
+        self.stream = stream
+        self.length = length
+
+    def open_url(self, headers=None):
+        """Streaming GET on the pooled session; caller must close the response."""
+        r = http_session.get(self.url, headers=headers, stream=True, timeout=30)
+        r.raise_for_status()
+        return r
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        if self.data is not None:
+            yield self.data
+        elif self.stream is not None:
+            yield from self.stream
+        elif self.file is not None or self.path is not None:
+            with self.file or open(self.path, "rb") as f:
+                while True:
+                    chunk = f.read(chunk_size)
+                    if not chunk:
+                        break
+                    yield chunk
+        else:
+            with self.open_url() as r:
+                yield from r.iter_content(chunk_size)
+
+    def read(self):
+        """Whole result as bytes, for callers that need it in memory."""
+        if self.data is not None:
+            return self.data
+        return b"".join(self.iter_chunks())
+
+
+def result_to_source(result, download_dir=DOWNLOAD_DIR):
+    """
+    Accepts raw result from client.predict and returns an AudioSource.
+    Handles:
+      - bytes / bytearray
+      - data:audio/...;base64,...
+      - http(s) URL pointing to audio (proxied, not downloaded)
+      - server-local path string (client may have downloaded it to download_dir)
+      - file dict {"path": ..., "url": ...} (client created with download_files=False)
+      - list/tuple (unwraps first element)
+    """
+    # unwrap list/tuple
+    if isinstance(result, (list, tuple)) and result:
+        result = result[0]
+
+    # file dict: prefer the URL so it can be proxied
+    if isinstance(result, dict):
+        result = result.get("url") or result.get("path")
+
+    # raw bytes
+    if isinstance(result, (bytes, bytearray)):
+        return AudioSource("application/octet-stream", data=bytes(result))
+
+    # string cases
+    if isinstance(result, str):
+        s = result.strip()
+
+        # 1) data URI (already in memory; decoding is unavoidable)
+        if s.startswith("data:audio"):
+            header, b64 = s.split(",", 1)
+            mime = header.split(";")[0].split(":")[1] if ":" in header else "audio/wav"
+            return AudioSource(mime, data=base64.b64decode(b64))
+
+        # 2) http(s) URL -> proxy
+        if s.startswith("http://") or s.startswith("https://"):
+            mime, _ = mimetypes.guess_type(s.split("?", 1)[0])
+            return AudioSource(mime or "audio/mpeg", url=s)
+
+        # 3) server-local path string returned by the Space.
+        p = Path(s)
+        if p.exists():
+            mime, _ = mimetypes.guess_type(str(p))
+            return AudioSource(mime or "application/octet-stream", path=p)
+
+        # 4) check downloads folder for a basename match
+        maybe = Path(download_dir) / Path(s).name
+        if maybe.exists():
+            mime, _ = mimetypes.guess_type(str(maybe))
+            return AudioSource(mime or "application/octet-stream", path=maybe)
+
+    raise RuntimeError(f"Unhandled model result type: {type(result)} | value: {str(result)[:300]}")
+
+
+def result_to_bytes_and_mime(result, download_dir=DOWNLOAD_DIR):
+    """Same as result_to_source, but returns (bytes, mime_type)."""
+    source = result_to_source(result, download_dir=download_dir)
+    return source.read(), source.mime
+
+
+def prune_downloads(download_dir=DOWNLOAD_DIR, max_bytes=DOWNLOAD_MAX_BYTES, max_age=DOWNLOAD_MAX_AGE):
+    """
+    Evicts files gradio_client left in download_dir: anything older than
+    max_age seconds, then oldest-first until the folder fits in max_bytes.
+    The cached voice prompt is kept.
+    """
+    now = time.time()
+    files = []
+    for p in Path(download_dir).rglob("*"):
+        if not p.is_file() or p.name.startswith("voice_prompt_"):
+            continue
+        try:
+            st = p.stat()
+        except OSError:
+            continue
+        if now - st.st_mtime > max_age:
+            p.unlink(missing_ok=True)
+        else:
+            files.append((st.st_mtime, st.st_size, p))
+
+    total = sum(size for _, size, _ in files)
+    for _, size, p in sorted(files):
+        if total <= max_bytes:
+            break
+        p.unlink(missing_ok=True)
+        total -= size
+
+    # gradio_client downloads into one subfolder per file
+    for d in sorted(Path(download_dir).rglob("*"), reverse=True):
+        if d.is_dir():
+            try:
+                d.rmdir()
+            except OSError:
+                pass
+
+
+def start_download_janitor(interval=JANITOR_INTERVAL):
+    """Runs prune_downloads every interval seconds in a daemon thread."""
+    def loop():
+        while True:
+            try:
+                prune_downloads()
+            except Exception as e:
+                print("Download janitor failed:", e)
+            time.sleep(interval)
+
+    threading.Thread(target=loop, daemon=True).start()
+
+
+class TTSBackend:
+    """
+    Interface every synthesis backend implements.
+
+    synthesize_source(text) -> AudioSource
+    synthesize(text) -> (audio_bytes, mime)
+    params()         -> dict of everything besides the text that shapes the output
+                        (used in the cache key)
+    healthy()        -> bool
+    """
+
+    name = "base"
+
+    def synthesize_source(self, text):
+        raise NotImplementedError
+
+    def synthesize(self, text):
+        source = self.synthesize_source(text)
+        return source.read(), source.mime
+
+    def params(self):
+        return {"backend": self.name}
+
+    def healthy(self):
+        return True
+
+    def close(self):
+        pass
+
+
+class HTTPBackend(TTSBackend):
+    """
+    Posts {"text": ...} to a plain HTTP server and returns the response body.
+    Lets a local stand-in server replace the Space in tests and dev.
+    """
+
+    name = "http"
+
+    def __init__(self, url=TTS_BACKEND_URL, timeout=REQUEST_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def synthesize_source(self, text):
+        r = self.session.post(self.url, json={"text": text}, timeout=self.timeout)
+        r.raise_for_status()
+        return AudioSource(r.headers.get("Content-Type", "audio/wav"), data=r.content)
+
+    def params(self):
+        return {"backend": self.name, "url": self.url}
+
+    def healthy(self):
+        try:
+            self.session.head(self.url, timeout=5)
+            return True
+        except requests.RequestException:
+            return False
+
+    def close(self):
+        self.session.close()
+
+
+class LocalEngineBackend(TTSBackend):
+    """
+    Chatterbox running in this process through local_tts.LocalTTSEngine
+    (CPU by default), so /synthesize works without the remote Space.
+    """
+
+    name = "local"
+
+    def __init__(self, prompt_path=LOCAL_PROMPT_PATH, device=LOCAL_DEVICE):
+        if str(LOCAL_TTS_DIR) not in sys.path:
+            sys.path.append(str(LOCAL_TTS_DIR))
+        from local_tts import LocalTTSEngine
+
+        self.engine = LocalTTSEngine(
+            device=device,
+            prompt_path=prompt_path if os.path.exists(prompt_path) else None,
+            exaggeration=PARAM_EXAGGERATION,
+            temperature=PARAM_TEMPERATURE,
+            cfgw=PARAM_CFGW,
+            seed=PARAM_SEED,
+        )
+        # the engine holds one set of active conditioning; serialize calls
+        self._lock = threading.Lock()
+
+    def synthesize_pcm(self, text):
+        """Returns (float32 samples, sample_rate)."""
+        with self._lock:
+            return self.engine.generate(text), self.engine.sr
+
+    def synthesize_source(self, text):
+        wav, sr = self.synthesize_pcm(text)
+        return AudioSource("audio/wav", data=float32_to_wav(wav, sr))
+
+    def params(self):
+        return {
+            "backend": self.name,
+            "prompt": self.engine.prompt_path,
+            "exaggeration": PARAM_EXAGGERATION,
+            "temperature": PARAM_TEMPERATURE,
+            "seed": PARAM_SEED,
+            "cfgw": PARAM_CFGW,
+        }
+
+
+def float32_to_wav(wav, sr):
+    """
+    Mono float32 samples -> IEEE-float WAV bytes. The samples are written as-is
+    (no int16 conversion copy); the encoder or the browser reads float WAV directly.
+    """
+    data = wav.astype("<f4", copy=False).tobytes()
+    header = b"".join([
+        b"RIFF", struct.pack("<I", 36 + len(data)), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 3, 1, sr, sr * 4, 4, 32),
+        b"data", struct.pack("<I", len(data)),
+    ])
+    return header + data
+
+
+def retryable_errors():
+    """Errors worth a reconnect: requests' and (gradio_client's transport) httpx's."""
+    errors = (ConnectionError, OSError, requests.RequestException)
+    try:
+        import httpx
+    except ImportError:
+        return errors
+    return errors + (httpx.HTTPError,)
+
+
+class _SpaceConnection:
+    """A connected gradio Client plus the voice prompt handle valid for it."""
+
+    def __init__(self, client, prompt):
+        self.client = client
+        self.prompt = prompt
+
+
+class GradioSpaceBackend(TTSBackend):
+    """
+    Chatterbox on a Hugging Face Space, through a pool of long-lived
+    gradio_client.Client instances.
+
+    - the Space config is fetched once per pooled client, not per request
+    - the reference voice is downloaded once and uploaded once per client;
+      later calls pass the Space-side file URL instead of re-sending it
+    - a background thread probes the Space and drops dead clients; a call that
+      fails on a connection error reconnects and retries once
+    """
+
+    name = "space"
+
+    def __init__(self, space=HF_SPACE, prompt_url=SAMPLE_PROMPT_URL, pool_size=POOL_SIZE,
+                 download_dir=DOWNLOAD_DIR, health_interval=HEALTH_INTERVAL):
+        self.space = space
+        self.prompt_url = prompt_url
+        self.download_dir = download_dir
+        self._prompt_path = None
+        self._prompt_lock = threading.Lock()
+        # each slot holds a _SpaceConnection or None (connect lazily on checkout)
+        self._pool = queue.Queue()
+        for _ in range(pool_size):
+            try:
+                self._pool.put(self._connect())
+            except Exception as e:
+                print("TTS client connect failed, will retry on demand:", e)
+                self._pool.put(None)
+        self._stop = threading.Event()
+        if health_interval:
+            threading.Thread(target=self._health_loop, args=(health_interval,), daemon=True).start()
+
+    # ---------- voice prompt ----------
+    def _local_prompt(self):
+        """Downloads the reference voice once and returns the local path."""
+        with self._prompt_lock:
+            if self._prompt_path is None:
+                ensure_download_dir()
+                path = Path(self.download_dir) / ("voice_prompt_" + Path(self.prompt_url).name)
+                if not path.exists():
+                    r = requests.get(self.prompt_url, timeout=30)
+                    r.raise_for_status()
+                    path.write_bytes(r.content)
+                self._prompt_path = path
+            return self._prompt_path
+
+    def _upload_prompt(self, client):
+        """
+        Uploads the voice prompt to the Space once and returns a file handle
+        pointing at the uploaded copy (kept per connection). If the upload route
+        is unavailable, falls back to the hosted prompt URL, which the Space
+        fetches itself, rather than a local file gradio would re-upload per call.
+        """
+        from gradio_client import handle_file
+
+        try:
+            import httpx
+
+            local = self._local_prompt()
+            with open(local, "rb") as f:
+                r = httpx.post(
+                    client.upload_url,
+                    headers=client.headers,
+                    files=[("files", (local.name, f))],
+                    timeout=30,
+                )
+            r.raise_for_status()
+            server_path = r.json()[0]
+            base = getattr(client, "src_prefixed", client.src)
+            return handle_file(base.rstrip("/") + "/file=" + server_path)
+        except Exception as e:
+            print("Voice prompt upload failed, passing its URL instead:", e)
+            return handle_file(self.prompt_url)
+
+    # ---------- pool ----------
+    def _connect(self):
+        from gradio_client import Client
+
+        ensure_download_dir()
+        # download_files so any server-local paths are downloaded into DOWNLOAD_DIR
+        # (or not at all, when results are proxied by URL)
+        download_files = self.download_dir if DOWNLOAD_FILES else False
+        client = Client(self.space, download_files=download_files, verbose=False)
+        return _SpaceConnection(client, self._upload_prompt(client))
+
+    def _checkout(self):
+        conn = self._pool.get()
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                self._pool.put(None)
+                raise
+        return conn
+
+    def _predict(self, conn, text):
+        return conn.client.predict(
+            text_input=text,
+            audio_prompt_path_input=conn.prompt,
+            exaggeration_input=PARAM_EXAGGERATION,
+            temperature_input=PARAM_TEMPERATURE,
+            seed_num_input=PARAM_SEED,
+            cfgw_input=PARAM_CFGW,
+            vad_trim_input=PARAM_VAD_TRIM,
+            api_name=API_NAME,
+        )
+
+    def synthesize_source(self, text):
+        conn = self._checkout()
+        try:
+            try:
+                result = self._predict(conn, text)
+            except retryable_errors() as e:
+                print("TTS client failed, reconnecting:", e)
+                conn = None
+                conn = self._connect()
+                result = self._predict(conn, text)
+        finally:
+            self._pool.put(conn)
+
+        try:
+            return result_to_source(result, download_dir=self.download_dir)
+        except Exception as e:
+            raise RuntimeError(f"Could not convert model result: {e}") from e
+
+    def params(self):
+        return {
+            "backend": self.name,
+            "space": self.space,
+            "api_name": API_NAME,
+            "prompt": self.prompt_url,
+            "exaggeration": PARAM_EXAGGERATION,
+            "temperature": PARAM_TEMPERATURE,
+            "seed": PARAM_SEED,
+            "cfgw": PARAM_CFGW,
+            "vad_trim": PARAM_VAD_TRIM,
+        }
+
+    # ---------- health ----------
+    def _probe(self, conn):
+        try:
+            r = requests.get(conn.client.src.rstrip("/") + "/config", timeout=10)
+            return r.ok
+        except requests.RequestException:
+            return False
+
+    def healthy(self):
+        conn = self._pool.get()
+        try:
+            return conn is not None and self._probe(conn)
+        finally:
+            self._pool.put(conn)
+
+    def _health_loop(self, interval):
+        while not self._stop.wait(interval):
+            # check every idle slot once; busy clients are checked next round
+            for _ in range(self._pool.qsize()):
+                try:
+                    conn = self._pool.get_nowait()
+                except queue.Empty:
+                    break
+                if conn is not None and not self._probe(conn):
+                    print("TTS client unhealthy, reconnecting")
+                    try:
+                        conn = self._connect()
+                    except Exception as e:
+                        print("TTS reconnect failed:", e)
+                        conn = None
+                self._pool.put(conn)
+
+    def close(self):
+        self._stop.set()
+
+
+def create_backend(kind=TTS_BACKEND):
+    """Builds the backend selected by TTS_BACKEND."""
+    if kind == "space":
+        return GradioSpaceBackend()
+    if kind == "local":
+        return LocalEngineBackend()
+    if kind == "http":
+        return HTTPBackend()
+    raise ValueError(f"Unknown TTS backend: {kind}")
@@ -0,0 +1,442 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+
+from tts_backend import AudioSource, CHUNK_SIZE
+
+# ---------- CONFIG: change only if needed ----------
+CACHE_DIR = "./tts_cache"                   # disk tier (one file per cached clip)
+MEMORY_LIMIT_BYTES = 64 * 1024 * 1024       # in-memory LRU budget
+DISK_LIMIT_BYTES = 1024 * 1024 * 1024       # disk tier budget
+DISK_EVICT_TO = 0.9                         # eviction frees space down to this share of the budget
+# Phrases the therapist says all the time; preloaded at startup.
+WARMUP_PHRASES = [
+    "Hello, I'm here with you.",
+    "Take a deep breath.",
+    "Take your time. I'm listening whenever you're ready.",
+    "It's okay to feel this way.",
+    "Let's try breathing in for four seconds, and out for six.",
+    "Thank you for sharing that with me.",
+]
+# ---------------------------------------------------
+
+
+def cache_key(text, params):
+    """
+    Stable key for a synthesis request: sha256 over the text plus every
+    parameter that influences the generated audio.
+    """
+    payload = json.dumps({"text": text, "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _InFlight:
+    """One pending generation that concurrent identical requests wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class TTSCache:
+    """
+    Two-tier cache for synthesized audio.
+
+    - memory: byte-bounded LRU of (audio_bytes, mime)
+    - disk:   <cache_dir>/<key>.bin + <key>.json (mime), evicted oldest-first;
+              the total size is tracked in memory, the directory is only
+              scanned when the budget is exceeded. Disk hits are handed out as
+              open files, so eviction never pulls a clip out from under a
+              response that is still sending it
+    - single-flight: concurrent misses for the same key share one producer call
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, memory_limit=MEMORY_LIMIT_BYTES, disk_limit=DISK_LIMIT_BYTES):
+        self.cache_dir = Path(cache_dir)
+        self.memory_limit = memory_limit
+        self.disk_limit = disk_limit
+        self._lru = OrderedDict()
+        self._memory_bytes = 0
+        self._inflight = {}
+        self._downloads = {}  # key -> _Download still being written
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._disk_lock = threading.Lock()
+        self._disk_bytes = sum(size for _, size, _ in self._scan_disk())
+
+    # ---------- memory tier ----------
+    def _mem_get(self, key):
+        entry = self._lru.get(key)
+        if entry is not None:
+            self._lru.move_to_end(key)
+        return entry
+
+    def _mem_put(self, key, audio_bytes, mime):
+        size = len(audio_bytes)
+        if size > self.memory_limit:
+            return
+        old = self._lru.pop(key, None)
+        if old is not None:
+            self._memory_bytes -= len(old[0])
+        self._lru[key] = (audio_bytes, mime)
+        self._memory_bytes += size
+        while self._memory_bytes > self.memory_limit and self._lru:
+            _, (evicted, _) = self._lru.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    # ---------- disk tier ----------
+    def _disk_paths(self, key):
+        return self.cache_dir / f"{key}.bin", self.cache_dir / f"{key}.json"
+
+    def _disk_get(self, key):
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            mime = json.loads(meta_path.read_text())["mime"]
+            audio_bytes = data_path.read_bytes()
+        except (OSError, ValueError, KeyError):
+            return None
+        os.utime(data_path)  # mark as recently used for eviction
+        return audio_bytes, mime
+
+    def _disk_put(self, key, audio_bytes, mime):
+        # write-then-rename so a concurrent reader never sees a partial file
+        tmp = self._tmp_path(key)
+        tmp.write_bytes(audio_bytes)
+        self._disk_commit(key, tmp, mime)
+
+    def _tmp_path(self, key):
+        return self.cache_dir / f"{key}.{uuid.uuid4().hex}.tmp"
+
+    def _disk_commit(self, key, tmp, mime):
+        data_path, meta_path = self._disk_paths(key)
+        size = tmp.stat().st_size
+        with self._disk_lock:
+            try:
+                replaced = data_path.stat().st_size
+            except OSError:
+                replaced = 0
+            meta_path.write_text(json.dumps({"mime": mime, "created": time.time()}))
+            os.replace(tmp, data_path)
+            self._disk_bytes += size - replaced
+            if self._disk_bytes > self.disk_limit:
+                self._evict_disk(keep=data_path)
+        return data_path
+
+    def _scan_disk(self):
+        """[(mtime, size, path)] of every cached clip."""
+        files = []
+        for p in self.cache_dir.glob("*.bin"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, p))
+        return files
+
+    def _evict_disk(self, keep=None):
+        """
+        Deletes the least recently used clips (never `keep`, the one just
+        committed) down to DISK_EVICT_TO of the budget. Call with _disk_lock.
+        """
+        files = sorted(self._scan_disk())
+        total = sum(size for _, size, _ in files)  # resync: other processes may share the directory
+        target = self.disk_limit * DISK_EVICT_TO
+        for _, size, p in files:
+            if total <= target:
+                break
+            if p == keep:
+                continue
+            try:
+                # open readers keep their copy (POSIX); where an open file
+                # can't be deleted (Windows) it is retried on the next eviction
+                p.unlink(missing_ok=True)
+            except OSError:
+                continue
+            p.with_suffix(".json").unlink(missing_ok=True)
+            total -= size
+        self._disk_bytes = total
+
+    # ---------- public API ----------
+    def get(self, key):
+        """Returns (audio_bytes, mime) or None. Disk hits are promoted to memory."""
+        with self._lock:
+            entry = self._mem_get(key)
+        if entry is not None:
+            return entry
+        entry = self._disk_get(key)
+        if entry is not None:
+            with self._lock:
+                self._mem_put(key, *entry)
+        return entry
+
+    def put(self, key, audio_bytes, mime):
+        with self._lock:
+            self._mem_put(key, audio_bytes, mime)
+        self._disk_put(key, audio_bytes, mime)
+
+    def get_source(self, key):
+        """
+        Returns an AudioSource for key or None. Memory hits carry the bytes;
+        disk hits carry an open file (the caller sends and closes it), so they
+        are sent without reading them and survive a concurrent eviction.
+        """
+        with self._lock:
+            entry = self._mem_get(key)
+        if entry is not None:
+            return AudioSource(entry[1], data=entry[0], length=len(entry[0]))
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            mime = json.loads(meta_path.read_text())["mime"]
+            f = open(data_path, "rb")
+        except (OSError, ValueError, KeyError):
+            return None
+        try:
+            os.utime(data_path)  # mark as recently used for eviction
+        except OSError:
+            pass
+        return AudioSource(mime, file=f, length=os.fstat(f.fileno()).st_size)
+
+    def _cached(self, key):
+        """The key's running _Download, True if it is in either tier, else None (without reading it)."""
+        with self._lock:
+            if key in self._downloads:
+                return self._downloads[key]
+            if key in self._lru:
+                return True
+        return True if self._disk_paths(key)[0].exists() else None
+
+    def _count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def _single_flight(self, key, fn, lookup):
+        """
+        Calls fn() once for all threads concurrently asking for key. The
+        leader first retries lookup(): the previous leader may have committed
+        the entry between this caller's miss and it taking the lead.
+        """
+        with self._lock:
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _InFlight()
+                self._inflight[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = lookup()
+            if flight.value is not None:
+                self._count("hits")
+                return flight.value
+            self._count("misses")
+            flight.value = fn()
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.done.set()
+
+    def get_or_create(self, key, producer):
+        """
+        Returns (audio_bytes, mime) for key, calling producer() at most once
+        across all threads currently asking for the same key.
+        """
+        entry = self.get(key)
+        if entry is not None:
+            self._count("hits")
+            return entry
+
+        def produce():
+            audio_bytes, mime = producer()
+            self.put(key, audio_bytes, mime)
+            return audio_bytes, mime
+
+        return self._single_flight(key, produce, lambda: self.get(key))
+
+    def get_or_create_source(self, key, producer):
+        """
+        Like get_or_create, but producer() returns an AudioSource and so does
+        this method. File results are copied into the disk tier (kernel-side
+        copy, never loaded) and every caller gets its own open file. URL
+        results are fetched once per key and written into the disk tier in the
+        background; every caller streams the file as it grows, so the first
+        bytes go out before the download has finished.
+        """
+        with self._lock:
+            download = self._downloads.get(key)
+        source = download.source() if download is not None else self.get_source(key)
+        if source is not None:
+            self._count("hits")
+            return source
+        stored = self._single_flight(key, lambda: self._store_source(key, producer()), lambda: self._cached(key))
+        if isinstance(stored, AudioSource):
+            return stored
+        if isinstance(stored, _Download):
+            return stored.source()
+        source = self.get_source(key)
+        if source is None:
+            raise RuntimeError("TTS cache entry was evicted before it could be sent")
+        return source
+
+    def _store_source(self, key, source):
+        """
+        Puts a produced AudioSource into the cache. Returns it if it can be
+        shared, the _Download for a URL, else True (read it back from disk).
+        """
+        if source.data is not None:
+            self.put(key, source.data, source.mime)
+            return source
+        if source.path is not None:
+            tmp = self._tmp_path(key)
+            shutil.copyfile(source.path, tmp)
+            self._disk_commit(key, tmp, source.mime)
+            return True
+        download = _Download(self, key, source)
+        with self._lock:
+            self._downloads[key] = download
+        download.start()
+        return download
+
+    def open_writer(self, key, mime):
+        """Incremental writer into the disk tier; see _DiskWriter."""
+        return _DiskWriter(self, key, mime)
+
+    def warmup(self, phrases, key_fn, producer_fn):
+        """
+        Preloads phrases into the cache. key_fn(text) builds the cache key and
+        producer_fn(text) returns (audio_bytes, mime). Failures are logged and skipped.
+        """
+        for text in phrases:
+            try:
+                self.get_or_create(key_fn(text), lambda t=text: producer_fn(t))
+            except Exception as e:
+                print(f"TTS warm-up failed for {text!r}: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "memory_entries": len(self._lru),
+                "memory_bytes": self._memory_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
+
+
+class _DiskWriter:
+    """
+    Writes a cache entry chunk by chunk (e.g. while downloading a URL result)
+    into <key>.<id>.tmp, flushed per chunk so readers can follow it. The
+    entry only becomes visible on commit() (os.replace); abort() discards it.
+    """
+
+    def __init__(self, cache, key, mime):
+        self.cache = cache
+        self.key = key
+        self.mime = mime
+        self.tmp = cache._tmp_path(key)
+        self.f = open(self.tmp, "wb")
+
+    def write(self, chunk):
+        self.f.write(chunk)
+        self.f.flush()
+
+    def commit(self):
+        """Publishes the entry; returns its path."""
+        self.f.close()
+        return self.cache._disk_commit(self.key, self.tmp, self.mime)
+
+    def abort(self):
+        self.f.close()
+        self.tmp.unlink(missing_ok=True)
+
+
+class _Download:
+    """
+    A URL result being written into the disk tier by a background thread.
+    Each caller streams it through its own reader, which follows the file as
+    it grows: the URL is fetched once, and nobody waits for the whole file
+    before sending the first bytes.
+    """
+
+    def __init__(self, cache, key, source):
+        self.cache = cache
+        self.key = key
+        self.upstream = source.open_url()  # errors here reach every coalesced caller
+        self.mime = self.upstream.headers.get("Content-Type") or source.mime
+        length = self.upstream.headers.get("Content-Length")
+        self.length = int(length) if length else None
+        self.writer = cache.open_writer(key, self.mime)
+        self.path = self.writer.tmp  # the committed path once done
+        self.written = 0
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            for chunk in self.upstream.iter_content(CHUNK_SIZE):
+                self.writer.write(chunk)
+                with self._cond:
+                    self.written += len(chunk)
+                    self._cond.notify_all()
+            with self._cond:  # readers open whichever path is current
+                self.path = self.writer.commit()
+        except Exception as e:
+            with self._cond:
+                self.writer.abort()
+                self.error = e
+        finally:
+            self.upstream.close()
+            with self.cache._lock:  # committed (or failed): later callers go to the disk tier
+                self.cache._downloads.pop(self.key, None)
+            with self._cond:
+                self.done = True
+                self._cond.notify_all()
+
+    def source(self):
+        return AudioSource(self.mime, stream=self.iter_chunks(), length=self.length)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        with self._cond:
+            if self.error is not None:
+                raise self.error
+            f = open(self.path, "rb")
+        with f:
+            sent = 0
+            while True:
+                chunk = f.read(chunk_size)
+                if chunk:
+                    sent += len(chunk)
+                    yield chunk
+                    continue
+                with self._cond:
+                    while sent >= self.written and not self.done:
+                        self._cond.wait()
+                    if self.error is not None:
+                        raise self.error
+                    if self.done and sent >= self.written:
+                        return
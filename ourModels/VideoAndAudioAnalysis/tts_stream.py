@@ -0,0 +1,128 @@
+import io
+import re
+import struct
+import subprocess
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+# ---------- CONFIG: change only if needed ----------
+STREAM_SAMPLE_RATE = 24000   # Chatterbox native rate; every chunk is converted to this
+STREAM_CHANNELS = 1
+STREAM_SAMPWIDTH = 2         # 16-bit PCM
+MAX_PARALLEL = 2             # concurrent sentence generations per request
+MAX_CHUNK_CHARS = 300        # longer sentences are split again at commas
+MIN_CHUNK_CHARS = 20         # shorter sentences are merged into the next one
+# ---------------------------------------------------
+
+_SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+_CLAUSE_END = re.compile(r"(?<=[,;:])\s+")
+
+
+def split_sentences(text, max_chars=MAX_CHUNK_CHARS, min_chars=MIN_CHUNK_CHARS):
+    """
+    Splits text into synthesis chunks at sentence boundaries.
+    Very short sentences ("Okay.") are merged forward so each call carries
+    enough context for natural prosody; overly long ones are split at clauses.
+    """
+    pieces = []
+    for sentence in _SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        part = ""
+        for clause in _CLAUSE_END.split(sentence):
+            if part and len(part) + len(clause) + 1 > max_chars:
+                pieces.append(part)
+                part = clause
+            else:
+                part = f"{part} {clause}".strip()
+        if part:
+            pieces.append(part)
+
+    chunks = []
+    pending = ""
+    for piece in pieces:
+        pending = f"{pending} {piece}".strip()
+        if len(pending) >= min_chars:
+            chunks.append(pending)
+            pending = ""
+    if pending:
+        if chunks:
+            chunks[-1] = f"{chunks[-1]} {pending}"
+        else:
+            chunks.append(pending)
+    return chunks
+
+
+def wav_stream_header(sample_rate=STREAM_SAMPLE_RATE, channels=STREAM_CHANNELS, sampwidth=STREAM_SAMPWIDTH):
+    """
+    RIFF/WAVE header for a stream of unknown length (sizes set to 0xFFFFFFFF,
+    which browsers and ffmpeg treat as "read until EOF").
+    """
+    byte_rate = sample_rate * channels * sampwidth
+    return b"".join([
+        b"RIFF", struct.pack("<I", 0xFFFFFFFF), b"WAVE",
+        b"fmt ", struct.pack("<IHHIIHH", 16, 1, channels, sample_rate, byte_rate, channels * sampwidth, sampwidth * 8),
+        b"data", struct.pack("<I", 0xFFFFFFFF),
+    ])
+
+
+def to_pcm(audio_bytes, sample_rate=STREAM_SAMPLE_RATE, channels=STREAM_CHANNELS, sampwidth=STREAM_SAMPWIDTH):
+    """
+    Returns raw PCM frames in the stream format. WAV input that already matches
+    is passed through; anything else (other rate, MP3, ...) goes through ffmpeg.
+    """
+    try:
+        with wave.open(io.BytesIO(audio_bytes), "rb") as w:
+            if (w.getframerate(), w.getnchannels(), w.getsampwidth()) == (sample_rate, channels, sampwidth):
+                return w.readframes(w.getnframes())
+    except (wave.Error, EOFError):
+        pass
+
+    command = [
+        "ffmpeg", "-hide_banner", "-loglevel", "error",
+        "-i", "pipe:0",
+        "-f", f"s{sampwidth * 8}le", "-ar", str(sample_rate), "-ac", str(channels),
+        "pipe:1",
+    ]
+    proc = subprocess.run(command, input=audio_bytes, capture_output=True, check=True)
+    return proc.stdout
+
+
+def synthesize_stream(text, synth_fn, max_parallel=MAX_PARALLEL):
+    """
+    Generator yielding a streamed WAV for text: the header with the first
+    sentence, then each sentence's PCM in order as soon as it (and every
+    sentence before it) is ready.
+
+    synth_fn(sentence) -> (audio_bytes, mime). At most max_parallel sentences are
+    generated at once, and only that many results are held ahead of the client.
+    """
+    chunks = split_sentences(text)
+    executor = ThreadPoolExecutor(max_workers=max_parallel)
+    futures = []
+    try:
+        submitted = 0
+        while submitted < min(max_parallel, len(chunks)):
+            futures.append(executor.submit(synth_fn, chunks[submitted]))
+            submitted += 1
+
+        for i in range(len(chunks)):
+            audio_bytes, _ = futures[i].result()
+            futures[i] = None  # release the finished chunk
+            if submitted < len(chunks):
+                futures.append(executor.submit(synth_fn, chunks[submitted]))
+                submitted += 1
+            pcm = to_pcm(audio_bytes)
+            # header goes out with the first sentence, so a failure before any
+            # audio exists can still be reported as a normal error response
+            yield wav_stream_header() + pcm if i == 0 else pcm
+    finally:
+        # client went away or a chunk failed: don't keep generating
+        for f in futures:
+            if f is not None:
+                f.cancel()
+        executor.shutdown(wait=False, cancel_futures=True)
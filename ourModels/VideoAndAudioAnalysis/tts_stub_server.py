@@ -0,0 +1,51 @@
+"""
+Local stand-in for the TTS Space. Returns a deterministic sine-tone WAV whose
+length scales with the text, so /synthesize can be exercised without network.
+
+Usage:
+    python tts_stub_server.py
+    TTS_BACKEND=http TTS_BACKEND_URL=http://127.0.0.1:5200/synthesize python main_api.py
+"""
+
+import io
+import math
+import struct
+import wave
+
+from flask import Flask, Response, jsonify, request
+
+app = Flask(__name__)
+PORT = 5200
+
+SAMPLE_RATE = 24000
+SECONDS_PER_CHAR = 0.06
+
+
+def tone_wav(text, sr=SAMPLE_RATE):
+    """Mono int16 WAV, one tone per text (pitch derived from the text)."""
+    n = max(1, int(len(text) * SECONDS_PER_CHAR * sr))
+    freq = 200 + (sum(map(ord, text)) % 400)
+    frames = b"".join(
+        struct.pack("<h", int(8000 * math.sin(2 * math.pi * freq * i / sr))) for i in range(n)
+    )
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sr)
+        w.writeframes(frames)
+    return buf.getvalue()
+
+
+@app.route("/synthesize", methods=["POST", "HEAD"])
+def synthesize():
+    if request.method == "HEAD":
+        return "", 200
+    text = (request.get_json() or {}).get("text", "").strip()
+    if not text:
+        return jsonify({"error": "text required"}), 400
+    return Response(tone_wav(text), mimetype="audio/wav")
+
+
+if __name__ == "__main__":
+    app.run(host="127.0.0.1", port=PORT, debug=False)
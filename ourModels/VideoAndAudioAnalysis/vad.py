@@ -0,0 +1,141 @@
+"""
+Energy-based voice activity detection.
+
+Therapy recordings are mostly silence; only the voiced parts need to go
+through Whisper, wav2vec2 or YIN. gate_silence() finds voiced segments from
+frame RMS (or reuses an RMS track that was already computed, e.g.
+librosa.feature.rms), trims leading/trailing silence, drops internal pauses
+longer than MAX_PAUSE_MS and returns the voiced samples joined with short
+gaps. VoicedAudio.to_original() maps a time in the gated audio back to the
+original recording.
+"""
+
+import bisect
+import os
+
+import numpy as np
+
+# ---------- CONFIG: change only if needed ----------
+VAD_ENABLED = os.getenv("VAD_ENABLED", "1") == "1"
+FRAME_MS = 25
+HOP_MS = 10
+MARGIN_DB = 12           # voiced = this much above the noise floor (10th percentile)...
+ABS_FLOOR_DB = -55       # ...and above this absolute level (full scale = 0 dB)
+MIN_HEADROOM_DB = 15     # the threshold never sits closer than this to the loudest frame
+MIN_SPEECH_MS = 200      # shorter bursts (clicks, breaths) are dropped
+MAX_PAUSE_MS = 500       # pauses up to this long stay inside a segment
+PAD_MS = 150             # context kept around each segment
+GAP_MS = 100             # silence inserted between joined segments
+# ---------------------------------------------------
+
+
+def frame_rms(audio, frame_length, hop_length):
+    """RMS per frame in O(n) memory (running sum of squares, no frame matrix)."""
+    audio = np.asarray(audio, dtype=np.float64)
+    if len(audio) < frame_length:
+        audio = np.pad(audio, (0, frame_length - len(audio)))
+    energy = np.concatenate([[0.0], np.cumsum(audio * audio)])
+    starts = np.arange(0, len(audio) - frame_length + 1, hop_length)
+    return np.sqrt((energy[starts + frame_length] - energy[starts]) / frame_length)
+
+
+def detect_speech(audio, sr, rms=None, hop_length=None, frame_length=None, center=False):
+    """
+    Voiced (start, end) sample ranges of `audio`. Pass `rms`/`hop_length`/
+    `frame_length` to reuse an RMS track (one value per hop; center=True for
+    librosa's default centered frames); hop_length is required with rms.
+    """
+    if rms is None:
+        hop_length = int(sr * HOP_MS / 1000)
+        frame_length = int(sr * FRAME_MS / 1000)
+        rms = frame_rms(audio, frame_length, hop_length)
+    elif not hop_length:
+        raise ValueError("detect_speech: pass the hop_length the rms track was computed with")
+    frame_length = frame_length or hop_length
+    if len(rms) == 0:
+        return []
+
+    db = 20 * np.log10(np.asarray(rms, dtype=np.float64) + 1e-10)
+    peak = db.max()
+    threshold = min(max(np.percentile(db, 10) + MARGIN_DB, ABS_FLOOR_DB), peak - MIN_HEADROOM_DB)
+    voiced = db > threshold
+    if not voiced.any() or peak < ABS_FLOOR_DB:
+        return []
+
+    # runs of voiced frames -> sample ranges
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], voiced.astype(np.int8), [0]])))
+    offset = frame_length // 2 if center else 0
+    runs = [(max(0, int(s) * hop_length - offset), min(len(audio), (int(e) - 1) * hop_length + frame_length - offset))
+            for s, e in zip(edges[::2], edges[1::2])]
+
+    max_pause = int(sr * MAX_PAUSE_MS / 1000)
+    merged = [list(runs[0])]
+    for start, end in runs[1:]:
+        if start - merged[-1][1] <= max_pause:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+
+    min_speech = int(sr * MIN_SPEECH_MS / 1000)
+    pad = int(sr * PAD_MS / 1000)
+    segments = []
+    for start, end in merged:
+        if end - start < min_speech:
+            continue
+        start, end = max(0, start - pad), min(len(audio), end + pad)
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    return segments
+
+
+class VoicedAudio:
+    """Voiced samples joined together, plus the mapping back to the original timeline."""
+
+    def __init__(self, audio, sr, segments, gap_ms=GAP_MS):
+        self.sr = sr
+        self.segments = segments
+        gap = np.zeros(int(sr * gap_ms / 1000), dtype=audio.dtype)
+        parts, self._starts, self._orig_starts = [], [], []
+        position = 0
+        for i, (start, end) in enumerate(segments):
+            if i:
+                parts.append(gap)
+                position += len(gap)
+            self._starts.append(position)
+            self._orig_starts.append(start)
+            parts.append(audio[start:end])
+            position += end - start
+        self.audio = np.concatenate(parts) if parts else audio[:0]
+
+    @property
+    def has_speech(self):
+        return len(self.audio) > 0
+
+    @property
+    def duration(self):
+        return len(self.audio) / self.sr
+
+    def to_original(self, seconds):
+        """Time in the gated audio -> time in the original recording."""
+        sample = int(seconds * self.sr)
+        i = max(0, bisect.bisect_right(self._starts, sample) - 1)
+        if not self._starts:
+            return seconds
+        return (self._orig_starts[i] + sample - self._starts[i]) / self.sr
+
+    def segment_times(self):
+        """[(start_s, end_s)] of the voiced segments in the original recording."""
+        return [(round(float(s) / self.sr, 3), round(float(e) / self.sr, 3)) for s, e in self.segments]
+
+
+def gate_silence(audio, sr, rms=None, hop_length=None, frame_length=None, center=False):
+    """
+    VoicedAudio for `audio`. With VAD_ENABLED=0 the whole clip is one segment.
+    Returns an empty VoicedAudio (has_speech False) for silent input.
+    """
+    audio = np.asarray(audio)
+    if not VAD_ENABLED:
+        return VoicedAudio(audio, sr, [(0, len(audio))] if len(audio) else [])
+    return VoicedAudio(audio, sr, detect_speech(audio, sr, rms, hop_length, frame_length, center))
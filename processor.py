@@ -6,13 +6,22 @@ from flask import Flask, request, jsonify
 import assemblyai as aai
 from dotenv import load_dotenv
 import os
+import sys
 import cv2
 from deepface import DeepFace
 import subprocess
 from transformers import pipeline
 
+# shared metrics/profiling helpers live next to main_api.py
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ourModels", "VideoAndAudioAnalysis"))
+from service_metrics import install_metrics, stage, model_forward, model_load
+from request_profiler import install_profiler
+from vad import gate_silence
+
     
 app = Flask(__name__)
+install_metrics(app)
+install_profiler(app, paths=("/analyze-audio", "/analyze-video"))
 
 def convert_webm_to_mp4(input_path: str, output_path: str):
     """
@@ -51,14 +60,29 @@ def process_audio_file(audio_file, sr_target=22050, hop_length=512):
     """
     
     # sentiment analysis model
-    classifier = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english") 
+    with model_load("sentiment"):
+        classifier = pipeline("sentiment-analysis", model="distilbert-base-uncased-finetuned-sst-2-english") 
     
     
     # Load the audio file using librosa
-    audio, sr = librosa.load(audio_file, sr=sr_target)
+    with stage("decode"):
+        audio, sr = librosa.load(audio_file, sr=sr_target)
     
+    # Compute RMS intensity over time
+    with stage("intensity"):
+        rms = librosa.feature.rms(y=audio, hop_length=hop_length)[0]
+    # time_intensity = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
+    average_intensity = np.mean(rms)
+
+    # Voiced parts only (the RMS track above doubles as the VAD input)
+    voiced = gate_silence(audio, sr, rms=rms, hop_length=hop_length, frame_length=2048, center=True)
+
     # Estimate pitch using librosa.yin in the desired range (50-3000 Hz)
-    pitches = librosa.yin(audio, fmin=50, fmax=3000, sr=sr, hop_length=hop_length)
+    with stage("pitch"):
+        if voiced.has_speech:
+            pitches = librosa.yin(voiced.audio, fmin=50, fmax=3000, sr=sr, hop_length=hop_length)
+        else:
+            pitches = np.array([])
     # time_pitch = librosa.frames_to_time(np.arange(len(pitches)), sr=sr, hop_length=hop_length)
     
     # Remove NaN values from pitch estimates (unvoiced frames)
@@ -75,11 +99,6 @@ def process_audio_file(audio_file, sr_target=22050, hop_length=512):
         min_pitch = np.min(valid_pitches)
         max_pitch = np.percentile(valid_pitches, 95)
     
-    # Compute RMS intensity over time
-    rms = librosa.feature.rms(y=audio, hop_length=hop_length)[0]
-    # time_intensity = librosa.frames_to_time(np.arange(len(rms)), sr=sr, hop_length=hop_length)
-    average_intensity = np.mean(rms)
-    
     # Get the transcript using speech recognition
     # transcript = get_transcript(audio_file)
     
@@ -89,7 +108,11 @@ def process_audio_file(audio_file, sr_target=22050, hop_length=512):
     aai.settings.api_key = API_KEY
     transcriber = aai.Transcriber()
 
-    transcript = transcriber.transcribe(audio_file)
+    with stage("transcription"):
+        transcript = transcriber.transcribe(audio_file)
+
+    with stage("sentiment"), model_forward("sentiment"):
+        sentiment = classifier(transcript.text)[0]
     
     # Package all the results into a dictionary
     results = {
@@ -104,8 +127,8 @@ def process_audio_file(audio_file, sr_target=22050, hop_length=512):
     "max_pitch": round(float(max_pitch), 2),
     "average_intensity": round(float(average_intensity), 2),
     "sentiment": {
-        "label":classifier(transcript.text)[0]['label'],
-        "score":classifier(transcript.text)[0]['score']
+        "label":sentiment['label'],
+        "score":sentiment['score']
     },
     "transcript": transcript.text,
 }
@@ -122,7 +145,8 @@ def analyze_audio():
 
     file = request.files['file']
     filepath = "./temp/temp_audio.wav"
-    file.save(filepath)
+    with stage("save"):
+        file.save(filepath)
 
     # Process the uploaded audio file
     results = process_audio_file(filepath)
@@ -143,14 +167,16 @@ def analyze_video():
     # Save the uploaded file as WebM.
     webm_path = "./temp/temp_video.webm"
     mp4_path = "./temp/temp_video.mp4"
-    file.save(webm_path)
+    with stage("save"):
+        file.save(webm_path)
 
     try:
         # Convert the WebM file to MP4.
         if file.filename.endswith('.mp4'):
             mp4_path = webm_path
         else:
-            convert_webm_to_mp4(webm_path, mp4_path)
+            with stage("convert"):
+                convert_webm_to_mp4(webm_path, mp4_path)
     except subprocess.CalledProcessError as e:
         return jsonify({"error": "Video conversion failed", "details": str(e)}), 500
 
@@ -168,19 +194,21 @@ def analyze_video():
     frame_indices = np.random.choice(frame_count, size=min(20, frame_count), replace=False)
     emotions = []
 
-    for idx in frame_indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ret, frame = cap.read()
-        if not ret:
-            continue
-        try:
-            result = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False)
-            # Adjust based on whether result is a list or dict.
-            dominant_emotion = result[0]['dominant_emotion'] if isinstance(result, list) else result['dominant_emotion']
-            emotions.append(dominant_emotion)
-        except Exception as e:
-            print("Error analyzing frame:", e)
-            continue
+    with stage("face"):
+        for idx in frame_indices:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
+            ret, frame = cap.read()
+            if not ret:
+                continue
+            try:
+                with model_forward("deepface"):
+                    result = DeepFace.analyze(frame, actions=['emotion'], enforce_detection=False)
+                # Adjust based on whether result is a list or dict.
+                dominant_emotion = result[0]['dominant_emotion'] if isinstance(result, list) else result['dominant_emotion']
+                emotions.append(dominant_emotion)
+            except Exception as e:
+                print("Error analyzing frame:", e)
+                continue
 
     cap.release()
 